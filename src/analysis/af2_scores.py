@@ -0,0 +1,184 @@
+import os
+import sys
+import numpy as np
+
+from design_names import extract_base_design_name
+
+# Parsed score files are cached next to the source as <file>.cache.npz and
+# reused while the source's mtime and size are unchanged. Bump the version
+# whenever the parsed layout changes.
+SCORE_CACHE_VERSION = 1
+STRING_COLUMNS = ('description',)
+
+def parse_score_lines(lines, header=None):
+    # Parse AF2 'SCORE:' lines into (header, tokens) segments. A header line
+    # may reappear when several runs append to the same file; rows always
+    # belong to the most recent header. Returns the segments and the last
+    # header seen, so a caller reading a file incrementally can resume.
+    segments = []
+    rows = None
+    for line in lines:
+        if not line.startswith('SCORE:'):
+            continue
+        parts = line.split()[1:]  # Skip 'SCORE:'
+        if 'description' in parts:
+            if parts != header or rows is None:
+                header = parts
+                rows = []
+                segments.append((header, rows))
+            continue
+        if header is None:
+            continue  # Data line before any header
+        if len(parts) < len(header):
+            continue  # Incomplete line, e.g. a run killed mid-write
+        if rows is None:
+            rows = []
+            segments.append((header, rows))
+        rows.append(parts[:len(header)])
+    return segments, header
+
+def _segments_to_columns(segments):
+    names = []
+    for header, _ in segments:
+        for name in header:
+            if name not in names:
+                names.append(name)
+
+    columns = {}
+    for name in names:
+        values = []
+        for header, rows in segments:
+            if name in header:
+                index = header.index(name)
+                values.extend(row[index] for row in rows)
+            else:
+                values.extend([None] * len(rows))
+        if name in STRING_COLUMNS:
+            columns[name] = np.array(['' if v is None else v for v in values], dtype=str)
+            continue
+        try:
+            columns[name] = np.array(['nan' if v is None else v for v in values], dtype=np.float64)
+        except ValueError:
+            columns[name] = np.array(['' if v is None else v for v in values], dtype=str)
+    return columns
+
+class ScoreTable:
+    # Column-oriented view of one or more AF2 score files. Columns are NumPy
+    # arrays (float64 for metrics, str for description); rows can be looked up
+    # by description or by normalized design name.
+
+    def __init__(self, columns):
+        self.columns = columns
+        if 'description' not in columns:
+            columns['description'] = np.array([], dtype=str)
+        self.descriptions = columns['description']
+        self.by_description = {}
+        self.by_design = {}
+        for index, description in enumerate(self.descriptions.tolist()):
+            self.by_description[description] = index  # Later rows win, as in the old parsers
+            self.by_design.setdefault(extract_base_design_name(description), []).append(index)
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def column(self, name):
+        return self.columns[name]
+
+    def row(self, index):
+        return {name: values[index].item() for name, values in self.columns.items()}
+
+    def get(self, description, default=None):
+        index = self.by_description.get(description)
+        return default if index is None else self.row(index)
+
+    def rows_for_design(self, design_name):
+        return [self.row(index) for index in self.by_design.get(design_name, [])]
+
+    def select(self, mask):
+        return ScoreTable({name: values[mask] for name, values in self.columns.items()})
+
+def _cache_path(score_path):
+    return score_path + '.cache.npz'
+
+def _read_cache(score_path, stat):
+    try:
+        with np.load(_cache_path(score_path), allow_pickle=False) as cached:
+            if (int(cached['_version']) != SCORE_CACHE_VERSION or
+                    int(cached['_mtime_ns']) != stat.st_mtime_ns or
+                    int(cached['_size']) != stat.st_size):
+                return None
+            return {name: cached[name] for name in cached.files if not name.startswith('_')}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _write_cache(score_path, stat, columns):
+    tmp_path = f"{_cache_path(score_path)}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as cache_file:
+            np.savez(cache_file, _version=SCORE_CACHE_VERSION, _mtime_ns=stat.st_mtime_ns,
+                     _size=stat.st_size, **columns)
+        os.replace(tmp_path, _cache_path(score_path))
+    except OSError:
+        # A read-only score directory just means no cache
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_score_columns(score_path, use_cache=True):
+    stat = os.stat(score_path)
+    if use_cache:
+        columns = _read_cache(score_path, stat)
+        if columns is not None:
+            return columns
+
+    with open(score_path, 'r') as score_file:
+        segments, _ = parse_score_lines(score_file)
+    columns = _segments_to_columns(segments)
+
+    if use_cache:
+        _write_cache(score_path, stat, columns)
+    return columns
+
+def load_scores(score_paths, use_cache=True):
+    # Load one score file or a list of them (e.g. one per round) into a single
+    # ScoreTable. Rows from later files win on duplicate descriptions.
+    if isinstance(score_paths, str):
+        score_paths = [score_paths]
+
+    tables = [load_score_columns(path, use_cache) for path in score_paths]
+    if len(tables) == 1:
+        return ScoreTable(tables[0])
+
+    names = []
+    for columns in tables:
+        for name in columns:
+            if name not in names:
+                names.append(name)
+    merged = {}
+    for name in names:
+        parts = []
+        for columns in tables:
+            n_rows = len(columns['description']) if 'description' in columns else 0
+            if name in columns:
+                parts.append(columns[name])
+            elif name in STRING_COLUMNS:
+                parts.append(np.full(n_rows, '', dtype=str))
+            else:
+                parts.append(np.full(n_rows, np.nan))
+        if any(part.dtype.kind == 'U' for part in parts) and name not in STRING_COLUMNS:
+            parts = [part.astype(str) for part in parts]
+        merged[name] = np.concatenate(parts)
+    return ScoreTable(merged)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python af2_scores.py <score_file> [<score_file> ...]")
+        sys.exit(1)
+
+    scores = load_scores(sys.argv[1:])
+    print(f"{len(scores)} rows, {len(scores.by_design)} designs")
+    for name, values in scores.columns.items():
+        if values.dtype.kind == 'f':
+            print(f"  {name:<22} mean {np.nanmean(values):10.3f}  min {np.nanmin(values):10.3f}  max {np.nanmax(values):10.3f}")
@@ -1,40 +1,54 @@
 import os
 import sys
+import time
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import MDAnalysis as mda
 from MDAnalysis.analysis import align
 from MDAnalysis.core.universe import Merge
 
+from design_names import extract_base_design_name
+from design_registry import design_id, scan_designs, build_registry
+from triage import load_keep_list
+import telemetry
+
 def align_and_write(pdb1_path, pdb2_path, cd20_path, output_pdb_path):
+    design = os.path.splitext(os.path.basename(pdb1_path))[0]
+
     # Load the PDB files into MDAnalysis Universes
-    u_rf = mda.Universe(pdb1_path, guess_bonds=False, topology_format='PDB', guess_element=True)
-    u_af = mda.Universe(pdb2_path, guess_bonds=False, topology_format='PDB', guess_element=True)
-    u_cd20 = mda.Universe(cd20_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+    with telemetry.timed('align.parse', design=design):
+        u_rf = mda.Universe(pdb1_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+        u_af = mda.Universe(pdb2_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+        u_cd20 = mda.Universe(cd20_path, guess_bonds=False, topology_format='PDB', guess_element=True)
     
-    # Align chain A from PDB2 to chain A from PDB1 using backbone atoms
-    chainA_rf = u_rf.select_atoms("chainID A")  # Chain A from PDB1 (reference)
-    chainA_af = u_af.select_atoms("chainID A")  # Chain A from PDB2 (mobile)
+    with telemetry.timed('align.superpose', design=design):
+        # Align chain A from PDB2 to chain A from PDB1 using backbone atoms
+        chainA_rf = u_rf.select_atoms("chainID A")  # Chain A from PDB1 (reference)
+        chainA_af = u_af.select_atoms("chainID A")  # Chain A from PDB2 (mobile)
 
-    align.alignto(chainA_af, chainA_rf, select="backbone")
-    
-    # Align protein parts of chains C and D from cd20_path to chain B from PDB1 using backbone atoms
-    chainB_rf = u_rf.select_atoms("chainID B")  # Chain B from PDB1 (reference)
-    
-    # Select only protein residues from chains C and D in cd20_path
-    chainsCD_cd20 = u_cd20.select_atoms("(chainID C or chainID D) and protein")
-    
-    # Align the protein parts of chains C and D to chain B of PDB1 using backbone atoms
-    align.alignto(chainsCD_cd20, chainB_rf, select="backbone")
-    
-    # Merge the aligned chain A from PDB2 and the aligned protein parts of chains C and D from cd20_path
-    merged = Merge(chainA_af, chainsCD_cd20)
-    
-    # Write the merged structure to the output PDB file
-    merged.atoms.write(output_pdb_path)
+        align.alignto(chainA_af, chainA_rf, select="backbone")
+        
+        # Align protein parts of chains C and D from cd20_path to chain B from PDB1 using backbone atoms
+        chainB_rf = u_rf.select_atoms("chainID B")  # Chain B from PDB1 (reference)
+        
+        # Select only protein residues from chains C and D in cd20_path
+        chainsCD_cd20 = u_cd20.select_atoms("(chainID C or chainID D) and protein")
+        
+        # Align the protein parts of chains C and D to chain B of PDB1 using backbone atoms
+        align.alignto(chainsCD_cd20, chainB_rf, select="backbone")
+        
+        # Merge the aligned chain A from PDB2 and the aligned protein parts of chains C and D from cd20_path
+        merged = Merge(chainA_af, chainsCD_cd20)
+        
+        # Write the merged structure to the output PDB file
+        merged.atoms.write(output_pdb_path)
     
     print(f"Aligned PDB written to {output_pdb_path}")
 
 def find_matching_af_pdb(af_folder, base_name):
-    matching_files = [f for f in os.listdir(af_folder) if f.startswith(base_name) and f.endswith('.pdb')]
+    # Exact design-ID match: binder_design_1 does not match binder_design_10's prediction
+    matching_files = [f for f in os.listdir(af_folder) if f.endswith('.pdb') and design_id(f) == base_name]
     
     if len(matching_files) == 0:
         raise FileNotFoundError(f"No matching AF2 PDB file found for {base_name} in {af_folder}")
@@ -43,14 +57,135 @@ def find_matching_af_pdb(af_folder, base_name):
     
     return matching_files[0]
 
-def process_folders(rf_folder, af_folder, cd20_path, output_folder):
-    rf_files = {f for f in os.listdir(rf_folder) if f.endswith('.pdb')}
+def index_af_folder(af_folder, keep=None):
+    # {design ID: AF2 PDB names} from a single listing of the folder, so each
+    # lookup is a dict access instead of a scan. With a keep set (see
+    # triage.py) only the kept predictions are listed.
+    return scan_designs(af_folder, keep=keep)
+
+def triaged_rf_files(rf_files, keep):
+    # Split RFdiffusion files into those with a kept AF2 prediction and the
+    # number left out by triage
+    if keep is None:
+        return rf_files, 0
+    kept_backbones = {extract_base_design_name(description) for description in keep}
+    selected = [f for f in rf_files if design_id(f) in kept_backbones]
+    return selected, len(rf_files) - len(selected)
+
+def find_matching_af_pdb_indexed(af_index, af_folder, base_name):
+    matching_files = af_index.get(base_name, [])
+
+    if len(matching_files) == 0:
+        raise FileNotFoundError(f"No matching AF2 PDB file found for {base_name} in {af_folder}")
+    elif len(matching_files) > 1:
+        raise Exception(f"Multiple matching AF2 PDB files found for {base_name} in {af_folder}: {matching_files}")
+
+    return matching_files[0]
+
+# Per-worker CD20 target, parsed once by _init_worker and reused for every design
+_cd20_target = None
+
+def _init_worker(cd20_path):
+    global _cd20_target
+    u_cd20 = mda.Universe(cd20_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+    _cd20_target = u_cd20.select_atoms("(chainID C or chainID D) and protein")
+
+def align_to_target(pdb1_path, pdb2_path, chainsCD_cd20, output_pdb_path):
+    # Same as align_and_write, but with the CD20 selection supplied by the caller.
+    # alignto superimposes from whatever pose the target is currently in, so the
+    # selection can be reused across designs.
+    design = os.path.splitext(os.path.basename(pdb1_path))[0]
+    with telemetry.timed('align.parse', design=design):
+        u_rf = mda.Universe(pdb1_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+        u_af = mda.Universe(pdb2_path, guess_bonds=False, topology_format='PDB', guess_element=True)
+
+    with telemetry.timed('align.superpose', design=design):
+        chainA_rf = u_rf.select_atoms("chainID A")
+        chainA_af = u_af.select_atoms("chainID A")
+        align.alignto(chainA_af, chainA_rf, select="backbone")
+
+        chainB_rf = u_rf.select_atoms("chainID B")
+        align.alignto(chainsCD_cd20, chainB_rf, select="backbone")
+
+        merged = Merge(chainA_af, chainsCD_cd20)
+        merged.atoms.write(output_pdb_path)
+
+def _align_chunk(jobs):
+    results = []
+    for base_name, rf_pdb_path, af_pdb_path, output_pdb_path in jobs:
+        try:
+            align_to_target(rf_pdb_path, af_pdb_path, _cd20_target, output_pdb_path)
+            results.append((base_name, None))
+        except Exception as e:
+            results.append((base_name, f"{type(e).__name__}: {e}"))
+    return results
+
+def process_folders_parallel(rf_folder, af_folder, cd20_path, output_folder,
+                             workers=None, chunk_size=16, summary_path=None, keep=None):
+    start_time = time.time()
+    os.makedirs(output_folder, exist_ok=True)
+
+    af_index = index_af_folder(af_folder, keep)
+    rf_files, triaged = triaged_rf_files(sorted(f for f in os.listdir(rf_folder) if f.endswith('.pdb')), keep)
+
+    failures = {}
+    jobs = []
+    for rf_file in rf_files:
+        base_name = design_id(rf_file)
+        try:
+            matching_af_file = find_matching_af_pdb_indexed(af_index, af_folder, base_name)
+        except Exception as e:
+            failures[base_name] = str(e)
+            continue
+        jobs.append((
+            base_name,
+            os.path.join(rf_folder, rf_file),
+            os.path.join(af_folder, matching_af_file),
+            os.path.join(output_folder, f"{base_name}_aligned.pdb"),
+        ))
+
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    aligned = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cd20_path,)) as executor:
+        for chunk_results in executor.map(_align_chunk, chunks):
+            for base_name, error in chunk_results:
+                if error is None:
+                    aligned += 1
+                else:
+                    failures[base_name] = error
+
+    elapsed = time.time() - start_time
+    summary = {
+        'rf_designs': len(rf_files) + triaged,
+        'aligned': aligned,
+        'failed': len(failures),
+        'triaged': triaged,
+        'elapsed_s': round(elapsed, 3),
+        'designs_per_s': round(aligned / elapsed, 3) if elapsed > 0 else None,
+        'failures': failures,
+    }
+
+    print(f"Aligned {aligned}/{len(rf_files) + triaged} designs in {elapsed:.1f} s "
+          f"({summary['designs_per_s']} designs/s), {len(failures)} failed"
+          + (f", {triaged} left out by the keep-list" if keep is not None else ""))
+    if summary_path:
+        with open(summary_path, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=1)
+        print(f"Alignment summary written to {summary_path}")
+    else:
+        for base_name, error in sorted(failures.items()):
+            print(f"  {base_name}: {error}")
+    return summary
+
+def process_folders(rf_folder, af_folder, cd20_path, output_folder, keep=None):
+    rf_files, _ = triaged_rf_files([f for f in os.listdir(rf_folder) if f.endswith('.pdb')], keep)
+    af_index = index_af_folder(af_folder, keep)
     
     for rf_file in rf_files:
-        base_name = rf_file.split('.')[0]  # e.g., binder_design_0
+        base_name = design_id(rf_file)  # e.g., binder_design_0
         
         try:
-            matching_af_file = find_matching_af_pdb(af_folder, base_name)
+            matching_af_file = find_matching_af_pdb_indexed(af_index, af_folder, base_name)
         except Exception as e:
             print(e)
             continue
@@ -69,21 +204,53 @@ def process_folders(rf_folder, af_folder, cd20_path, output_folder):
             print(f"Error processing {base_name}: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: python align.py <rf_folder> <af_folder> <cd20_path> <output_folder>")
+    parser = argparse.ArgumentParser(description="Align AF2 binders onto their RFdiffusion backbones together with CD20")
+    parser.add_argument("rf_folder", help="RFdiffusion PDB folder (or a single RFdiffusion PDB)")
+    parser.add_argument("af_folder", help="AF2 PDB folder (or the single matching AF2 PDB)")
+    parser.add_argument("cd20_path")
+    parser.add_argument("output_folder", help="Output folder (or the output PDB path when aligning a single design)")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Align across a process pool, loading the CD20 target once per worker")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (parallel mode)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Designs handed to a worker at a time")
+    parser.add_argument("--summary", default=None, help="Write the throughput/failure summary to this JSON file")
+    parser.add_argument("--keep-list", default=None,
+                        help="Only align AF2 predictions listed in this file (written by triage.py)")
+    parser.add_argument("--registry", default=None,
+                        help="Record the RF, AF2 and aligned PDBs in this design registry (see design_registry.py)")
+    args = parser.parse_args()
+
+    rf_folder = args.rf_folder
+    af_folder = args.af_folder
+    cd20_path = args.cd20_path
+    output_folder = args.output_folder
+
+    if not os.path.isfile(cd20_path):
+        print(f"Error: CD20 PDB file not found: {cd20_path}")
         sys.exit(1)
-    
-    rf_folder = sys.argv[1]
-    af_folder = sys.argv[2]
-    cd20_path = sys.argv[3]
-    output_folder = sys.argv[4]
+
+    # Single design: both inputs are files and output_folder is the output PDB
+    if os.path.isfile(rf_folder) and os.path.isfile(af_folder):
+        output_dir = os.path.dirname(output_folder)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        align_and_write(rf_folder, af_folder, cd20_path, output_folder)
+        sys.exit(0)
 
     if not os.path.isdir(rf_folder) or not os.path.isdir(af_folder):
         print("Error: One or both input folders are invalid.")
         sys.exit(1)
-    
-    if not os.path.isfile(cd20_path):
-        print(f"Error: CD20 PDB file not found: {cd20_path}")
-        sys.exit(1)
 
-    process_folders(rf_folder, af_folder, cd20_path, output_folder)
+    keep = None
+    if args.keep_list:
+        keep = load_keep_list(args.keep_list)
+
+    if args.parallel:
+        process_folders_parallel(rf_folder, af_folder, cd20_path, output_folder,
+                                 args.workers, args.chunk_size, args.summary, keep)
+    else:
+        process_folders(rf_folder, af_folder, cd20_path, output_folder, keep)
+
+    if args.registry:
+        registry, _ = build_registry(args.registry, {'rf': rf_folder, 'af2': af_folder, 'aligned': output_folder})
+        print(f"Design registry updated: {args.registry} ({len(registry)} designs)")
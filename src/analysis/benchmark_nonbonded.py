@@ -0,0 +1,144 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import tempfile
+from pdbfixer import PDBFixer
+import openmm as mm
+from openmm import app
+from openmm import unit
+
+from run_md import build_system, fix_pdb, load_forcefield
+
+# Nonbonded settings compared against the original all-pairs protocol
+MODES = [
+    ('NoCutoff', {'nonbonded_method': 'NoCutoff'}),
+    ('Cutoff 1.0 nm', {'nonbonded_method': 'CutoffNonPeriodic', 'cutoff_nm': 1.0}),
+    ('Cutoff 1.2 nm', {'nonbonded_method': 'CutoffNonPeriodic', 'cutoff_nm': 1.2}),
+    ('Cutoff 1.5 nm', {'nonbonded_method': 'CutoffNonPeriodic', 'cutoff_nm': 1.5}),
+    ('Cutoff 1.2 nm + 1.5 nm shell', {'nonbonded_method': 'CutoffNonPeriodic', 'cutoff_nm': 1.2, 'interface_shell_nm': 1.5}),
+    ('NoCutoff + 2.0 nm shell', {'nonbonded_method': 'NoCutoff', 'interface_shell_nm': 2.0}),
+]
+
+def prepare_complex(pdb_path, work_dir):
+    # Strip heterogens (cd20.pdb carries lipid residues the force field has no
+    # templates for) and run the usual fix_pdb protocol
+    fixer = PDBFixer(filename=pdb_path)
+    fixer.removeHeterogens(keepWater=False)
+    stripped_path = os.path.join(work_dir, 'stripped.pdb')
+    with open(stripped_path, 'w') as outfile:
+        app.PDBFile.writeFile(fixer.topology, fixer.positions, outfile, keepIds=True)
+    fixed_path = os.path.join(work_dir, 'fixed.pdb')
+    fix_pdb(stripped_path, fixed_path)
+
+    forcefield = load_forcefield()
+    pdb = app.PDBFile(fixed_path)
+    modeller = app.Modeller(pdb.topology, pdb.positions)
+    modeller.addHydrogens(forcefield)
+    return modeller
+
+def relax_reference(modeller, platform, binder_chains, target_chains):
+    # Minimize once with the reference protocol so every mode is evaluated on
+    # the same clash-free coordinates
+    system = build_system(modeller, load_forcefield(), binder_chains=binder_chains, target_chains=target_chains)
+    integrator = mm.VerletIntegrator(0.001 * unit.picoseconds)
+    context = mm.Context(system, integrator, platform)
+    context.setPositions(modeller.positions)
+    mm.LocalEnergyMinimizer.minimize(context, maxIterations=200)
+    return context.getState(getPositions=True).getPositions()
+
+def benchmark_mode(modeller, positions, platform, options, n_steps, binder_chains, target_chains):
+    start_time = time.perf_counter()
+    system = build_system(modeller, load_forcefield(), binder_chains=binder_chains,
+                          target_chains=target_chains, **options)
+    integrator = mm.LangevinIntegrator(300 * unit.kelvin, 1.0 / unit.picoseconds, 0.002 * unit.picoseconds)
+    integrator.setRandomNumberSeed(1)
+    context = mm.Context(system, integrator, platform)
+    context.setPositions(positions)
+    setup_time = time.perf_counter() - start_time
+
+    total_energy = context.getState(getEnergy=True).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+    interaction_energy = context.getState(getEnergy=True, groups={1}).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+
+    context.setVelocitiesToTemperature(300 * unit.kelvin, 1)
+    integrator.step(10)  # Warm-up, excluded from timing
+    context.getState(getEnergy=True)
+    start_time = time.perf_counter()
+    integrator.step(n_steps)
+    context.getState(getEnergy=True)
+    step_time = time.perf_counter() - start_time
+
+    return {
+        'setup_s': setup_time,
+        'ms_per_step': 1000 * step_time / n_steps,
+        'total_energy': total_energy,
+        'interaction_energy': interaction_energy,
+    }
+
+def run_benchmark(pdb_path, platform_name='CPU', n_steps=200, binder_chains=None,
+                  target_chains=None, output_csv_path=None):
+    with tempfile.TemporaryDirectory() as work_dir:
+        modeller = prepare_complex(pdb_path, work_dir)
+
+    # By default the first chain is the binder and the rest are the target.
+    # The bundled cd20.pdb has no binder, so protomer C stands in for one.
+    chain_ids = [chain.id for chain in modeller.topology.chains()]
+    if binder_chains is None:
+        binder_chains = (chain_ids[0],)
+    if target_chains is None:
+        target_chains = tuple(c for c in chain_ids if c not in binder_chains)
+
+    platform = mm.Platform.getPlatformByName(platform_name)
+    positions = relax_reference(modeller, platform, binder_chains, target_chains)
+    print(f"Benchmarking {pdb_path}: {modeller.topology.getNumAtoms()} atoms, binder {binder_chains}, "
+          f"target {target_chains}, {n_steps} steps on {platform_name}")
+
+    rows = []
+    reference = None
+    for name, options in MODES:
+        result = benchmark_mode(modeller, positions, platform, options, n_steps, binder_chains, target_chains)
+        if reference is None:
+            reference = result
+        result['mode'] = name
+        result['speedup'] = reference['ms_per_step'] / result['ms_per_step']
+        result['total_energy_dev'] = result['total_energy'] - reference['total_energy']
+        result['interaction_energy_dev'] = result['interaction_energy'] - reference['interaction_energy']
+        rows.append(result)
+
+    header = f"{'Mode':<30} {'ms/step':>9} {'speedup':>8} {'E_int kJ/mol':>14} {'dE_int':>10} {'dE_total':>12}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(f"{row['mode']:<30} {row['ms_per_step']:>9.2f} {row['speedup']:>8.2f} "
+              f"{row['interaction_energy']:>14.1f} {row['interaction_energy_dev']:>10.1f} {row['total_energy_dev']:>12.1f}")
+
+    if output_csv_path:
+        fieldnames = ['mode', 'setup_s', 'ms_per_step', 'speedup', 'total_energy', 'interaction_energy',
+                      'total_energy_dev', 'interaction_energy_dev']
+        with open(output_csv_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Benchmark results written to {output_csv_path}")
+    return rows
+
+if __name__ == "__main__":
+    default_pdb = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'pdb', 'cd20.pdb')
+    parser = argparse.ArgumentParser(description="Compare nonbonded settings in run_md.py against the NoCutoff protocol")
+    parser.add_argument("pdb", nargs='?', default=os.path.normpath(default_pdb),
+                        help="Complex to benchmark (default: the bundled cd20.pdb)")
+    parser.add_argument("--platform", default='CPU', help="OpenMM platform name")
+    parser.add_argument("--steps", type=int, default=200, help="MD steps timed per mode")
+    parser.add_argument("--binder-chains", default=None, help="Comma-separated binder chain IDs")
+    parser.add_argument("--target-chains", default=None, help="Comma-separated target chain IDs")
+    parser.add_argument("--output", default=None, help="Write the results table to this CSV file")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.pdb):
+        print(f"PDB file not found: {args.pdb}")
+        sys.exit(1)
+
+    binder_chains = tuple(args.binder_chains.split(',')) if args.binder_chains else None
+    target_chains = tuple(args.target_chains.split(',')) if args.target_chains else None
+    run_benchmark(args.pdb, args.platform, args.steps, binder_chains, target_chains, args.output)
@@ -0,0 +1,576 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import hashlib
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+from sequences import THREE_TO_ONE
+import telemetry
+import energy_sink
+
+# Reproducible benchmark of the analysis scripts on synthetic rounds. Each
+# round is generated from the bundled cd20.pdb: RFdiffusion-style backbones
+# (poly-GLY helical binder as chain A, the CD20 backbone as chain B), AF2
+# predictions with a sequence and an out.sc, and an MD round directory with
+# energies.csv, a Prodigy CSV and md_output PDBs. Every entry point then runs
+# as its own process, the way main.py starts it, and its wall time, CPU time
+# and peak RSS are recorded. Nothing needs a GPU or the network.
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CD20 = os.path.normpath(os.path.join(ANALYSIS_DIR, '..', '..', 'data', 'pdb', 'cd20.pdb'))
+DEFAULT_SIZES = (100, 1000, 10000)
+GENERATOR_VERSION = 2
+# Wall-time differences below this are timer noise, whatever the ratio
+MIN_CHANGE_S = 0.25
+# Backbone-to-backbone gap between a binder and the target, in Angstrom;
+# wide enough for both side chains, so the complexes minimize without clashes
+INTERFACE_GAP = (8.0, 11.0)
+
+BACKBONE_ATOMS = ('N', 'CA', 'C', 'O')
+AMINO_ACIDS = sorted(THREE_TO_ONE)
+
+SCORE_COLUMNS = ['binder_aligned_rmsd', 'pae_binder', 'pae_interaction', 'pae_target', 'plddt_binder',
+                 'plddt_target', 'plddt_total', 'target_aligned_rmsd', 'time']
+
+# Ideal alpha helix: phi, psi, omega and backbone bond lengths / angles
+HELIX_DIHEDRALS = (-57.8, -47.0, 180.0)
+BOND_N_CA, BOND_CA_C, BOND_C_N, BOND_C_O = 1.458, 1.525, 1.329, 1.231
+ANGLE_N_CA_C, ANGLE_CA_C_N, ANGLE_C_N_CA, ANGLE_CA_C_O = 111.2, 116.2, 121.7, 120.5
+
+
+def _place_atom(a, b, c, bond, angle, torsion):
+    # Position of the atom bonded to c, with bond length |cd|, angle b-c-d and
+    # torsion a-b-c-d in degrees (NeRF)
+    angle, torsion = np.radians(angle), np.radians(torsion)
+    bc = (c - b) / np.linalg.norm(c - b)
+    normal = np.cross(b - a, bc)
+    normal /= np.linalg.norm(normal)
+    local = np.array([-bond * np.cos(angle), bond * np.sin(angle) * np.cos(torsion),
+                      bond * np.sin(angle) * np.sin(torsion)])
+    return c + local[0] * bc + local[1] * np.cross(normal, bc) + local[2] * normal
+
+
+def helix_backbone(length):
+    # (length, 4, 3) N/CA/C/O coordinates of an ideal helix, centred on the
+    # origin with its axis along x
+    phi, psi, omega = HELIX_DIHEDRALS
+    n = np.array([0.0, 0.0, 0.0])
+    ca = np.array([BOND_N_CA, 0.0, 0.0])
+    c = ca + BOND_CA_C * np.array([-np.cos(np.radians(ANGLE_N_CA_C)), np.sin(np.radians(ANGLE_N_CA_C)), 0.0])
+    residues = [[n, ca, c]]
+    for _ in range(length - 1):
+        n, ca, c = residues[-1]
+        next_n = _place_atom(n, ca, c, BOND_C_N, ANGLE_CA_C_N, psi)
+        next_ca = _place_atom(ca, c, next_n, BOND_N_CA, ANGLE_C_N_CA, omega)
+        next_c = _place_atom(c, next_n, next_ca, BOND_CA_C, ANGLE_N_CA_C, phi)
+        residues.append([next_n, next_ca, next_c])
+    coords = np.zeros((length, 4, 3))
+    for index, (n, ca, c) in enumerate(residues):
+        coords[index, :3] = n, ca, c
+        coords[index, 3] = _place_atom(n, ca, c, BOND_C_O, ANGLE_CA_C_O, psi + 180.0)
+
+    # Helix axis = principal axis of the CA trace, rotated onto x
+    ca_coords = coords[:, 1]
+    centre = ca_coords.mean(axis=0)
+    _, _, vt = np.linalg.svd(ca_coords - centre)
+    rotation = vt if np.linalg.det(vt) > 0 else vt * np.array([[1.0], [1.0], [-1.0]])
+    return (coords - centre) @ rotation.T
+
+
+def _rotation_about_x(angle):
+    cos, sin = np.cos(angle), np.sin(angle)
+    return np.array([[1.0, 0.0, 0.0], [0.0, cos, -sin], [0.0, sin, cos]])
+
+
+def _small_rotation(rng, max_degrees):
+    # Rotation by up to max_degrees about a random axis (Rodrigues)
+    axis = rng.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    angle = np.radians(rng.uniform(0.0, max_degrees))
+    cross = np.array([[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]])
+    return np.eye(3) + np.sin(angle) * cross + (1.0 - np.cos(angle)) * cross @ cross
+
+
+def load_target_backbone(cd20_path, chains=('C', 'D')):
+    # [(chain, res_name, [(atom_name, xyz), ...]), ...] for the standard
+    # residues of the target chains, backbone atoms only. The sterol ligands
+    # are left out, as align.py's 'protein' selection does.
+    residues = []
+    keys = {}
+    with open(cd20_path, 'r') as pdb_file:
+        for line in pdb_file:
+            if not line.startswith('ATOM') or line[21] not in chains:
+                continue
+            res_name = line[17:20].strip()
+            atom_name = line[12:16].strip()
+            if res_name not in THREE_TO_ONE or atom_name not in BACKBONE_ATOMS:
+                continue
+            key = (line[21], line[22:27])
+            if key not in keys:
+                keys[key] = len(residues)
+                residues.append((line[21], res_name, []))
+            xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            residues[keys[key]][2].append((atom_name, xyz))
+    return residues
+
+
+def _atom_line(serial, atom_name, res_name, chain, res_seq, xyz):
+    return (f"ATOM  {serial:5d} {atom_name if len(atom_name) == 4 else ' ' + atom_name:<4} {res_name:>3} {chain}"
+            f"{res_seq:4d}    {xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}  1.00  0.00           {atom_name[0]}\n")
+
+
+def binder_block(coords, res_names, chain='A'):
+    lines = []
+    serial = 0
+    for index, res_name in enumerate(res_names):
+        for atom_index, atom_name in enumerate(BACKBONE_ATOMS):
+            serial += 1
+            lines.append(_atom_line(serial, atom_name, res_name, chain, index + 1, coords[index, atom_index]))
+    lines.append(f"TER   {serial + 1:5d}      {res_names[-1]:>3} {chain}{len(res_names):4d}\n")
+    return ''.join(lines)
+
+
+def target_block(residues, first_serial, offset=None, chain=None):
+    # Target residues as PDB text. With chain set, every residue goes into
+    # that chain and is renumbered from 1 (RFdiffusion's chain B); otherwise
+    # the original chains are kept.
+    lines = []
+    serial = first_serial
+    previous_chain = None
+    res_seq = 0
+    for residue_chain, res_name, atoms in residues:
+        if chain is None and previous_chain is not None and residue_chain != previous_chain:
+            lines.append(f"TER   {serial:5d}\n")
+            serial += 1
+            res_seq = 0
+        previous_chain = residue_chain
+        res_seq += 1
+        for atom_name, xyz in atoms:
+            position = np.asarray(xyz) + (offset if offset is not None else 0.0)
+            lines.append(_atom_line(serial, atom_name, res_name, chain or residue_chain, res_seq, position))
+            serial += 1
+    lines.append(f"TER   {serial:5d}\n")
+    return ''.join(lines)
+
+
+def _write_text(path, text):
+    with open(path, 'w') as output_file:
+        output_file.write(text)
+
+
+def _file_sha256(path):
+    with open(path, 'rb') as input_file:
+        return hashlib.sha256(input_file.read()).hexdigest()
+
+
+def generate_round(work_dir, n_designs, cd20_path=DEFAULT_CD20, seed=0):
+    # Write a synthetic round of n_designs under work_dir, or reuse the one
+    # already there if it was generated with the same settings
+    marker_path = os.path.join(work_dir, 'synthetic.json')
+    settings = {'designs': n_designs, 'seed': seed, 'version': GENERATOR_VERSION, 'cd20': _file_sha256(cd20_path)}
+    try:
+        with open(marker_path, 'r') as marker_file:
+            if json.load(marker_file) == settings:
+                print(f"Reusing synthetic round in {work_dir}")
+                return
+    except (OSError, ValueError):
+        pass
+    if os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+
+    rf_dir = os.path.join(work_dir, 'rf')
+    af2_dir = os.path.join(work_dir, 'af2')
+    round_dir = os.path.join(work_dir, 'rounds', 'round1')
+    md_dir = os.path.join(round_dir, 'md_output')
+    for directory in (rf_dir, af2_dir, md_dir):
+        os.makedirs(directory)
+
+    start_time = time.time()
+    rng = np.random.RandomState(seed)
+    target = load_target_backbone(cd20_path)
+    # RFdiffusion frame: target centred on the origin, membrane at z > 0 for chain A
+    target_centre = np.mean([xyz for _, _, atoms in target for _, xyz in atoms], axis=0)
+    target_z_min = min(xyz[2] for _, _, atoms in target for _, xyz in atoms) - target_centre[2]
+    helices = {}
+    rf_targets = {}
+    md_targets = {}
+    sequences = []
+
+    score_lines = ["SCORE: " + ' '.join(SCORE_COLUMNS + ['description']) + '\n']
+    energy_rows = []
+    prodigy_rows = []
+    for index in range(n_designs):
+        name = f"binder_design_{index}"
+        if sequences and rng.rand() < 0.05:
+            sequence = sequences[rng.randint(len(sequences))]  # Same sequence from another backbone
+        else:
+            sequence = [AMINO_ACIDS[code] for code in rng.randint(len(AMINO_ACIDS), size=rng.randint(56, 81))]
+        sequences.append(sequence)
+        length = len(sequence)
+        if length not in helices:
+            helices[length] = helix_backbone(length)
+            atoms = 4 * length + 1  # Binder atoms and its TER record
+            rf_targets[length] = target_block(target, atoms + 1, -target_centre, chain='B')
+            md_targets[length] = target_block(target, atoms + 1)
+
+        helix = helices[length] @ _rotation_about_x(rng.uniform(0.0, 2.0 * np.pi)).T
+        offset = np.array([rng.uniform(-10.0, 10.0), rng.uniform(-10.0, 10.0), 0.0])
+        coords = helix + offset
+
+        # AF2 pose: the same binder, slightly turned about its own centre,
+        # moved and perturbed
+        af2_coords = helix @ _small_rotation(rng, 10.0).T + offset + rng.uniform(-3.0, 3.0, size=3)
+        af2_coords = af2_coords + rng.normal(scale=0.1, size=af2_coords.shape)
+
+        # Both poses under the target, the higher one INTERFACE_GAP below its
+        # lowest backbone atom; one in ten reaches into the membrane (z > 0)
+        if rng.rand() < 0.1:
+            shift = rng.uniform(2.0, 30.0)
+        else:
+            top = max(coords[..., 2].max(), af2_coords[..., 2].max())
+            shift = target_z_min - rng.uniform(*INTERFACE_GAP) - top
+        coords[..., 2] += shift
+        af2_coords[..., 2] += shift
+
+        description = f"{name}_dldesign_0_af2pred"
+        _write_text(os.path.join(rf_dir, f"{name}.pdb"),
+                    binder_block(coords, ['GLY'] * length) + rf_targets[length] + "END\n")
+        _write_text(os.path.join(af2_dir, f"{description}.pdb"),
+                    binder_block(af2_coords, sequence) + rf_targets[length] + "END\n")
+        output_name = f"{name}_aligned_md"
+        # MD structures are in the target's own frame, as align.py writes them
+        _write_text(os.path.join(md_dir, f"{output_name}.pdb"),
+                    binder_block(af2_coords + target_centre, sequence) + md_targets[length] + "END\n")
+
+        scores = [
+            0.5 + rng.gamma(2.0, 1.2),   # binder_aligned_rmsd, a few above the 6 A cut
+            rng.uniform(3.0, 8.0),        # pae_binder
+            rng.uniform(4.0, 28.0),       # pae_interaction
+            rng.uniform(3.0, 8.0),        # pae_target
+            rng.uniform(60.0, 95.0),      # plddt_binder
+            rng.uniform(80.0, 95.0),      # plddt_target
+            rng.uniform(75.0, 95.0),      # plddt_total
+            rng.uniform(0.3, 2.0),        # target_aligned_rmsd
+            rng.uniform(10.0, 40.0),      # time
+        ]
+        score_lines.append("SCORE: " + ' '.join(f"{value:.3f}" for value in scores) + f" {description}\n")
+        energy_rows.append([output_name, round(rng.normal(-11000.0, 1500.0), 3),
+                            round(rng.normal(-900.0, 250.0), 3), 2000, 'max_steps'])
+        prodigy_rows.append([f"{output_name}.pdb", round(rng.normal(-12.0, 2.0), 2)])
+
+    _write_text(os.path.join(af2_dir, 'out.sc'), ''.join(score_lines))
+    with open(os.path.join(round_dir, 'energies.csv'), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['OutputName', 'TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol', 'Steps', 'StopReason'])
+        writer.writerows(energy_rows)
+    with open(os.path.join(round_dir, 'prodigy.csv'), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['File', 'DeltaG (kcal/mol)'])
+        writer.writerows(prodigy_rows)
+
+    with open(marker_path, 'w') as marker_file:
+        json.dump(settings, marker_file)
+    print(f"Generated {n_designs} synthetic designs in {work_dir} in {time.time() - start_time:.1f} s")
+
+
+def _fresh_dir(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    return path
+
+
+def _linked_copy(src_dir, dest_dir):
+    # Hardlinked copy of a folder of PDBs (filter_pdbs moves files out of it)
+    _fresh_dir(dest_dir)
+    os.makedirs(dest_dir)
+    for file_name in os.listdir(src_dir):
+        if file_name.endswith('.pdb'):
+            try:
+                os.link(os.path.join(src_dir, file_name), os.path.join(dest_dir, file_name))
+            except OSError:
+                shutil.copyfile(os.path.join(src_dir, file_name), os.path.join(dest_dir, file_name))
+
+
+def _count_pdbs(directory):
+    return sum(1 for file_name in os.listdir(directory) if file_name.endswith('.pdb'))
+
+
+def _script(name):
+    return [sys.executable, os.path.join(ANALYSIS_DIR, name)]
+
+
+def benchmark_entry_points(work_dir, n_designs, cd20_path=DEFAULT_CD20, workers=1, md_designs=0,
+                           md_platform='CPU', md_steps=100, md_minimize_iterations=100):
+    # Run each analysis entry point on the round in work_dir and return one
+    # result dict per entry point
+    rf_dir = os.path.join(work_dir, 'rf')
+    af2_dir = os.path.join(work_dir, 'af2')
+    filtered_dir = os.path.join(work_dir, 'rf_filtered')
+    aligned_dir = os.path.join(work_dir, 'aligned')
+    rounds_dir = os.path.join(work_dir, 'rounds')
+    round_dir = os.path.join(rounds_dir, 'round1')
+    final_dir = os.path.join(work_dir, 'final')
+    worker_args = ['--workers', str(workers)]
+
+    # Each preparation step resets the entry point's outputs and returns its
+    # command and the number of designs it processes, or None if an input it
+    # needs is missing because an earlier entry point failed. A completion
+    # count, where given, returns how many designs the entry point finished;
+    # fewer than it was given marks it failed even if it exited with 0.
+    def filter_step():
+        _linked_copy(rf_dir, filtered_dir)
+        return _script('filter_pdbs.py') + [filtered_dir, '--batch'] + worker_args, n_designs
+
+    def align_step():
+        _fresh_dir(aligned_dir)
+        return (_script('align.py') + [filtered_dir, af2_dir, cd20_path, aligned_dir, '--parallel'] + worker_args,
+                _count_pdbs(filtered_dir))
+
+    def hotspot_step():
+        if not os.path.isdir(aligned_dir):
+            return None
+        return (_script('hotspot_filter.py') + [
+            aligned_dir, '--md-list', os.path.join(work_dir, 'hotspot_pass.txt'),
+            '--maps', os.path.join(work_dir, 'contact_maps.npz')] + worker_args, _count_pdbs(aligned_dir))
+
+    def merge_step():
+        return (_script('merge_energies_post.py') + [
+            os.path.join(round_dir, 'energies.csv'), os.path.join(round_dir, 'prodigy.csv'),
+            os.path.join(af2_dir, 'out.sc'), os.path.join(round_dir, 'merged_energies_post.csv'),
+            os.path.join(round_dir, 'md_output'), '--rg-workers', str(workers)], n_designs)
+
+    def collect_step():
+        _fresh_dir(final_dir)
+        return _script('collect_top_designs.py') + [rounds_dir, final_dir, '--top-n', str(min(n_designs, 1000))], \
+            n_designs
+
+    def consolidate_step():
+        if not os.path.isfile(os.path.join(final_dir, 'top_designs.csv')):
+            return None
+        _fresh_dir(os.path.join(work_dir, 'consolidated'))
+        # consolidate_top_designs.py resolves source folders from the working directory
+        with open(os.path.join(final_dir, 'top_designs.csv'), 'r') as csvfile:
+            rows = sum(1 for _ in csv.DictReader(csvfile))
+        return _script('consolidate_top_designs.py') + [
+            'final', '--output-dir', 'consolidated', '--top-n', str(min(n_designs, 500))] + worker_args, rows
+
+    def md_step():
+        if not os.path.isdir(aligned_dir):
+            return None
+        inputs = sorted(os.listdir(aligned_dir))[:md_designs]
+        list_path = os.path.join(work_dir, 'md_inputs.txt')
+        _write_text(list_path, ''.join(os.path.abspath(os.path.join(aligned_dir, name)) + '\n' for name in inputs))
+        md_work = _fresh_dir(os.path.join(work_dir, 'md_bench'))
+        os.makedirs(md_work)
+        return _script('run_md.py') + [
+            list_path, os.path.join(md_work, 'fixed'), os.path.join(md_work, 'md'),
+            os.path.join(md_work, 'energies.csv'), '--batch', '--platform', md_platform,
+            '--max-steps', str(md_steps), '--report-interval', str(min(100, md_steps)),
+            '--minimize-iterations', str(md_minimize_iterations)], len(inputs)
+
+    def md_completed():
+        # run_md.py logs a failed design and goes on; only energy rows count
+        energies_csv = os.path.join(work_dir, 'md_bench', 'energies.csv')
+        energy_sink.compact(energies_csv)
+        if not os.path.isfile(energies_csv):
+            return 0
+        with open(energies_csv, 'r') as csvfile:
+            return sum(1 for _ in csv.DictReader(csvfile))
+
+    steps = [('filter_pdbs', filter_step, None, None), ('align', align_step, None, None),
+             ('hotspot_filter', hotspot_step, None, None), ('merge_energies_post', merge_step, None, None),
+             ('collect_top_designs', collect_step, None, None),
+             ('consolidate_top_designs', consolidate_step, work_dir, None)]
+    if md_designs:
+        steps.append(('run_md', md_step, None, md_completed))
+
+    # Per-design events of the scripts (e.g. run_md.py's ns/day) go to a telemetry file per round
+    telemetry_path = os.path.join(work_dir, 'telemetry.jsonl')
+    if os.path.exists(telemetry_path):
+        os.remove(telemetry_path)
+    previous_env = {key: os.environ.get(key) for key in (telemetry.TELEMETRY_ENV, telemetry.RUN_ID_ENV)}
+    telemetry.enable(telemetry_path, f"bench-{n_designs}")
+
+    results = []
+    try:
+        for name, prepare, cwd, completed_count in steps:
+            prepared = prepare()
+            if prepared is None:
+                print(f"[{n_designs}] {name}: skipped, inputs missing")
+                results.append({'size': n_designs, 'entry': name, 'designs': 0, 'returncode': None,
+                                'skipped': True, 'wall_s': None, 'cpu_s': None, 'peak_rss_mb': None,
+                                'designs_per_s': None})
+                continue
+            command, designs = prepared
+            print(f"[{n_designs}] {name}: {designs} designs")
+            log_path = os.path.join(work_dir, f"{name}.log")
+            with open(log_path, 'w') as log_file:
+                completed = telemetry.run_subprocess(command, check=False, labels={'entry': name}, cwd=cwd,
+                                                     stdout=log_file, stderr=subprocess.STDOUT)
+            events = telemetry.load_events(telemetry_path)
+            usage = [event for event in events if event['event'] == 'subprocess' and event.get('entry') == name][-1]
+            result = {'size': n_designs, 'entry': name, 'designs': designs, 'returncode': completed.returncode}
+            result.update({key: usage.get(key) for key in ('wall_s', 'cpu_s', 'peak_rss_mb')})
+            result['designs_per_s'] = round(designs / result['wall_s'], 3) if result['wall_s'] else None
+            rates = sorted(event['ns_per_day'] for event in events if event['event'] == 'md.dynamics')
+            if rates:
+                result['ns_per_day'] = rates[len(rates) // 2]
+            if completed.returncode != 0:
+                print(f"  {name} exited with {completed.returncode}, see {log_path}")
+            elif completed_count is not None:
+                result['completed'] = completed_count()
+                if result['completed'] < designs:
+                    print(f"  {name} completed {result['completed']} of {designs} designs, see {log_path}")
+            results.append(result)
+    finally:
+        for key, value in previous_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return results
+
+
+def _failed(result):
+    # Exited non-zero, or finished fewer designs than it was given
+    return result['returncode'] != 0 or result.get('completed', result['designs']) < result['designs']
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    # (result, baseline wall time, ratio, verdict) for every entry point
+    # measured in both; slower/faster means outside the tolerance and by more
+    # than MIN_CHANGE_S. An entry point that exited non-zero or left designs
+    # unfinished is 'failed' and one whose inputs were missing 'skipped',
+    # whatever its wall time.
+    baseline_wall = {(entry['size'], entry['entry']): entry.get('wall_s') for entry in baseline.get('results', [])}
+    comparisons = []
+    for result in results:
+        reference = baseline_wall.get((result['size'], result['entry']))
+        if result.get('skipped'):
+            comparisons.append((result, reference, None, 'skipped'))
+            continue
+        if _failed(result):
+            comparisons.append((result, reference, None, 'failed'))
+            continue
+        if not reference or not result.get('wall_s'):
+            comparisons.append((result, None, None, 'new'))
+            continue
+        ratio = result['wall_s'] / reference
+        if abs(result['wall_s'] - reference) < MIN_CHANGE_S:
+            verdict = 'same'
+        elif ratio > 1.0 + tolerance:
+            verdict = 'slower'
+        elif ratio < 1.0 / (1.0 + tolerance):
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        comparisons.append((result, reference, ratio, verdict))
+    return comparisons
+
+
+def print_results(results, comparisons=None):
+    verdicts = {(result['size'], result['entry']): (reference, ratio, verdict)
+                for result, reference, ratio, verdict in (comparisons or [])}
+    header = (f"{'Size':>6} {'Entry point':<26}{'Designs':>8}{'Wall s':>10}{'CPU s':>10}{'RSS MB':>9}"
+              f"{'Designs/s':>11}")
+    if comparisons is not None:
+        header += f"{'Baseline s':>12}{'Ratio':>7}  Verdict"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        line = (f"{result['size']:>6} {result['entry']:<26}{result['designs']:>8}{result['wall_s'] or 0:>10.2f}"
+                f"{result['cpu_s'] or 0:>10.2f}{result['peak_rss_mb'] or 0:>9.0f}{result['designs_per_s'] or 0:>11.2f}")
+        if comparisons is not None:
+            reference, ratio, verdict = verdicts.get((result['size'], result['entry']), (None, None, 'new'))
+            line += (f"{reference:>12.2f}{ratio:>7.2f}" if reference and ratio else f"{'':>12}{'':>7}") + \
+                f"  {verdict}"
+        if result.get('skipped'):
+            line += "  (inputs missing)"
+        elif result['returncode'] != 0:
+            line += f"  (exit {result['returncode']})"
+        elif _failed(result):
+            line += f"  ({result['completed']} of {result['designs']} completed)"
+        if result.get('ns_per_day'):
+            line += f"  {result['ns_per_day']:.1f} ns/day"
+        print(line)
+
+
+def write_results(results_path, results, settings):
+    directory = os.path.dirname(os.path.abspath(results_path))
+    os.makedirs(directory, exist_ok=True)
+    document = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'settings': settings,
+        'results': results,
+    }
+    tmp_path = f"{results_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as results_file:
+        json.dump(document, results_file, indent=1)
+    os.replace(tmp_path, results_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis scripts on synthetic rounds built from cd20.pdb")
+    parser.add_argument("--sizes", default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated round sizes in designs")
+    parser.add_argument("--work-dir", default=os.path.join('data', 'benchmarks'),
+                        help="Where synthetic rounds are generated (reused across runs)")
+    parser.add_argument("--cd20", default=DEFAULT_CD20, help="Target structure the rounds are built from")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic rounds")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes passed to the scripts")
+    parser.add_argument("--md-designs", type=int, default=2,
+                        help="Designs run through run_md.py in each round (0 skips MD)")
+    parser.add_argument("--md-platform", default='CPU', choices=['CPU', 'Reference'], help="OpenMM platform for run_md.py")
+    parser.add_argument("--md-steps", type=int, default=100, help="MD steps per design")
+    parser.add_argument("--md-minimize-iterations", type=int, default=100, help="Minimization iterations per design")
+    parser.add_argument("--output", default=None, help="Results JSON (default: <work-dir>/results.json)")
+    parser.add_argument("--baseline", default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative wall-time change reported as slower/faster")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 if an entry point failed or is slower than the baseline")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cd20):
+        print(f"Target PDB not found: {args.cd20}")
+        sys.exit(1)
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    settings = {key: getattr(args, key) for key in ('sizes', 'seed', 'workers', 'md_designs', 'md_platform',
+                                                     'md_steps', 'md_minimize_iterations')}
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        round_dir = os.path.join(args.work_dir, f"n{size}")
+        generate_round(round_dir, size, args.cd20, args.seed)
+        results.extend(benchmark_entry_points(round_dir, size, os.path.abspath(args.cd20), args.workers,
+                                              args.md_designs, args.md_platform, args.md_steps,
+                                              args.md_minimize_iterations))
+
+    output_path = args.output or os.path.join(args.work_dir, 'results.json')
+    write_results(output_path, results, settings)
+
+    comparisons = None
+    if args.baseline and os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            comparisons = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+    print()
+    print_results(results, comparisons)
+    print(f"\nResults written to {output_path}")
+    if args.save_baseline:
+        write_results(args.baseline, results, settings)
+        print(f"Baseline saved to {args.baseline}")
+    if args.fail_on_regression:
+        failed = any(not result.get('skipped') and _failed(result) for result in results)
+        if failed or (comparisons and any(verdict == 'slower' for *_, verdict in comparisons)):
+            sys.exit(1)
@@ -0,0 +1,353 @@
+import os
+import csv
+import sys
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_io import read_atom_lines, atom_table, table_field, table_coords, table_elements
+
+try:
+    import freesasa
+    freesasa.setVerbosity(freesasa.nowarnings)
+except ImportError:
+    freesasa = None
+
+# In-process PRODIGY binding affinity (IC-NIS model, Vangone & Bonvin 2015)
+# for many complexes at once, instead of one `prodigy` run per file. Residue
+# contacts between the binder chain and the target chains come from a KD-tree
+# search over heavy atoms and are counted by residue-class pair; the
+# non-interacting surface (NIS) is the share of apolar/charged residues among
+# the solvent-exposed ones. Structures are cleaned the way PRODIGY does it:
+# hydrogens, HETATM records and insertion-code residues are dropped, only the
+# first alternate location is kept and other non-standard residues are an error.
+# Results are written in PRODIGY's `File,DeltaG (kcal/mol)` CSV format, the
+# one merge_energies*.py read.
+
+PRODIGY_CSV_HEADER = ['File', 'DeltaG (kcal/mol)']
+DISTANCE_CUTOFF = 5.5
+ACC_THRESHOLD = 0.05
+PROBE_RADIUS = 1.4
+SPHERE_POINTS = 100
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "affinity_examples")
+
+# Residue classes: contacts use the IC classes, the NIS the protorp classes
+APOLAR, CHARGED, POLAR = 0, 1, 2
+IC_CLASS = {
+    'ALA': APOLAR, 'CYS': APOLAR, 'GLY': APOLAR, 'PHE': APOLAR, 'ILE': APOLAR, 'MET': APOLAR, 'LEU': APOLAR,
+    'PRO': APOLAR, 'TRP': APOLAR, 'VAL': APOLAR, 'TYR': APOLAR,
+    'GLU': CHARGED, 'ASP': CHARGED, 'HIS': CHARGED, 'LYS': CHARGED, 'ARG': CHARGED,
+    'ASN': POLAR, 'GLN': POLAR, 'SER': POLAR, 'THR': POLAR,
+}
+NIS_CLASS = {
+    'ALA': APOLAR, 'GLY': APOLAR, 'PHE': APOLAR, 'ILE': APOLAR, 'MET': APOLAR, 'LEU': APOLAR, 'PRO': APOLAR,
+    'VAL': APOLAR,
+    'GLU': CHARGED, 'ASP': CHARGED, 'LYS': CHARGED, 'ARG': CHARGED,
+    'CYS': POLAR, 'HIS': POLAR, 'ASN': POLAR, 'GLN': POLAR, 'SER': POLAR, 'THR': POLAR, 'TRP': POLAR,
+    'TYR': POLAR,
+}
+RESIDUES = sorted(IC_CLASS)
+
+# Total SASA of each residue type in an extended tripeptide, for relative SASA
+RELATIVE_ASA_TOTAL = {
+    'ALA': 107.95, 'CYS': 134.28, 'ASP': 140.39, 'GLU': 172.25, 'PHE': 199.48, 'GLY': 80.10, 'HIS': 182.88,
+    'ILE': 175.12, 'LYS': 200.81, 'LEU': 178.63, 'MET': 194.15, 'ASN': 143.94, 'PRO': 136.13, 'GLN': 178.50,
+    'ARG': 238.76, 'SER': 116.50, 'THR': 139.27, 'VAL': 151.44, 'TRP': 249.36, 'TYR': 212.76,
+}
+
+# NACCESS atom radii (the classifier PRODIGY hands to freesasa)
+C_ALI, C_CAR, N_AMN, N_AMD, O, S = 1.87, 1.76, 1.50, 1.65, 1.40, 1.85
+BACKBONE_RADII = {'C': C_CAR, 'O': O, 'CA': C_ALI, 'N': N_AMD, 'CB': C_ALI, 'OXT': O}
+SIDE_CHAIN_RADII = {
+    'ARG': {'CG': C_ALI, 'CD': C_ALI, 'NE': N_AMD, 'CZ': C_CAR, 'NH1': N_AMD, 'NH2': N_AMD},
+    'ASN': {'CG': C_CAR, 'OD1': O, 'ND2': N_AMD},
+    'ASP': {'CG': C_CAR, 'OD1': O, 'OD2': O},
+    'CYS': {'SG': S},
+    'GLN': {'CG': C_ALI, 'CD': C_CAR, 'OE1': O, 'NE2': N_AMD},
+    'GLU': {'CG': C_ALI, 'CD': C_CAR, 'OE1': O, 'OE2': O},
+    'HIS': {'CG': C_CAR, 'ND1': N_AMD, 'CD2': C_CAR, 'NE2': N_AMD, 'CE1': C_CAR},
+    'ILE': {'CG1': C_ALI, 'CG2': C_ALI, 'CD1': C_ALI},
+    'LEU': {'CG': C_ALI, 'CD1': C_ALI, 'CD2': C_ALI},
+    'LYS': {'CG': C_ALI, 'CD': C_ALI, 'CE': C_ALI, 'NZ': N_AMN},
+    'MET': {'CG': C_ALI, 'SD': S, 'CE': C_ALI},
+    'PHE': {'CG': C_CAR, 'CD1': C_CAR, 'CD2': C_CAR, 'CE1': C_CAR, 'CE2': C_CAR, 'CZ': C_CAR},
+    'PRO': {'CG': C_ALI, 'CD': C_ALI},
+    'SER': {'OG': O},
+    'THR': {'OG1': O, 'CG2': C_ALI},
+    'TRP': {'CG': C_CAR, 'CD1': C_CAR, 'CD2': C_CAR, 'NE1': N_AMD, 'CE2': C_CAR, 'CE3': C_CAR, 'CZ2': C_CAR,
+            'CZ3': C_CAR, 'CH2': C_CAR},
+    'TYR': {'CG': C_CAR, 'CD1': C_CAR, 'CD2': C_CAR, 'CE1': C_CAR, 'CE2': C_CAR, 'CZ': C_CAR, 'OH': O},
+    'VAL': {'CG1': C_ALI, 'CG2': C_ALI},
+}
+
+# IC-NIS regression: weights of the contact counts and NIS percentages
+IC_NIS_WEIGHTS = {'CC': -0.09459, 'AC': -0.10007, 'PP': 0.19577, 'AP': -0.22671,
+                  'nis_a': 0.18681, 'nis_c': 0.13810}
+IC_NIS_INTERCEPT = -15.9433
+CONTACT_BINS = {'AA': (APOLAR, APOLAR), 'AC': (APOLAR, CHARGED), 'AP': (APOLAR, POLAR),
+                'CC': (CHARGED, CHARGED), 'CP': (CHARGED, POLAR), 'PP': (POLAR, POLAR)}
+
+
+def atom_radius(res_name, atom_name):
+    # NACCESS radius, None for atoms the classifier does not know (skipped)
+    radius = BACKBONE_RADII.get(atom_name)
+    if radius is None:
+        radius = SIDE_CHAIN_RADII.get(res_name, {}).get(atom_name)
+    return radius
+
+
+def read_complex(pdb_file_path, chains=None):
+    # Heavy atoms of the standard residues of a complex, optionally restricted
+    # to some chains. Returns coords, atom radii, per-atom residue index and
+    # per-residue chain IDs and names.
+    lines = [line for line in read_atom_lines(pdb_file_path) if line[:6] == b'ATOM  ' and line[26:27] in (b' ', b'')]
+    if chains is not None:
+        keep = {chain.encode() for chain in chains}
+        lines = [line for line in lines if line[21:22] in keep]
+    if not lines:
+        raise ValueError("no protein atoms")
+    table = atom_table(lines)
+    heavy = ~np.isin(table_elements(table), ('H', 'D'))
+    table = table[heavy]
+
+    res_names = np.char.strip(table_field(table, 17, 20).astype(str))
+    unknown = sorted(set(res_names.tolist()) - set(RESIDUES))
+    if unknown:
+        raise ValueError(f"non-standard residues {', '.join(unknown)}")
+    atom_names = np.char.strip(table_field(table, 12, 16).astype(str))
+
+    # Residues are consecutive runs of (chain, number) in file order
+    residue_keys = table_field(table, 21, 26)
+    starts = np.concatenate(([True], residue_keys[1:] != residue_keys[:-1]))
+    residue_index = np.cumsum(starts) - 1
+    radii = np.array([atom_radius(res, atom) or np.nan for res, atom in zip(res_names.tolist(), atom_names.tolist())])
+    return {
+        'coords': table_coords(table),
+        'radii': radii,
+        'residue': residue_index,
+        'chains': table_field(table, 21, 22).astype(str)[starts],
+        'res_names': res_names[starts],
+    }
+
+
+def interface_contacts(structure, binder_chain='A', target_chains=None, cutoff=DISTANCE_CUTOFF):
+    # (binder residue, target residue) index pairs with any heavy atoms within
+    # cutoff Angstrom
+    atom_chains = structure['chains'][structure['residue']]
+    binder = atom_chains == binder_chain
+    if target_chains is None:
+        target = ~binder
+    else:
+        target = np.isin(atom_chains, list(target_chains))
+    binder_atoms = np.nonzero(binder)[0]
+    target_atoms = np.nonzero(target)[0]
+    if len(binder_atoms) == 0 or len(target_atoms) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    coords = structure['coords']
+    pairs = cKDTree(coords[binder_atoms]).query_ball_tree(cKDTree(coords[target_atoms]), cutoff)
+    counts = np.fromiter((len(hits) for hits in pairs), dtype=np.int64, count=len(pairs))
+    if counts.sum() == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    binder_hits = np.repeat(binder_atoms, counts)
+    target_hits = target_atoms[np.fromiter((j for hits in pairs for j in hits), dtype=np.int64, count=counts.sum())]
+    residue = structure['residue']
+    return np.unique(np.stack((residue[binder_hits], residue[target_hits]), axis=1), axis=0)
+
+
+def contact_bins(structure, contacts):
+    # Number of contacts per residue-class pair (AA, AC, AP, CC, CP, PP)
+    classes = np.array([IC_CLASS[name] for name in structure['res_names'].tolist()], dtype=np.int64)
+    first = classes[contacts[:, 0]]
+    second = classes[contacts[:, 1]]
+    pair_codes = np.minimum(first, second) * 3 + np.maximum(first, second)
+    counts = np.bincount(pair_codes, minlength=9)
+    return {name: int(counts[a * 3 + b]) for name, (a, b) in CONTACT_BINS.items()}
+
+
+def _sphere_points(n_points):
+    # Golden-section spiral of unit vectors
+    index = np.arange(n_points) + 0.5
+    z = 1 - 2 * index / n_points
+    radius = np.sqrt(1 - z * z)
+    phi = np.pi * (3 - np.sqrt(5)) * index
+    return np.stack((radius * np.cos(phi), radius * np.sin(phi), z), axis=1)
+
+
+def shrake_rupley(coords, radii, probe=PROBE_RADIUS, n_points=SPHERE_POINTS):
+    # Per-atom SASA with the Shrake-Rupley test-point method, used when
+    # freesasa is not installed
+    sphere = _sphere_points(n_points)
+    expanded = radii + probe
+    tree = cKDTree(coords)
+    neighbours = tree.query_ball_point(coords, expanded + expanded.max())
+    areas = np.empty(len(coords))
+    for i, near in enumerate(neighbours):
+        near = np.array([j for j in near if j != i], dtype=np.int64)
+        points = coords[i] + expanded[i] * sphere
+        if len(near):
+            sq_dist = ((points[:, None, :] - coords[near][None, :, :]) ** 2).sum(axis=2)
+            exposed = np.count_nonzero((sq_dist >= expanded[near] ** 2).all(axis=1))
+        else:
+            exposed = n_points
+        areas[i] = 4 * np.pi * expanded[i] ** 2 * exposed / n_points
+    return areas
+
+
+def atom_sasa(coords, radii):
+    if freesasa is None:
+        return shrake_rupley(coords, radii)
+    result = freesasa.calcCoord(coords.ravel(), radii.tolist())
+    return np.array([result.atomArea(i) for i in range(len(radii))])
+
+
+def nis_percentages(structure, acc_threshold=ACC_THRESHOLD):
+    # Percentages of apolar and charged residues among those with a relative
+    # SASA of at least acc_threshold in the complex
+    known = ~np.isnan(structure['radii'])
+    areas = atom_sasa(structure['coords'][known], structure['radii'][known])
+    residue_area = np.bincount(structure['residue'][known], weights=areas, minlength=len(structure['res_names']))
+    has_atoms = np.bincount(structure['residue'][known], minlength=len(structure['res_names'])) > 0
+    names = structure['res_names'].tolist()
+    relative = residue_area / np.array([RELATIVE_ASA_TOTAL[name] for name in names])
+    classes = np.array([NIS_CLASS[name] for name in names], dtype=np.int64)
+    counts = np.bincount(classes[has_atoms & (relative >= acc_threshold)], minlength=3)
+    total = counts.sum()
+    if total == 0:
+        raise ValueError("no solvent-exposed residues")
+    return float(100.0 * counts[APOLAR] / total), float(100.0 * counts[CHARGED] / total)
+
+
+def ic_nis(bins, nis_a, nis_c):
+    values = dict(bins, nis_a=nis_a, nis_c=nis_c)
+    return float(sum(weight * values[term] for term, weight in IC_NIS_WEIGHTS.items()) + IC_NIS_INTERCEPT)
+
+
+def predict(pdb_file_path, binder_chain='A', target_chains=None, cutoff=DISTANCE_CUTOFF,
+            acc_threshold=ACC_THRESHOLD):
+    # PRODIGY prediction for one complex: {'ICs', bins..., 'nis_a', 'nis_c', 'DeltaG'}.
+    # Without target_chains every chain other than the binder is the target.
+    chains = None if target_chains is None else [binder_chain] + list(target_chains)
+    structure = read_complex(pdb_file_path, chains)
+    contacts = interface_contacts(structure, binder_chain, target_chains, cutoff)
+    if len(contacts) == 0:
+        raise ValueError(f"no contacts between chain {binder_chain} and the target")
+    bins = contact_bins(structure, contacts)
+    nis_a, nis_c = nis_percentages(structure, acc_threshold)
+    prediction = dict(bins, ICs=len(contacts), nis_a=nis_a, nis_c=nis_c)
+    prediction['DeltaG'] = ic_nis(bins, nis_a, nis_c)
+    return prediction
+
+
+def _predict_chunk(job):
+    pdb_file_paths, binder_chain, target_chains, cutoff, acc_threshold = job
+    results = []
+    for pdb_file_path in pdb_file_paths:
+        try:
+            results.append(predict(pdb_file_path, binder_chain, target_chains, cutoff, acc_threshold))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {os.path.basename(pdb_file_path)}: {e}")
+            results.append(None)
+    return results
+
+
+def predict_batch(pdb_file_paths, binder_chain='A', target_chains=None, cutoff=DISTANCE_CUTOFF,
+                  acc_threshold=ACC_THRESHOLD, workers=None, chunk_size=8):
+    # Predictions for many complexes, in input order (None where a file could
+    # not be scored). With workers > 1, chunks of files run in separate processes.
+    pdb_file_paths = list(pdb_file_paths)
+    jobs = [(pdb_file_paths[i:i + chunk_size], binder_chain, target_chains, cutoff, acc_threshold)
+            for i in range(0, len(pdb_file_paths), chunk_size)]
+    if not workers or workers <= 1 or len(jobs) <= 1:
+        return [result for job in jobs for result in _predict_chunk(job)]
+
+    results = []
+    executor = None
+    try:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        for chunk_results in executor.map(_predict_chunk, jobs):
+            results.extend(chunk_results)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
+
+
+def write_prodigy_csv(output_csv_path, file_names, predictions):
+    directory = os.path.dirname(os.path.abspath(output_csv_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_csv_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(PRODIGY_CSV_HEADER)
+        for file_name, prediction in zip(file_names, predictions):
+            if prediction is not None:
+                writer.writerow([file_name, f"{prediction['DeltaG']:.3f}"])
+    os.replace(tmp_path, output_csv_path)
+
+
+def score_directory(pdb_dir, output_csv_path, binder_chain='A', target_chains=None, workers=None,
+                    cutoff=DISTANCE_CUTOFF, acc_threshold=ACC_THRESHOLD):
+    # Score every PDB file in pdb_dir and write the PRODIGY CSV. Returns the
+    # number of files scored.
+    file_names = sorted(f for f in os.listdir(pdb_dir) if f.endswith('.pdb'))
+    predictions = predict_batch([os.path.join(pdb_dir, name) for name in file_names],
+                                binder_chain, target_chains, cutoff, acc_threshold, workers)
+    write_prodigy_csv(output_csv_path, file_names, predictions)
+    return sum(prediction is not None for prediction in predictions)
+
+
+def validate(examples_dir=EXAMPLES_DIR, tolerance=None):
+    # Compare predictions for the bundled example complexes with the values
+    # PRODIGY itself reports for them with the same chain selection
+    # (reference.csv). Returns True if every example is within tolerance
+    # kcal/mol; the default tolerance is tighter with freesasa, which computes
+    # the same SASA as PRODIGY.
+    if tolerance is None:
+        tolerance = 0.01 if freesasa is not None else 0.25
+    with open(os.path.join(examples_dir, "reference.csv"), 'r', newline='') as csvfile:
+        reference = list(csv.DictReader(csvfile))
+    print(f"SASA: {'freesasa' if freesasa is not None else 'Shrake-Rupley fallback'}, tolerance {tolerance} kcal/mol")
+    passed = True
+    for row in reference:
+        binder_chain, target_chains = row['Selection'].split()
+        expected = float(row['DeltaG (kcal/mol)'])
+        try:
+            prediction = predict(os.path.join(examples_dir, row['File']), binder_chain, target_chains.split(','))
+        except (OSError, ValueError) as e:
+            print(f"  FAIL {row['File']}: {e}")
+            passed = False
+            continue
+        error = prediction['DeltaG'] - expected
+        ok = abs(error) <= tolerance and prediction['ICs'] == int(row['ICs'])
+        passed = passed and ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {row['File']}: {prediction['DeltaG']:.3f} vs {expected:.3f} "
+              f"({error:+.3f}), ICs {prediction['ICs']} vs {row['ICs']}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PRODIGY binding affinity (IC-NIS) for a folder of complexes")
+    parser.add_argument("pdb_dir", nargs='?', help="Folder of complex PDB files (e.g. md_output)")
+    parser.add_argument("output_csv", nargs='?', help="CSV to write (File, DeltaG (kcal/mol))")
+    parser.add_argument("--binder-chain", default='A', help="Binder chain (default: A)")
+    parser.add_argument("--target-chains", default=None,
+                        help="Comma-separated target chains, e.g. C,D (default: every other chain)")
+    parser.add_argument("--distance-cutoff", type=float, default=DISTANCE_CUTOFF,
+                        help=f"Contact distance cutoff in Angstrom (default: {DISTANCE_CUTOFF})")
+    parser.add_argument("--acc-threshold", type=float, default=ACC_THRESHOLD,
+                        help=f"Relative SASA above which a residue is on the surface (default: {ACC_THRESHOLD})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--validate", action="store_true",
+                        help="Check the predictions for the bundled example complexes and exit")
+    args = parser.parse_args()
+
+    if args.validate:
+        sys.exit(0 if validate() else 1)
+    if not args.pdb_dir or not args.output_csv:
+        parser.error("pdb_dir and output_csv are required")
+
+    target_chains = args.target_chains.split(',') if args.target_chains else None
+    scored = score_directory(args.pdb_dir, args.output_csv, args.binder_chain, target_chains, args.workers,
+                             args.distance_cutoff, args.acc_threshold)
+    print(f"Scored {scored} complexes from {args.pdb_dir} into {args.output_csv}")
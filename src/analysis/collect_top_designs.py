@@ -1,11 +1,27 @@
 import os
+import sys
 import csv
-import shutil
-
-def collect_and_sort_designs(rounds_dir, output_dir, top_n=300):
-    all_data = []
-
-    # Iterate over all rounds
+import heapq
+import argparse
+from functools import lru_cache
+from collections import Counter
+
+from file_links import LINK_MODES, link_or_copy
+from diversity import DIVERSITY_MODES, DiversityFilter, select_diverse
+from design_registry import DesignRegistry
+
+ENERGY_FIELDS = ['TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol', 'DeltaG_kcal/mol', 'binder_aligned_rmsd', 'Rg']
+# Written into each round folder by align.py and merge_energies_post.py --registry
+REGISTRY_FILE = 'design_registry.json'
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None  # Handle missing or invalid values
+
+def iter_merged_csvs(rounds_dir):
+    # (round_folder, merged_csv_path) for every round that has been merged
     for round_folder in sorted(os.listdir(rounds_dir)):
         round_path = os.path.join(rounds_dir, round_folder)
         if not os.path.isdir(round_path):
@@ -15,57 +31,139 @@ def collect_and_sort_designs(rounds_dir, output_dir, top_n=300):
         if not os.path.isfile(merged_csv_path):
             print(f"No merged_energies_post.csv in {round_path}")
             continue
+        yield round_folder, merged_csv_path
+
+def row_results_format(row):
+    # Merged CSVs from before the column was written hold format 1 energies
+    return row.get('ResultsFormat') or '1'
 
-        # Read merged_energies.csv
+def results_formats_by_round(rounds_dir):
+    # {ResultsFormat: [round, ...]} over the rows iter_scored_rows ranks
+    formats = {}
+    for round_folder, merged_csv_path in iter_merged_csvs(rounds_dir):
         with open(merged_csv_path, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
+            for row in csv.DictReader(csvfile):
+                if row.get('CarriedFrom'):
+                    continue
+                rounds = formats.setdefault(row_results_format(row), [])
+                if round_folder not in rounds:
+                    rounds.append(round_folder)
+    return formats
+
+def check_results_formats(rounds_dir, results_format=None):
+    # Energies of different run_md.py results formats are not comparable (see
+    # run_md.ENERGY_RESULTS_FORMAT), so they are never ranked together
+    formats = results_formats_by_round(rounds_dir)
+    if results_format is not None:
+        if str(results_format) not in formats:
+            raise ValueError(f"No rows with ResultsFormat {results_format} in {rounds_dir}")
+        return
+    if len(formats) > 1:
+        detail = "; ".join(f"format {fmt}: {', '.join(rounds)}" for fmt, rounds in sorted(formats.items()))
+        raise ValueError(f"Rounds in {rounds_dir} mix energy results formats ({detail}); "
+                         f"re-run MD for the older rounds or pick one with --results-format")
+
+def iter_scored_rows(rounds_dir, results_format=None):
+    # Yield (score, row) for every usable row of every round, reading the CSVs
+    # lazily. Only Score and binder_aligned_rmsd are converted here; the other
+    # fields are converted for the selected rows only.
+    for round_folder, merged_csv_path in iter_merged_csvs(rounds_dir):
+        with open(merged_csv_path, 'r') as csvfile:
+            for row in csv.DictReader(csvfile):
+                # Designs carried forward by campaign.py are counted in the
+                # round they were simulated in
+                if row.get('CarriedFrom'):
+                    continue
+                if results_format is not None and row_results_format(row) != str(results_format):
+                    continue
+                # Skip rows with invalid scores or missing binder_aligned_rmsd
+                score = _to_float(row.get('Score'))
+                if score is None or _to_float(row.get('binder_aligned_rmsd')) is None:
+                    continue
                 # Add round information to row
                 row['Round'] = round_folder
-                all_data.append(row)
-
-    # Convert energies to floats and handle missing or invalid data
-    for row in all_data:
-        try:
-            row['Score'] = float(row['Score'])
-        except (ValueError, TypeError):
-            row['Score'] = None  # Handle invalid scores
-        # Convert other energy fields as needed
-        for key in ['TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol', 'DeltaG_kcal/mol', 'binder_aligned_rmsd', 'Rg']:
-            try:
-                row[key] = float(row[key])
-            except (ValueError, TypeError):
-                row[key] = None  # Handle missing or invalid values
-
-    # Remove rows with invalid scores or missing binder_aligned_rmsd
-    all_data = [row for row in all_data if row['Score'] is not None and row['binder_aligned_rmsd'] is not None]
-
-    # Sort all data by Score (ascending)
-    sorted_data = sorted(all_data, key=lambda x: x['Score'])
+                yield score, row
+
+def select_top_rows(rounds_dir, top_n, results_format=None):
+    # Bounded heap of the best (lowest) scores. heapq.nsmallest is stable, so
+    # ties keep their read order exactly as a full sort would.
+    top_designs = []
+    for score, row in heapq.nsmallest(top_n, iter_scored_rows(rounds_dir, results_format), key=lambda item: item[0]):
+        row['Score'] = score
+        for key in ENERGY_FIELDS:
+            row[key] = _to_float(row.get(key))
+        top_designs.append(row)
+    return top_designs
+
+@lru_cache(maxsize=None)
+def load_round_registry(registry_path):
+    if not os.path.isfile(registry_path):
+        return None
+    return DesignRegistry(registry_path)
+
+def md_pdb_path(rounds_dir, row):
+    # The design's MD PDB as recorded in the round's design registry; rounds
+    # without one, and rows merged before the Design column, use
+    # rounds/$i/md_output/
+    registry = load_round_registry(os.path.join(rounds_dir, row['Round'], REGISTRY_FILE))
+    if registry is not None and row.get('Design'):
+        for pdb_path in registry.paths(row['Design'], 'md'):
+            if os.path.basename(pdb_path) == row['OutputName'] + '.pdb':
+                return pdb_path
+    return os.path.join(rounds_dir, row['Round'], 'md_output', row['OutputName'] + '.pdb')
+
+def select_diverse_rows(rounds_dir, top_n, diversity_filter, workers=None, results_format=None):
+    # Best-scoring rows with at most max_per_cluster per sequence/structure
+    # cluster. Candidates are sorted in full (stable, like select_top_rows)
+    # and only read from disk until top_n are selected.
+    candidates = [(row, md_pdb_path(rounds_dir, row))
+                  for score, row in sorted(iter_scored_rows(rounds_dir, results_format), key=lambda item: item[0])]
+    selected, report = select_diverse(candidates, top_n, diversity_filter, workers)
+    top_designs = []
+    for row, _ in selected:
+        row['Score'] = _to_float(row['Score'])
+        for key in ENERGY_FIELDS:
+            row[key] = _to_float(row.get(key))
+        top_designs.append(row)
+    return top_designs, report
+
+def write_cluster_report(report_path, report):
+    with open(report_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['OutputName', 'Round', 'Score', 'Cluster', 'Selected'])
+        for row, cluster, accepted in report:
+            writer.writerow([row['OutputName'], row['Round'], row['Score'], cluster, int(accepted)])
+
+def collect_and_sort_designs(rounds_dir, output_dir, top_n=300, link_mode='reflink', diversity='none',
+                             seq_threshold=0.5, rmsd_threshold=2.0, max_per_cluster=1, workers=None,
+                             results_format=None):
+    check_results_formats(rounds_dir, results_format)
 
     # Take top N designs
-    top_designs = sorted_data[:top_n]
+    cluster_report = None
+    if diversity == 'none':
+        top_designs = select_top_rows(rounds_dir, top_n, results_format)
+    else:
+        diversity_filter = DiversityFilter(diversity, seq_threshold, rmsd_threshold, max_per_cluster)
+        top_designs, cluster_report = select_diverse_rows(rounds_dir, top_n, diversity_filter, workers,
+                                                          results_format)
 
     # Prepare output CSV data
     output_csv_rows = []
     output_csv_header = [
-        'Rank', 'OutputName', 'Round', 'TotalEnergy_kJ/mol',
+        'Rank', 'OutputName', 'Design', 'PdbFile', 'Round', 'TotalEnergy_kJ/mol',
         'InteractionEnergy_kJ/mol', 'DeltaG_kcal/mol',
-        'binder_aligned_rmsd', 'Rg', 'Score'
+        'binder_aligned_rmsd', 'Rg', 'Score', 'ResultsFormat'
     ]
 
     # Create output directory for PDB files
     os.makedirs(output_dir, exist_ok=True)
 
-    # For each top design, copy the PDB file and rename it
+    # For each top design, link (or copy) the PDB file under its new name
+    link_counts = Counter()
     for rank, row in enumerate(top_designs, start=1):
         output_name = row['OutputName']
-        round_folder = row['Round']
-
-        # Locate the PDB file in rounds/$i/md_output/
-        pdb_filename = output_name + '.pdb'
-        md_output_dir = os.path.join(rounds_dir, round_folder, 'md_output')
-        pdb_path = os.path.join(md_output_dir, pdb_filename)
+        pdb_path = md_pdb_path(rounds_dir, row)
 
         if not os.path.isfile(pdb_path):
             print(f"PDB file {pdb_path} not found.")
@@ -75,11 +173,11 @@ def collect_and_sort_designs(rounds_dir, output_dir, top_n=300):
         new_pdb_filename = f"{rank:03d}_{output_name}.pdb"
         dest_pdb_path = os.path.join(output_dir, new_pdb_filename)
 
-        # Copy and rename the PDB file
-        shutil.copyfile(pdb_path, dest_pdb_path)
+        link_counts[link_or_copy(pdb_path, dest_pdb_path, link_mode)] += 1
 
         # Add rank to the row and collect for output CSV
         row['Rank'] = rank
+        row['PdbFile'] = new_pdb_filename
         output_csv_rows.append(row)
 
     # Write the sorted designs and their data to a new CSV file
@@ -91,6 +189,8 @@ def collect_and_sort_designs(rounds_dir, output_dir, top_n=300):
             writer.writerow({
                 'Rank': row['Rank'],
                 'OutputName': row['OutputName'],
+                'Design': row.get('Design', ''),
+                'PdbFile': row['PdbFile'],
                 'Round': row['Round'],
                 'TotalEnergy_kJ/mol': row['TotalEnergy_kJ/mol'],
                 'InteractionEnergy_kJ/mol': row['InteractionEnergy_kJ/mol'],
@@ -98,16 +198,45 @@ def collect_and_sort_designs(rounds_dir, output_dir, top_n=300):
                 'binder_aligned_rmsd': row['binder_aligned_rmsd'],
                 'Rg': row['Rg'],
                 'Score': row['Score'],
+                'ResultsFormat': row_results_format(row),
             })
 
-    print(f"Top {len(output_csv_rows)} designs have been copied and data saved to {output_csv_path}")
+    print(f"Top {len(output_csv_rows)} designs have been collected and data saved to {output_csv_path}")
+    if cluster_report is not None:
+        report_path = os.path.join(output_dir, 'diversity_clusters.csv')
+        write_cluster_report(report_path, cluster_report)
+        clusters = len({cluster for _, cluster, _ in cluster_report})
+        print(f"{len(cluster_report)} candidates examined in {clusters} clusters, see {report_path}")
+    if link_counts:
+        print("PDB files materialized as: " + ", ".join(f"{count} {method}" for method, count in sorted(link_counts.items())))
 
 if __name__ == '__main__':
-    # Set the path to the directory containing the rounds folders
-    rounds_dir = 'rounds_old4'  # Adjust this if your rounds directory is named differently
-    output_dir = 'top_designs_old'  # Directory to save top PDBs and CSV file
-    collect_and_sort_designs(rounds_dir, output_dir, top_n=500)
-    
-    rounds_dir = 'rounds'  # Adjust this if your rounds directory is named differently
-    output_dir = 'top_designs'  # Directory to save top PDBs and CSV file
-    collect_and_sort_designs(rounds_dir, output_dir, top_n=1000)
+    parser = argparse.ArgumentParser(description="Collect the best-scoring designs across all rounds")
+    parser.add_argument('rounds_dir', nargs='?', default='rounds',
+                        help="Directory containing the round folders (default: rounds)")
+    parser.add_argument('output_dir', nargs='?', default='top_designs',
+                        help="Directory to save top PDBs and CSV file (default: top_designs)")
+    parser.add_argument('--top-n', type=int, default=1000, help="Number of designs to keep")
+    parser.add_argument('--link-mode', choices=LINK_MODES, default='reflink',
+                        help="How PDB files are placed in the output directory (default: reflink, else copy; "
+                             "'auto' also tries a hardlink, which follows later in-place rewrites of the MD PDBs)")
+    parser.add_argument('--diversity', choices=DIVERSITY_MODES, default='none',
+                        help="Cluster candidates by chain A sequence and/or CA structure before picking (default: none)")
+    parser.add_argument('--seq-threshold', type=float, default=0.5,
+                        help="3-mer Jaccard similarity at which two sequences share a cluster")
+    parser.add_argument('--rmsd-threshold', type=float, default=2.0,
+                        help="Chain A CA-RMSD in Angstrom at which two structures share a cluster")
+    parser.add_argument('--max-per-cluster', type=int, default=1, help="Designs kept from each cluster")
+    parser.add_argument('--workers', type=int, default=None, help="Processes used to read PDB files")
+    parser.add_argument('--results-format', type=int, default=None,
+                        help="Only rank rows with this run_md.py ResultsFormat; needed when rounds mix formats")
+    args = parser.parse_args()
+
+    try:
+        collect_and_sort_designs(args.rounds_dir, args.output_dir, top_n=args.top_n, link_mode=args.link_mode,
+                                 diversity=args.diversity, seq_threshold=args.seq_threshold,
+                                 rmsd_threshold=args.rmsd_threshold, max_per_cluster=args.max_per_cluster,
+                                 workers=args.workers, results_format=args.results_format)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -1,14 +1,97 @@
 import os
 import csv
 import shutil
-from Bio.PDB import PDBParser, PPBuilder
+import argparse
+
+from sequences import extract_sequences
+from diversity import DIVERSITY_MODES, DiversityFilter, load_ca_coords
+
+TEAM_NAME = "Molecule_Masters"
+
+def find_source_pdb(row, pdb_subfolder=''):
+    # Path of a design's PDB in its source folder, or None if it is missing
+    source_folder = row['SourceFolder']
+    # The file collect_top_designs.py recorded; older CSVs only have the
+    # original rank in the source folder to rebuild the name from
+    pdb_filename = row.get('PdbFile') or f"{int(row['SourceRank']):03d}_{row['OutputName']}.pdb"
+    for source_pdb_path in (os.path.join(source_folder, pdb_filename),
+                            os.path.join(source_folder, pdb_subfolder, pdb_filename)):
+        if os.path.isfile(source_pdb_path):
+            return source_pdb_path
+    print(f"PDB file {pdb_filename} not found in {source_folder}.")
+    return None
+
+def select_unique_designs(sorted_data, consolidated_top_n, pdb_subfolder='', skip_duplicates=True,
+                          workers=None, cache_path=None, diversity_filter=None):
+    # Walk the ranked candidates, reading chain A sequences a window at a time,
+    # until consolidated_top_n designs are selected. With skip_duplicates, a
+    # design whose sequence was already selected is passed over and the slot
+    # goes to the next candidate. A diversity_filter further limits how many
+    # designs each sequence/structure cluster contributes. Returns (selected,
+    # duplicates, cluster_report) where selected holds (row, source_pdb_path,
+    # sequence), duplicates (row, kept_row) and cluster_report (row, cluster,
+    # accepted).
+    selected = []
+    duplicates = []
+    cluster_report = []
+    seen = {}
+    position = 0
+    while len(selected) < consolidated_top_n and position < len(sorted_data):
+        remaining = consolidated_top_n - len(selected)
+        window = sorted_data[position:position + (remaining if diversity_filter is None else max(2 * remaining, 64))]
+        position += len(window)
+        candidates = [(row, find_source_pdb(row, pdb_subfolder)) for row in window]
+        candidates = [(row, path) for row, path in candidates if path is not None]
+        sequences = extract_sequences([path for _, path in candidates], 'A', workers, cache_path)
+        if diversity_filter is not None and diversity_filter.use_structure:
+            ca_coords = load_ca_coords([path for _, path in candidates], workers)
+        else:
+            ca_coords = [None] * len(candidates)
+
+        for (row, source_pdb_path), (sequence, error), coords in zip(candidates, sequences, ca_coords):
+            if len(selected) >= consolidated_top_n:
+                break
+            if error is not None:
+                print(f"Error extracting sequence from {source_pdb_path}: {error}")
+                continue
+            if sequence:
+                kept_row = seen.get(sequence)
+                if kept_row is not None:
+                    duplicates.append((row, kept_row))
+                    if skip_duplicates:
+                        continue
+                else:
+                    seen[sequence] = row
+            if diversity_filter is not None:
+                cluster, accepted = diversity_filter.assign(sequence, coords)
+                cluster_report.append((row, cluster, accepted))
+                if not accepted:
+                    continue
+            selected.append((row, source_pdb_path, sequence))
+    return selected, duplicates, cluster_report
+
+def write_duplicate_report(report_path, duplicates):
+    with open(report_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['OutputName', 'SourceFolder', 'SourceRank', 'Score',
+                         'DuplicateOf', 'DuplicateOfFolder', 'DuplicateOfSourceRank'])
+        for row, kept_row in duplicates:
+            writer.writerow([row['OutputName'], row['SourceFolder'], row['SourceRank'], row['Score'],
+                             kept_row['OutputName'], kept_row['SourceFolder'], kept_row['SourceRank']])
 
 def consolidate_designs(
     top_designs_dirs,
     output_dir,
     consolidated_top_n=500,
     pdb_subfolder='',
-    csv_filename='top_designs.csv'
+    csv_filename='top_designs.csv',
+    skip_duplicates=True,
+    workers=None,
+    sequence_cache=None,
+    diversity='none',
+    seq_threshold=0.5,
+    rmsd_threshold=2.0,
+    max_per_cluster=1
 ):
     all_data = []
 
@@ -48,9 +131,6 @@ def consolidate_designs(
     # Sort all data by Score (ascending)
     sorted_data = sorted(all_data, key=lambda x: x['Score'])
 
-    # Take top N designs
-    top_designs = sorted_data[:consolidated_top_n]
-
     # Prepare output CSV data
     output_csv_rows = []
     output_csv_header = [
@@ -60,31 +140,21 @@ def consolidate_designs(
 
     # Create output directory for PDB files
     os.makedirs(output_dir, exist_ok=True)
-
-    # Prepare to extract sequences
-    parser = PDBParser(QUIET=True)
-    ppb = PPBuilder()
+    if sequence_cache is None:
+        sequence_cache = os.path.join(output_dir, '.sequence_cache.json')
+
+    # Take top N designs, reading only chain A of each candidate's PDB
+    diversity_filter = None
+    if diversity != 'none':
+        diversity_filter = DiversityFilter(diversity, seq_threshold, rmsd_threshold, max_per_cluster)
+    top_designs, duplicates, cluster_report = select_unique_designs(
+        sorted_data, consolidated_top_n, pdb_subfolder, skip_duplicates, workers, sequence_cache, diversity_filter)
     fasta_lines = []
 
     # For each top design, copy the PDB file and rename it
-    for rank, row in enumerate(top_designs, start=1):
+    for rank, (row, source_pdb_path, sequence) in enumerate(top_designs, start=1):
         output_name = row['OutputName']
         source_folder = row['SourceFolder']
-        source_rank = int(row['SourceRank'])  # Use the original rank from the source folder
-        round_folder = row.get('Round', '')
-        source_designs_dir = os.path.join(source_folder, pdb_subfolder)
-
-        # Construct the PDB filename using the source rank
-        pdb_filename = f"{source_rank:03d}_{output_name}.pdb"
-        source_pdb_path = os.path.join(source_folder, pdb_filename)
-
-        # If the PDB file is not found in the source folder, try to locate it
-        if not os.path.isfile(source_pdb_path):
-            # Try to find the PDB in the source designs directory
-            source_pdb_path = os.path.join(source_folder, pdb_subfolder, pdb_filename)
-            if not os.path.isfile(source_pdb_path):
-                print(f"PDB file {pdb_filename} not found in {source_folder}.")
-                continue
 
         # Prepare new PDB filename with numerical prefix and source folder identification
         new_pdb_filename = f"{rank:03d}_{source_folder}_{output_name}.pdb"
@@ -93,19 +163,9 @@ def consolidate_designs(
         # Copy and rename the PDB file
         shutil.copyfile(source_pdb_path, dest_pdb_path)
 
-        team_name = "Molecule_Masters"
-        # Extract the sequence of chain A
-        try:
-            structure = parser.get_structure(output_name, dest_pdb_path)
-            for model in structure:
-                for chain in model:
-                    if chain.id == 'A':
-                        sequence = ''.join(str(pp.get_sequence()) for pp in ppb.build_peptides(chain))
-                        fasta_lines.append(f">{rank:03d}_{team_name}\n{sequence}")
-                        break  # Only process chain A
-        except Exception as e:
-            print(f"Error extracting sequence from {dest_pdb_path}: {e}")
-            continue
+        # Chain A sequence (None when the PDB has no chain A)
+        if sequence is not None:
+            fasta_lines.append(f">{rank:03d}_{TEAM_NAME}\n{sequence}")
 
         # Prepare row for output CSV
         row_copy = row.copy()  # Create a copy to avoid modifying the original row
@@ -140,14 +200,47 @@ def consolidate_designs(
     print(f"Top {len(output_csv_rows)} designs have been consolidated and data saved to {output_csv_path}")
     print(f"FASTA file of chain A sequences saved to {fasta_output_path}")
 
+    if duplicates:
+        report_path = os.path.join(output_dir, 'duplicate_sequences.csv')
+        write_duplicate_report(report_path, duplicates)
+        action = "skipped" if skip_duplicates else "kept"
+        print(f"{len(duplicates)} designs with a duplicate chain A sequence {action}, see {report_path}")
+
+    if diversity_filter is not None:
+        report_path = os.path.join(output_dir, 'diversity_clusters.csv')
+        with open(report_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['OutputName', 'SourceFolder', 'SourceRank', 'Score', 'Cluster', 'Selected'])
+            for row, cluster, accepted in cluster_report:
+                writer.writerow([row['OutputName'], row['SourceFolder'], row['SourceRank'], row['Score'],
+                                 cluster, int(accepted)])
+        clusters = len({cluster for _, cluster, _ in cluster_report})
+        print(f"{len(cluster_report)} candidates examined in {clusters} clusters, see {report_path}")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge top designs from several folders into one ranked set")
     # Directories containing the top designs
-    top_designs_dirs = ['top_designs', 'top_designs_old']
-
+    parser.add_argument('top_designs_dirs', nargs='*', default=['top_designs', 'top_designs_old'])
     # Directory to save consolidated top designs
-    output_dir = 'top_designs_consolidated'
-
+    parser.add_argument('--output-dir', default='top_designs_consolidated')
     # Number of top designs to consolidate
-    consolidated_top_n = 500  # Adjust this as needed
-
-    consolidate_designs(top_designs_dirs, output_dir, consolidated_top_n)
+    parser.add_argument('--top-n', type=int, default=500)
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Keep designs whose chain A sequence was already selected (they are still reported)")
+    parser.add_argument('--workers', type=int, default=None, help="Processes used to read sequences")
+    parser.add_argument('--sequence-cache', default=None,
+                        help="JSON cache of sequences by file hash (default: <output-dir>/.sequence_cache.json)")
+    parser.add_argument('--diversity', choices=DIVERSITY_MODES, default='none',
+                        help="Cluster candidates by chain A sequence and/or CA structure before picking (default: none)")
+    parser.add_argument('--seq-threshold', type=float, default=0.5,
+                        help="3-mer Jaccard similarity at which two sequences share a cluster")
+    parser.add_argument('--rmsd-threshold', type=float, default=2.0,
+                        help="Chain A CA-RMSD in Angstrom at which two structures share a cluster")
+    parser.add_argument('--max-per-cluster', type=int, default=1, help="Designs kept from each cluster")
+    args = parser.parse_args()
+
+    consolidate_designs(args.top_designs_dirs, args.output_dir, args.top_n,
+                        skip_duplicates=not args.keep_duplicates, workers=args.workers,
+                        sequence_cache=args.sequence_cache, diversity=args.diversity,
+                        seq_threshold=args.seq_threshold, rmsd_threshold=args.rmsd_threshold,
+                        max_per_cluster=args.max_per_cluster)
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_io import read_atom_lines, atom_table, table_field, table_coords
+
+# Binary store of many design structures. Every per-atom field is one flat
+# binary file holding all designs back to back; offsets.bin gives the first
+# atom of each design. The files are opened with np.memmap in read-only mode,
+# so any number of processes can share one store without parsing PDB text.
+#
+#   <store>/index.json   version, atom count, field dtypes, design list
+#   <store>/offsets.bin  int64, n_designs + 1
+#   <store>/<field>.bin  one array per field below
+#
+# Text fields keep their raw fixed-width PDB columns (e.g. ' CA '), so export
+# reproduces the original alignment.
+
+STORE_VERSION = 1
+
+# name: (dtype, PDB columns [start, end) or None, per-atom shape)
+FIELDS = {
+    'coords': ('float32', None, (3,)),
+    'serial': ('int32', (6, 11), ()),
+    'atom_name': ('S4', (12, 16), ()),
+    'altloc': ('S1', (16, 17), ()),
+    'res_name': ('S3', (17, 20), ()),
+    'chain': ('S1', (21, 22), ()),
+    'res_seq': ('int32', (22, 26), ()),
+    'icode': ('S1', (26, 27), ()),
+    'occupancy': ('float32', (54, 60), ()),
+    'bfactor': ('float32', (60, 66), ()),
+    'element': ('S2', (76, 78), ()),
+    'hetatm': ('bool', None, ()),
+}
+
+# Folder layout of a round, as used by the analysis scripts
+DEFAULT_KINDS = ('rf', 'af2', 'aligned', 'md')
+
+
+def _numeric_field(table, start, end, dtype):
+    values = np.char.strip(table_field(table, start, end))
+    values[values == b''] = b'0'
+    return values.astype(dtype)
+
+
+def parse_structure(pdb_file_path):
+    # Per-atom arrays for one PDB file, or None if it has no atoms
+    lines = read_atom_lines(pdb_file_path)
+    if not lines:
+        return None
+    table = atom_table(lines)
+    arrays = {}
+    for name, (dtype, columns, _) in FIELDS.items():
+        if name == 'coords':
+            arrays[name] = table_coords(table).astype(np.float32)
+        elif name == 'hetatm':
+            arrays[name] = table_field(table, 0, 6) == b'HETATM'
+        elif dtype.startswith('S'):
+            arrays[name] = table_field(table, *columns).astype(dtype)
+        else:
+            arrays[name] = _numeric_field(table, columns[0], columns[1], dtype)
+    return arrays
+
+
+def _parse_job(pdb_file_path):
+    try:
+        return parse_structure(pdb_file_path), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+def _collect_sources(sources):
+    # [(kind, name, path)] for every PDB of every kind, in a stable order
+    entries = []
+    for kind, folder in sources.items():
+        if not folder or not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.endswith('.pdb'):
+                entries.append((kind, os.path.splitext(file_name)[0], os.path.join(folder, file_name)))
+    return entries
+
+
+def ingest(store_dir, sources, workers=None, chunksize=32):
+    # Build a store from {kind: folder of PDBs}. The new store is written next
+    # to the old one and swapped in when complete, so readers never see a
+    # half-written store.
+    entries = _collect_sources(sources)
+    tmp_dir = f"{store_dir.rstrip('/')}.{os.getpid()}.tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    files = {name: open(os.path.join(tmp_dir, name + '.bin'), 'wb') for name in FIELDS}
+    offsets = [0]
+    designs = []
+    failures = {}
+    executor = None
+    try:
+        paths = [path for _, _, path in entries]
+        if workers == 1 or len(paths) < 2:
+            results = map(_parse_job, paths)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_parse_job, paths, chunksize=chunksize)
+
+        for (kind, name, path), (arrays, error) in zip(entries, results):
+            if arrays is None:
+                failures[f"{kind}/{name}"] = error or 'no atoms'
+                continue
+            for field, array in arrays.items():
+                files[field].write(np.ascontiguousarray(array).tobytes())
+            stat = os.stat(path)
+            offsets.append(offsets[-1] + len(arrays['coords']))
+            designs.append({'name': name, 'kind': kind, 'source': os.path.abspath(path),
+                            'mtime': stat.st_mtime, 'size': stat.st_size})
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for handle in files.values():
+            handle.close()
+
+    np.array(offsets, dtype=np.int64).tofile(os.path.join(tmp_dir, 'offsets.bin'))
+    index = {
+        'version': STORE_VERSION,
+        'n_atoms': offsets[-1],
+        'fields': {name: [dtype, list(shape)] for name, (dtype, _, shape) in FIELDS.items()},
+        'designs': designs,
+    }
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as index_file:
+        json.dump(index, index_file)
+
+    old_dir = None
+    if os.path.isdir(store_dir):
+        old_dir = f"{store_dir.rstrip('/')}.{os.getpid()}.old"
+        os.rename(store_dir, old_dir)
+    os.rename(tmp_dir, store_dir)
+    if old_dir:
+        shutil.rmtree(old_dir)
+
+    print(f"Stored {len(designs)} structures ({offsets[-1]} atoms) in {store_dir}, {len(failures)} failed")
+    for key, error in sorted(failures.items()):
+        print(f"  {key}: {error}")
+    return len(designs)
+
+
+class CoordStore:
+    # Read-only view of a store. Arrays are memory-mapped lazily; slicing a
+    # design only touches the pages holding its atoms.
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'index.json'), 'r') as index_file:
+            self.index = json.load(index_file)
+        if self.index.get('version') != STORE_VERSION:
+            raise ValueError(f"{store_dir} has store version {self.index.get('version')}, expected {STORE_VERSION}")
+        self.designs = self.index['designs']
+        self.n_atoms = self.index['n_atoms']
+        self.offsets = np.fromfile(os.path.join(store_dir, 'offsets.bin'), dtype=np.int64)
+        self.lookup = {}
+        for position, design in enumerate(self.designs):
+            self.lookup[(design['kind'], design['name'])] = position
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.designs)
+
+    def __contains__(self, key):
+        return key in self.lookup
+
+    def is_current(self, kind, name, pdb_file_path):
+        # True if the design is stored and pdb_file_path still has the mtime
+        # and size it had when it was ingested
+        if (kind, name) not in self.lookup:
+            return False
+        try:
+            stat = os.stat(pdb_file_path)
+        except OSError:
+            return False
+        design = self.designs[self.lookup[(kind, name)]]
+        return design['mtime'] == stat.st_mtime and design['size'] == stat.st_size
+
+    def keys(self, kind=None):
+        return [(d['kind'], d['name']) for d in self.designs if kind is None or d['kind'] == kind]
+
+    def field(self, name):
+        # Whole-store array for one field (read-only memmap)
+        if name not in self._arrays:
+            dtype, shape = self.index['fields'][name]
+            if self.n_atoms == 0:
+                self._arrays[name] = np.empty((0,) + tuple(shape), dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(os.path.join(self.store_dir, name + '.bin'), dtype=dtype,
+                                               mode='r', shape=(self.n_atoms,) + tuple(shape))
+        return self._arrays[name]
+
+    def span(self, kind, name):
+        position = self.lookup[(kind, name)]
+        return int(self.offsets[position]), int(self.offsets[position + 1])
+
+    def coords(self, kind, name, chain_id=None):
+        start, end = self.span(kind, name)
+        coords = self.field('coords')[start:end]
+        if chain_id is None:
+            return coords
+        return coords[self.field('chain')[start:end] == chain_id.encode()]
+
+    def atoms(self, kind, name):
+        # Every field of one design as {field: array}
+        start, end = self.span(kind, name)
+        return {field: self.field(field)[start:end] for field in self.index['fields']}
+
+    def radius_of_gyration(self, kind, chain_id='A', names=None):
+        # {name: Rg} of one chain for every design of a kind (or the given
+        # names), in one vectorized pass over the mapped arrays
+        names = [n for k, n in self.keys(kind)] if names is None else list(names)
+        results = {name: None for name in names}
+        positions = np.array(sorted(self.lookup[(kind, n)] for n in names if (kind, n) in self.lookup),
+                             dtype=np.int64)
+        if len(positions) == 0:
+            return results
+
+        low, high = int(self.offsets[positions[0]]), int(self.offsets[positions[-1] + 1])
+        atom_index = np.nonzero(self.field('chain')[low:high] == chain_id.encode())[0] + low
+        owner = np.searchsorted(self.offsets, atom_index, side='right') - 1
+        keep = np.isin(owner, positions)
+        atom_index, owner = atom_index[keep], owner[keep]
+        if len(atom_index) == 0:
+            return results
+
+        coords = np.asarray(self.field('coords')[atom_index], dtype=np.float64)
+        present, segment = np.unique(owner, return_inverse=True)
+        counts = np.bincount(segment)
+        centers = np.stack([np.bincount(segment, coords[:, axis]) for axis in range(3)], axis=1) / counts[:, None]
+        sq_dist = ((coords - centers[segment]) ** 2).sum(axis=1)
+        rg = np.sqrt(np.bincount(segment, sq_dist) / counts)
+        for position, value in zip(present.tolist(), rg.tolist()):
+            results[self.designs[position]['name']] = value
+        return results
+
+    def to_pdb(self, kind, name, output_pdb_path):
+        # Write one design back out as a PDB file
+        atoms = self.atoms(kind, name)
+        lines = []
+        previous_chain = None
+        for i in range(len(atoms['coords'])):
+            chain = atoms['chain'][i].decode()
+            if previous_chain is not None and chain != previous_chain:
+                lines.append('TER')
+            previous_chain = chain
+            x, y, z = atoms['coords'][i]
+            record = 'HETATM' if atoms['hetatm'][i] else 'ATOM'
+            lines.append(
+                f"{record:<6}{int(atoms['serial'][i]) % 100000:5d} {atoms['atom_name'][i].decode():<4}"
+                f"{atoms['altloc'][i].decode():1}{atoms['res_name'][i].decode():>3} {chain:1}"
+                f"{int(atoms['res_seq'][i]):4d}{atoms['icode'][i].decode():1}   "
+                f"{x:8.3f}{y:8.3f}{z:8.3f}{float(atoms['occupancy'][i]):6.2f}{float(atoms['bfactor'][i]):6.2f}"
+                f"          {atoms['element'][i].decode():>2}")
+        if lines:
+            lines.append('TER')
+        lines.append('END')
+        with open(output_pdb_path, 'w') as pdb_file:
+            pdb_file.write('\n'.join(lines) + '\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped coordinate store for design structures")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Build a store from folders of PDB files")
+    ingest_parser.add_argument("store_dir")
+    for kind in DEFAULT_KINDS:
+        ingest_parser.add_argument(f"--{kind}", default=None, help=f"Folder of {kind} PDB files")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="Processes used to parse PDB files")
+
+    export_parser = subparsers.add_parser("export", help="Write stored structures back to PDB files")
+    export_parser.add_argument("store_dir")
+    export_parser.add_argument("kind", choices=DEFAULT_KINDS)
+    export_parser.add_argument("output_dir")
+    export_parser.add_argument("names", nargs='*', help="Designs to export (default: all of this kind)")
+
+    info_parser = subparsers.add_parser("info", help="Summarize a store")
+    info_parser.add_argument("store_dir")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        sources = {kind: getattr(args, kind) for kind in DEFAULT_KINDS if getattr(args, kind)}
+        if not sources:
+            print("Nothing to ingest: give at least one of " + ", ".join(f"--{k}" for k in DEFAULT_KINDS))
+            sys.exit(1)
+        ingest(args.store_dir, sources, args.workers)
+    elif args.command == "export":
+        store = CoordStore(args.store_dir)
+        names = args.names or [name for _, name in store.keys(args.kind)]
+        os.makedirs(args.output_dir, exist_ok=True)
+        for name in names:
+            if (args.kind, name) not in store:
+                print(f"{args.kind}/{name} is not in {args.store_dir}")
+                continue
+            store.to_pdb(args.kind, name, os.path.join(args.output_dir, name + '.pdb'))
+        print(f"Exported {len(names)} structures to {args.output_dir}")
+    else:
+        store = CoordStore(args.store_dir)
+        counts = {}
+        for design in store.designs:
+            counts[design['kind']] = counts.get(design['kind'], 0) + 1
+        size = sum(os.path.getsize(os.path.join(args.store_dir, f)) for f in os.listdir(args.store_dir))
+        print(f"{len(store)} structures, {store.n_atoms} atoms, {size / 1024**2:.1f} MB")
+        for kind, count in sorted(counts.items()):
+            print(f"  {kind:<8} {count}")
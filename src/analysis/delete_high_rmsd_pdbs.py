@@ -1,51 +1,34 @@
 import os
 import sys
 
-def delete_high_rmsd_pdbs(af2_score_path, pdb_dirs, rmsd_threshold=6.0):
+from af2_scores import load_scores
+from triage import evaluate_predicate
+
+# Deletes the PDBs of rejected designs. triage.py applies the same kind of
+# predicate without deleting anything and writes a keep-list instead.
+
+def delete_high_rmsd_pdbs(af2_score_path, pdb_dirs, rmsd_threshold=6.0, predicate=None):
     # Read af2 score file (out_*.sc) to identify high RMSD designs
-    high_rmsd_designs = []
-    with open(af2_score_path, 'r') as af2_file:
-        header = None
-        for line in af2_file:
-            line = line.strip()
-            if not line.startswith('SCORE:'):
-                continue
-            parts = line.split()
-            if 'binder_aligned_rmsd' in line and 'description' in line:
-                # This is the header line
-                header = parts[1:]  # Skip 'SCORE:'
-                # Find the index of 'binder_aligned_rmsd' and 'description'
-                try:
-                    rmsd_index = header.index('binder_aligned_rmsd')
-                    description_index = header.index('description')
-                except ValueError as e:
-                    print(f"Error: Column not found in header: {e}")
-                    sys.exit(1)
-                continue
-            elif header is not None:
-                # This is a data line
-                data = parts[1:]  # Skip 'SCORE:'
-                # Ensure the data has enough columns
-                if len(data) < max(rmsd_index, description_index) + 1:
-                    print(f"Warning: Incomplete data line skipped: {line}")
-                    continue
-                try:
-                    binder_aligned_rmsd = float(data[rmsd_index])
-                    description = data[description_index]
-                    if binder_aligned_rmsd > rmsd_threshold:
-                        high_rmsd_designs.append(description)
-                except ValueError as e:
-                    print(f"Error parsing line: {line}. Error: {e}")
-                    continue
-            else:
-                print("Warning: Data line encountered before header. Skipping line.")
-                continue
+    scores = load_scores(af2_score_path)
+    if predicate is None:
+        if 'binder_aligned_rmsd' not in scores:
+            print(f"Error: Column not found in header: 'binder_aligned_rmsd' in {af2_score_path}")
+            sys.exit(1)
+        predicate = f"binder_aligned_rmsd > {rmsd_threshold}"
+    try:
+        rejected = evaluate_predicate(scores, predicate)
+    except ValueError as e:
+        print(f"Error: {e} in {af2_score_path}")
+        sys.exit(1)
+    high_rmsd_designs = scores.descriptions[rejected].tolist()
 
-    # Delete corresponding PDB files from specified directories
-    for design in high_rmsd_designs:
-        for pdb_dir in pdb_dirs:
+    # Delete corresponding PDB files from specified directories, listing each
+    # directory once instead of checking every design separately
+    for pdb_dir in pdb_dirs:
+        present = set(os.listdir(pdb_dir)) if os.path.isdir(pdb_dir) else set()
+        for design in high_rmsd_designs:
             pdb_path = os.path.join(pdb_dir, design + '.pdb')
-            if os.path.isfile(pdb_path):
+            if design + '.pdb' in present:
                 os.remove(pdb_path)
                 print(f"Deleted {pdb_path}")
             else:
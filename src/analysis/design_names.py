@@ -0,0 +1,19 @@
+import re
+from functools import lru_cache
+
+# Memoized: the same names are resolved once per score row, file and table
+# join, and the answer never changes for a given name
+@lru_cache(maxsize=1 << 20)
+def extract_base_design_name(name):
+    # Remove prefixes
+    name = re.sub(r'^rnd\d+_binder_design_', 'binder_design_', name)
+    name = re.sub(r'^rnd\d+_', '', name)
+    # Remove suffixes
+    name = re.sub(r'_aligned_md$', '', name)
+    name = re.sub(r'_fixed$', '', name)  # Before _aligned: run_md.py writes <name>_aligned_fixed
+    name = re.sub(r'_aligned$', '', name)
+    name = re.sub(r'_md$', '', name)
+    name = re.sub(r'_dldesign_.*$', '', name)
+    name = re.sub(r'_cycle.*$', '', name)
+    name = re.sub(r'_af2pred$', '', name)
+    return name
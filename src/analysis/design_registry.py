@@ -0,0 +1,324 @@
+import os
+import csv
+import sys
+import json
+import hashlib
+import argparse
+
+from af2_scores import parse_score_lines
+from design_names import extract_base_design_name
+
+# Registry of every artifact of every design in a round, keyed by design ID
+# (the RFdiffusion backbone name, e.g. binder_design_12). Each stage folder is
+# listed once and every file name is mapped to its ID exactly, so
+# binder_design_1 never picks up binder_design_10's files. Score tables are
+# indexed by row key (AF2 description, MD OutputName). The registry is saved
+# as JSON; refresh() only relists folders whose mtime changed and only reads
+# table rows appended since the last refresh.
+
+REGISTRY_VERSION = 1
+ARTIFACT_KINDS = ('rf', 'mpnn', 'af2', 'aligned', 'fixed', 'md')
+TABLE_KINDS = ('scores', 'energies')
+TAIL_CHECK_BYTES = 4096
+
+
+def design_id(file_name):
+    # Design ID of an artifact file name (extension and stage suffixes removed)
+    stem = file_name[:-4] if file_name.endswith('.pdb') else os.path.splitext(file_name)[0]
+    return extract_base_design_name(stem)
+
+
+def scan_designs(directory, suffix='.pdb', keep=None):
+    # {design ID: sorted file names} from a single listing of directory. With a
+    # keep set, only files whose stem is in it are listed.
+    designs = {}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(suffix):
+            continue
+        if keep is not None and file_name[:-len(suffix)] not in keep:
+            continue
+        designs.setdefault(design_id(file_name), []).append(file_name)
+    return designs
+
+
+def _tail_hash(source_file, offset):
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    source_file.seek(start)
+    return hashlib.sha1(source_file.read(offset - start)).hexdigest()
+
+
+class DesignRegistry:
+    def __init__(self, registry_path=None):
+        self.registry_path = registry_path
+        self.directories = {}  # kind -> {'path', 'suffix', 'mtime_ns', 'files': {file name: design ID}}
+        self.tables = {}       # kind -> {'path', 'offset', 'tail_hash', 'header', 'rows': {row key: design ID}}
+        self._designs = {}     # design ID -> {kind: [file names or row keys]}
+        if registry_path and os.path.isfile(registry_path):
+            self._load()
+
+    # -- Persistence ----------------------------------------------------------
+
+    def _load(self):
+        with open(self.registry_path, 'r') as registry_file:
+            state = json.load(registry_file)
+        if state.get('version') != REGISTRY_VERSION:
+            return  # Rebuilt from scratch by the next refresh
+        self.directories = state['directories']
+        self.tables = state['tables']
+        for kind, source in list(self.directories.items()) + list(self.tables.items()):
+            entries = source['files'] if kind in self.directories else source['rows']
+            for name, design in entries.items():
+                self._designs.setdefault(design, {}).setdefault(kind, []).append(name)
+
+    def save(self):
+        if not self.registry_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.registry_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as registry_file:
+            json.dump({'version': REGISTRY_VERSION, 'directories': self.directories, 'tables': self.tables},
+                      registry_file)
+        os.replace(tmp_path, self.registry_path)
+
+    # -- Sources ----------------------------------------------------------------
+
+    def add_directory(self, kind, path, suffix='.pdb'):
+        # Register (or move) the folder holding one kind of artifact
+        if kind not in ARTIFACT_KINDS:
+            raise ValueError(f"Unknown artifact kind {kind!r}, expected one of {', '.join(ARTIFACT_KINDS)}")
+        path = os.path.abspath(path)
+        source = self.directories.get(kind)
+        if source is not None and source['path'] == path and source['suffix'] == suffix:
+            return
+        if source is not None:
+            self._forget(kind, source['files'])
+        self.directories[kind] = {'path': path, 'suffix': suffix, 'mtime_ns': None, 'files': {}}
+
+    def add_table(self, kind, path):
+        # Register an AF2 score file ('scores') or an MD energies CSV ('energies')
+        if kind not in TABLE_KINDS:
+            raise ValueError(f"Unknown table kind {kind!r}, expected one of {', '.join(TABLE_KINDS)}")
+        path = os.path.abspath(path)
+        source = self.tables.get(kind)
+        if source is not None and source['path'] == path:
+            return
+        if source is not None:
+            self._forget(kind, source['rows'])
+        self.tables[kind] = {'path': path, 'offset': 0, 'tail_hash': None, 'header': None, 'rows': {}}
+
+    def _forget(self, kind, entries):
+        for name, design in entries.items():
+            names = self._designs.get(design, {}).get(kind)
+            if names is not None and name in names:
+                names.remove(name)
+                if not names:
+                    del self._designs[design][kind]
+                if not self._designs[design]:
+                    del self._designs[design]
+
+    def _remember(self, kind, name, design):
+        names = self._designs.setdefault(design, {}).setdefault(kind, [])
+        if name not in names:
+            names.append(name)
+
+    # -- Refresh ----------------------------------------------------------------
+
+    def _refresh_directory(self, kind, source):
+        try:
+            mtime_ns = os.stat(source['path']).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns is not None and mtime_ns == source['mtime_ns']:
+            return 0, 0  # No file was added, removed or renamed since the last listing
+        files = source['files']
+        present = set()
+        if mtime_ns is not None:
+            suffix = source['suffix']
+            present = {entry.name for entry in os.scandir(source['path'])
+                       if entry.name.endswith(suffix) and entry.is_file()}
+        removed = {name: files.pop(name) for name in list(files) if name not in present}
+        self._forget(kind, removed)
+        added = 0
+        for name in sorted(present):
+            if name not in files:
+                files[name] = design_id(name)
+                self._remember(kind, name, files[name])
+                added += 1
+        source['mtime_ns'] = mtime_ns
+        return added, len(removed)
+
+    def _new_table_text(self, source):
+        # Text appended since the last refresh; a file that shrank or whose
+        # bytes before the old offset changed is read again from the start
+        if not os.path.isfile(source['path']):
+            return None, False
+        with open(source['path'], 'rb') as table_file:
+            size = os.fstat(table_file.fileno()).st_size
+            offset = source['offset']
+            rewritten = size < offset or (offset and _tail_hash(table_file, offset) != source['tail_hash'])
+            if rewritten:
+                offset = 0
+            elif size == offset:
+                return None, False
+            table_file.seek(offset)
+            data = table_file.read()
+            end = data.rfind(b'\n') + 1  # A partially written last line is read next time
+            source['offset'] = offset + end
+            source['tail_hash'] = _tail_hash(table_file, source['offset'])
+        return data[:end].decode(), rewritten
+
+    def _refresh_table(self, kind, source):
+        text, rewritten = self._new_table_text(source)
+        removed = 0
+        if rewritten:
+            removed = len(source['rows'])
+            self._forget(kind, source['rows'])
+            source['rows'] = {}
+            source['header'] = None
+        if not text:
+            return 0, removed
+
+        keys = []
+        if kind == 'scores':
+            segments, source['header'] = parse_score_lines(text.splitlines(), source['header'])
+            for header, rows in segments:
+                description = header.index('description')
+                keys.extend(row[description] for row in rows)
+        else:
+            lines = text.splitlines()
+            if source['header'] is None:
+                source['header'] = lines.pop(0) if lines else None
+            if source['header'] is not None:
+                reader = csv.DictReader(lines, fieldnames=next(csv.reader([source['header']])))
+                keys.extend(row['OutputName'] for row in reader if row.get('OutputName'))
+
+        added = 0
+        rows = source['rows']
+        for key in keys:
+            if key not in rows:
+                rows[key] = extract_base_design_name(key)
+                self._remember(kind, key, rows[key])
+                added += 1
+        return added, removed
+
+    def refresh(self):
+        # Pick up files and rows that appeared (or disappeared) since the last
+        # refresh. Returns {kind: (added, removed)}.
+        changes = {}
+        for kind, source in self.directories.items():
+            changes[kind] = self._refresh_directory(kind, source)
+        for kind, source in self.tables.items():
+            changes[kind] = self._refresh_table(kind, source)
+        return changes
+
+    # -- Queries ----------------------------------------------------------------
+
+    def __contains__(self, design):
+        return design in self._designs
+
+    def __len__(self):
+        return len(self._designs)
+
+    def design_ids(self):
+        return sorted(self._designs)
+
+    def design_of(self, kind, name):
+        # Design ID a file name (artifact kinds) or row key (table kinds) is
+        # registered under; None if the name is not in the registry
+        if kind in self.directories:
+            return self.directories[kind]['files'].get(name)
+        if kind in self.tables:
+            return self.tables[kind]['rows'].get(name)
+        return None
+
+    def names(self, design, kind):
+        # File names (artifact kinds) or row keys (table kinds) of one design
+        return sorted(self._designs.get(design, {}).get(kind, []))
+
+    def paths(self, design, kind):
+        directory = self.directories.get(kind)
+        if directory is None:
+            return []
+        return [os.path.join(directory['path'], name) for name in self.names(design, kind)]
+
+    def path(self, design, kind):
+        # The single artifact of this kind, None if there is none; several
+        # (e.g. MPNN variants of one backbone) raise a ValueError
+        paths = self.paths(design, kind)
+        if len(paths) > 1:
+            raise ValueError(f"{len(paths)} {kind} files for {design}: {', '.join(os.path.basename(p) for p in paths)}")
+        return paths[0] if paths else None
+
+    def design(self, design):
+        # Every artifact path and row key of one design
+        entry = {}
+        for kind in self._designs.get(design, {}):
+            entry[kind] = self.paths(design, kind) if kind in self.directories else self.names(design, kind)
+        return entry
+
+    def with_kind(self, kind):
+        # {design ID: names} for every design having this kind
+        return {design: sorted(kinds[kind]) for design, kinds in self._designs.items() if kind in kinds}
+
+    def coverage(self):
+        # Number of designs having each registered kind
+        kinds = list(self.directories) + list(self.tables)
+        return {kind: sum(1 for entry in self._designs.values() if kind in entry) for kind in kinds}
+
+
+def build_registry(registry_path, directories=None, tables=None):
+    # Open (or create) a registry, register the given sources, refresh and save
+    registry = DesignRegistry(registry_path)
+    for kind, path in (directories or {}).items():
+        registry.add_directory(kind, path)
+    for kind, path in (tables or {}).items():
+        registry.add_table(kind, path)
+    changes = registry.refresh()
+    registry.save()
+    return registry, changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index RF, MPNN, AF2, aligned and MD artifacts by design ID")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Register folders/tables and pick up new files")
+    build_parser.add_argument("registry", help="Registry JSON file (created if missing)")
+    for kind in ARTIFACT_KINDS:
+        build_parser.add_argument(f"--{kind}", default=None, metavar="DIR", help=f"Folder of {kind} PDB files")
+    build_parser.add_argument("--scores", default=None, metavar="FILE", help="AF2 score file (out.sc)")
+    build_parser.add_argument("--energies", default=None, metavar="FILE", help="MD energies CSV")
+
+    show_parser = subparsers.add_parser('show', help="Print the artifacts of one or more designs")
+    show_parser.add_argument("registry")
+    show_parser.add_argument("designs", nargs='+', help="Design IDs, e.g. binder_design_12")
+
+    missing_parser = subparsers.add_parser('missing', help="List designs that have one kind but not another")
+    missing_parser.add_argument("registry")
+    missing_parser.add_argument("--has", default='rf', help="Kind the designs have (default: rf)")
+    missing_parser.add_argument("--lacks", required=True, help="Kind the designs lack, e.g. md")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        directories = {kind: getattr(args, kind) for kind in ARTIFACT_KINDS if getattr(args, kind)}
+        tables = {kind: getattr(args, kind) for kind in TABLE_KINDS if getattr(args, kind)}
+        registry, changes = build_registry(args.registry, directories, tables)
+        print(f"{len(registry)} designs in {args.registry}")
+        coverage = registry.coverage()
+        for kind, (added, removed) in changes.items():
+            print(f"  {kind:<9}{coverage[kind]:>8} designs  (+{added} / -{removed})")
+        sys.exit(0)
+
+    if not os.path.isfile(args.registry):
+        print(f"Registry not found: {args.registry}")
+        sys.exit(1)
+    registry = DesignRegistry(args.registry)
+    if args.command == 'show':
+        print(json.dumps({design: registry.design(design) for design in args.designs}, indent=1))
+    else:
+        lacking = sorted(design for design in registry.with_kind(args.has)
+                         if not registry.names(design, args.lacks))
+        for design in lacking:
+            print(design)
+        print(f"{len(lacking)} designs with {args.has} but no {args.lacks}", file=sys.stderr)
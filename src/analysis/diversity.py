@@ -0,0 +1,273 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_io import read_ca_coords
+from sequences import extract_sequences
+
+# Diversity-aware selection. Candidates are visited best score first and
+# greedily clustered: each one is compared only against the representatives
+# (first members) of existing clusters, and joins the first cluster it is
+# similar to or starts a new one. A cluster contributes at most
+# max_per_cluster designs to the selection.
+#
+# Sequence similarity is the Jaccard index of k-mer sets. MinHash signatures
+# with LSH banding find the representatives worth comparing, so a candidate
+# never looks at more than a handful of sequences. Structure similarity is
+# the CA-RMSD of chain A after optimal superposition, computed for all
+# representatives of the same length at once. The singular values of the
+# centered coordinates give a lower bound on that RMSD (von Neumann's trace
+# inequality), which discards most representatives before any SVD of pairs.
+
+DIVERSITY_MODES = ('none', 'sequence', 'structure', 'both')
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+_RESIDUE_CODES = np.full(256, len(AMINO_ACIDS), dtype=np.uint64)  # Unknown letters share one code
+for _code, _letter in enumerate(AMINO_ACIDS):
+    _RESIDUE_CODES[ord(_letter)] = _code
+
+
+def kmer_codes(sequence, k=3):
+    # Sorted unique integer codes of the sequence's k-mers
+    residues = _RESIDUE_CODES[np.frombuffer(sequence.upper().encode(), dtype=np.uint8)]
+    k = min(k, len(residues))
+    codes = np.zeros(len(residues) - k + 1, dtype=np.uint64)
+    base = np.uint64(len(AMINO_ACIDS) + 1)
+    for offset in range(k):
+        codes = codes * base + residues[offset:len(residues) - k + 1 + offset]
+    return np.unique(codes)
+
+
+def jaccard(codes_a, codes_b):
+    shared = len(np.intersect1d(codes_a, codes_b, assume_unique=True))
+    return shared / (len(codes_a) + len(codes_b) - shared)
+
+
+def lsh_bands(num_perm, threshold):
+    # (bands, rows) with bands * rows == num_perm whose LSH threshold
+    # (1/bands) ** (1/rows) lies safely below the Jaccard threshold, so
+    # similar pairs are rarely missed
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1.0 / bands) ** (1.0 / rows) <= 0.8 * threshold:
+            best = (bands, rows)
+    return best
+
+
+def _symmetric_eigenvalues(m):
+    # Eigenvalues (descending) of a stack of symmetric 3x3 matrices in closed
+    # form; much faster than a LAPACK call per matrix for small batches
+    q = np.trace(m, axis1=1, axis2=2) / 3.0
+    off = m[:, 0, 1] ** 2 + m[:, 0, 2] ** 2 + m[:, 1, 2] ** 2
+    p = np.sqrt(((m[:, 0, 0] - q) ** 2 + (m[:, 1, 1] - q) ** 2 + (m[:, 2, 2] - q) ** 2 + 2.0 * off) / 6.0)
+    safe_p = np.where(p > 0, p, 1.0)
+    b = (m - q[:, None, None] * np.eye(3)) / safe_p[:, None, None]
+    half_det = np.clip(np.linalg.det(b) / 2.0, -1.0, 1.0)
+    phi = np.arccos(half_det) / 3.0
+    largest = q + 2.0 * p * np.cos(phi)
+    smallest = q + 2.0 * p * np.cos(phi + 2.0 * np.pi / 3.0)
+    return np.stack([largest, 3.0 * q - largest - smallest, smallest], axis=1)
+
+
+def kabsch_rmsd_batch(references, coords):
+    # RMSD of coords (n, 3) to each of references (m, n, 3) after optimal
+    # superposition. Inputs must be centered. Only the singular values of the
+    # 3x3 covariance matrices are needed, taken from the eigenvalues of H^T H.
+    h = np.matmul(references.transpose(0, 2, 1), coords)
+    s = np.sqrt(np.maximum(_symmetric_eigenvalues(np.matmul(h.transpose(0, 2, 1), h)), 0.0))
+    # A reflection is not a valid superposition: flip the smallest singular
+    # value when det(U V^T), which has the sign of det(H), is negative
+    s[:, 2] *= np.where(np.linalg.det(h) < 0, -1.0, 1.0)
+    sq = ((references ** 2).sum(axis=(1, 2)) + (coords ** 2).sum() - 2.0 * s.sum(axis=1)) / len(coords)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+class _StructureBank:
+    # Centered CA coordinates of cluster representatives, grouped by length in
+    # growable arrays
+
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, cluster, coords, shape):
+        group = self.groups.get(len(coords))
+        if group is None:
+            group = self.groups[len(coords)] = {
+                'coords': np.empty((16, len(coords), 3)), 'shape': np.empty((16, 3)),
+                'cluster': np.empty(16, dtype=np.int64), 'size': 0}
+        size = group['size']
+        if size == len(group['cluster']):
+            for key in ('coords', 'shape', 'cluster'):
+                group[key] = np.concatenate([group[key], np.empty_like(group[key])])
+        group['coords'][size] = coords
+        group['shape'][size] = shape
+        group['cluster'][size] = cluster
+        group['size'] = size + 1
+
+    def closest(self, coords, shape, threshold):
+        # (cluster, rmsd) of the closest representative within threshold, or None
+        group = self.groups.get(len(coords))
+        if group is None:
+            return None
+        size = group['size']
+        bound_sq = ((group['shape'][:size] - shape) ** 2).sum(axis=1) / len(coords)
+        near = np.nonzero(bound_sq <= threshold ** 2)[0]
+        if len(near) == 0:
+            return None
+        rmsd = kabsch_rmsd_batch(group['coords'][near], coords)
+        best = int(np.argmin(rmsd))
+        if rmsd[best] > threshold:
+            return None
+        return int(group['cluster'][near[best]]), float(rmsd[best])
+
+
+class DiversityFilter:
+    # Greedy leader clustering of candidates fed in score order
+
+    def __init__(self, mode='sequence', seq_threshold=0.5, rmsd_threshold=2.0, max_per_cluster=1,
+                 kmer=3, num_perm=64, seed=0):
+        if mode not in DIVERSITY_MODES or mode == 'none':
+            raise ValueError(f"Unknown diversity mode: {mode}")
+        self.use_sequence = mode in ('sequence', 'both')
+        self.use_structure = mode in ('structure', 'both')
+        self.seq_threshold = seq_threshold
+        self.rmsd_threshold = rmsd_threshold
+        self.max_per_cluster = max_per_cluster
+        self.kmer = kmer
+        self.bands, self.rows = lsh_bands(num_perm, seq_threshold)
+
+        rng = np.random.RandomState(seed)
+        # Multiply-shift hashes: ((a * x + b) mod 2**64) >> 32, a odd
+        self.hash_a = rng.randint(1, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.hash_b = rng.randint(0, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+        # Per-band row weights that fold a band of the signature into one key
+        self.band_weights = rng.randint(1, 2 ** 62, size=self.rows, dtype=np.int64).astype(np.uint64)
+        self.buckets = {}
+        self.signatures = np.zeros((16, num_perm), dtype=np.uint64)
+        self.kmers = []  # Representative k-mer codes by cluster (None without a sequence)
+        self.members = []
+        self.structures = _StructureBank()
+
+    def signature(self, codes):
+        with np.errstate(over='ignore'):
+            hashed = (self.hash_a[:, None] * codes[None, :] + self.hash_b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1)
+
+    def _band_keys(self, signature):
+        with np.errstate(over='ignore'):
+            folded = (signature.reshape(self.bands, self.rows) * self.band_weights).sum(axis=1)
+        return list(enumerate(folded.tolist()))
+
+    def _sequence_match(self, codes, signature, band_keys):
+        candidates = set()
+        for key in band_keys:
+            candidates.update(self.buckets.get(key, ()))
+        if not candidates:
+            return None
+        # The fraction of agreeing signature slots estimates the Jaccard index;
+        # only candidates that could plausibly pass get the exact comparison
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        estimate = (self.signatures[candidates] == signature).mean(axis=1)
+        best = None
+        for cluster in np.sort(candidates[estimate >= self.seq_threshold - 0.15]).tolist():
+            similarity = jaccard(codes, self.kmers[cluster])
+            if similarity >= self.seq_threshold and (best is None or similarity > best[1]):
+                best = (cluster, similarity)
+        return best
+
+    def assign(self, sequence=None, ca_coords=None):
+        # (cluster, accepted) for the next candidate. accepted is False once the
+        # cluster already holds max_per_cluster designs.
+        codes = signature = band_keys = None
+        if self.use_sequence and sequence:
+            codes = kmer_codes(sequence, self.kmer)
+            signature = self.signature(codes)
+            band_keys = self._band_keys(signature)
+        coords = shape = None
+        if self.use_structure and ca_coords is not None and len(ca_coords) >= 3:
+            coords = np.asarray(ca_coords, dtype=np.float64)
+            coords = coords - coords.mean(axis=0)
+            shape = np.linalg.svd(coords, compute_uv=False)
+
+        match = None
+        if codes is not None:
+            match = self._sequence_match(codes, signature, band_keys)
+        if match is None and coords is not None:
+            match = self.structures.closest(coords, shape, self.rmsd_threshold)
+
+        if match is not None:
+            cluster = match[0]
+            self.members[cluster] += 1
+            return cluster, self.members[cluster] <= self.max_per_cluster
+
+        cluster = len(self.members)
+        self.members.append(1)
+        self.kmers.append(codes)
+        if band_keys is not None:
+            if cluster == len(self.signatures):
+                self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+            self.signatures[cluster] = signature
+            for key in band_keys:
+                self.buckets.setdefault(key, []).append(cluster)
+        if coords is not None:
+            self.structures.add(cluster, coords, shape)
+        return cluster, True
+
+
+def _ca_job(pdb_file_path):
+    try:
+        return read_ca_coords(pdb_file_path, 'A')
+    except (OSError, ValueError):
+        return None
+
+
+def load_ca_coords(pdb_file_paths, workers=None, chunksize=16):
+    # Chain A CA coordinates for many PDB files (None where unreadable)
+    pdb_file_paths = list(pdb_file_paths)
+    if not workers or workers <= 1 or len(pdb_file_paths) < 2:
+        return [_ca_job(path) for path in pdb_file_paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_ca_job, pdb_file_paths, chunksize=chunksize))
+
+
+def load_features(diversity_filter, pdb_file_paths, workers=None, cache_path=None):
+    # (sequences, ca_coords) needed by a filter, each a list parallel to the paths
+    sequences = [None] * len(pdb_file_paths)
+    ca_coords = [None] * len(pdb_file_paths)
+    if diversity_filter.use_sequence:
+        sequences = [sequence for sequence, _ in extract_sequences(pdb_file_paths, 'A', workers, cache_path)]
+    if diversity_filter.use_structure:
+        ca_coords = load_ca_coords(pdb_file_paths, workers)
+    return sequences, ca_coords
+
+
+def select_diverse(candidates, top_n, diversity_filter, workers=None, cache_path=None, window=None):
+    # Pick up to top_n of candidates [(row, pdb_path)] (best first) so that no
+    # cluster exceeds max_per_cluster. PDBs are read a window at a time, so
+    # only as many candidates as needed are loaded. Returns (selected, report):
+    # selected holds (row, pdb_path), report (row, cluster, accepted) for
+    # every candidate examined.
+    selected = []
+    report = []
+    position = 0
+    while len(selected) < top_n and position < len(candidates):
+        size = window or max(2 * (top_n - len(selected)), 64)
+        batch = candidates[position:position + size]
+        position += len(batch)
+        for row, path in batch:
+            if not os.path.isfile(path):
+                print(f"PDB file {path} not found.")
+        batch = [(row, path) for row, path in batch if os.path.isfile(path)]
+        sequences, ca_coords = load_features(diversity_filter, [path for _, path in batch], workers, cache_path)
+        for (row, path), sequence, coords in zip(batch, sequences, ca_coords):
+            if len(selected) >= top_n:
+                break
+            cluster, accepted = diversity_filter.assign(sequence, coords)
+            report.append((row, cluster, accepted))
+            if accepted:
+                selected.append((row, path))
+    return selected, report
@@ -0,0 +1,206 @@
+import io
+import os
+import csv
+import sys
+import time
+import fcntl
+import socket
+import argparse
+
+# Result sink for MD energies that any number of processes can write to at
+# once. Each writer process appends to its own shard file under
+# <energies.csv>.shards/, so rows are never interleaved and no header is
+# written twice. compact() folds the shards into energies.csv under a lock:
+# one row per OutputName, the most recently recorded one winning, so running
+# a design again replaces its row. Rows of designs new to the CSV are
+# appended in place, leaving the bytes already there untouched for readers
+# that resume where they stopped (metrics_store); replacing a row rewrites the
+# CSV atomically. Readers (merge_energies*.py) compact before reading and see
+# a plain CSV.
+
+ENERGY_CSV_HEADER = ['OutputName', 'TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol', 'Steps', 'StopReason',
+                     'ResultsFormat', 'Nonbonded', 'Cutoff_nm', 'RFDielectric', 'InterfaceShell_nm']
+
+# Shard rows carry the time they were recorded, used to order rewrites of the
+# same design across shards; it is dropped from energies.csv
+RECORDED_COLUMN = 'RecordedAt'
+SHARD_SUFFIX = '.csv'
+COMPACTING_SUFFIX = '.compacting'
+
+
+def shard_dir(energy_csv_path):
+    return f"{energy_csv_path}.shards"
+
+
+def shard_path(energy_csv_path):
+    # One shard per writer process; a later process reusing the pid simply
+    # appends to the same shard
+    return os.path.join(shard_dir(energy_csv_path), f"{socket.gethostname()}-{os.getpid()}{SHARD_SUFFIX}")
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def append_row(energy_csv_path, values):
+    # Append one result row ({column: value}) to this process's shard
+    path = shard_path(energy_csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    row = [values.get(column, '') for column in ENERGY_CSV_HEADER] + [time.time_ns()]
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # compact() may have moved the shard away between open and lock;
+            # the row then goes to a fresh shard at the same path
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(fd).st_ino:
+                continue
+            data = _csv_line(row)
+            if os.fstat(fd).st_size == 0:
+                data = _csv_line(ENERGY_CSV_HEADER + [RECORDED_COLUMN]) + data
+            os.write(fd, data.encode())
+            return path
+        finally:
+            os.close(fd)  # Also releases the lock
+
+
+def _read_csv(path):
+    with open(path, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return [], []
+        return header, [dict(zip(header, row)) for row in reader if row]
+
+
+def _merge(header, merged, rows):
+    # Later rows replace earlier ones with the same OutputName, keeping the
+    # position the design first appeared at
+    for row in rows:
+        for column in row:
+            if column not in header and column != RECORDED_COLUMN:
+                header.append(column)
+        merged[row['OutputName']] = row
+
+
+class _CompactionLock:
+    def __init__(self, energy_csv_path):
+        self.path = f"{energy_csv_path}.lock"
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)
+
+
+def pending_shards(energy_csv_path):
+    directory = shard_dir(energy_csv_path)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(SHARD_SUFFIX) or name.endswith(COMPACTING_SUFFIX))
+
+
+def _ends_with_newline(path):
+    # False for a CSV whose last line was cut short, which is rewritten instead of appended to
+    with open(path, 'rb') as csvfile:
+        csvfile.seek(0, os.SEEK_END)
+        if csvfile.tell() == 0:
+            return False
+        csvfile.seek(-1, os.SEEK_END)
+        return csvfile.read(1) == b'\n'
+
+
+def compact(energy_csv_path):
+    # Fold every shard into energy_csv_path. Returns the number of shard rows
+    # merged. Safe to call from several processes and while writers append.
+    shards = pending_shards(energy_csv_path)
+    if not shards:
+        return 0
+    with _CompactionLock(energy_csv_path):
+        # Move each shard aside so new rows start a new one, then lock it to
+        # wait for a write already in progress. Shards left aside by an
+        # interrupted compaction are merged again, which is harmless.
+        handles = []
+        try:
+            for path in pending_shards(energy_csv_path):
+                if path.endswith(SHARD_SUFFIX):
+                    moved = path[:-len(SHARD_SUFFIX)] + f".{os.getpid()}{COMPACTING_SUFFIX}"
+                    try:
+                        os.replace(path, moved)
+                    except FileNotFoundError:
+                        continue
+                    path = moved
+                fd = os.open(path, os.O_RDONLY)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                handles.append((path, fd))
+
+            shard_rows = []
+            for path, _ in handles:
+                shard_rows.extend(_read_csv(path)[1])
+            # Stable sort: rows of one shard with the same timestamp keep their order
+            shard_rows.sort(key=lambda row: int(row.get(RECORDED_COLUMN) or 0))
+
+            header, existing_header, existing_rows = list(ENERGY_CSV_HEADER), [], []
+            if os.path.isfile(energy_csv_path):
+                existing_header, existing_rows = _read_csv(energy_csv_path)
+                header = existing_header + [column for column in ENERGY_CSV_HEADER if column not in existing_header]
+            new_rows = {}
+            _merge(header, new_rows, shard_rows)
+
+            existing_names = {row.get('OutputName') for row in existing_rows}
+            if (existing_header and header == existing_header and _ends_with_newline(energy_csv_path)
+                    and not any(name in existing_names for name in new_rows)):
+                with open(energy_csv_path, 'a', newline='') as csvfile:
+                    writer = csv.writer(csvfile)
+                    for row in new_rows.values():
+                        writer.writerow([row.get(column, '') for column in header])
+            else:
+                merged = {}
+                _merge(header, merged, existing_rows)
+                _merge(header, merged, shard_rows)
+                tmp_path = f"{energy_csv_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', newline='') as csvfile:
+                    writer = csv.writer(csvfile)
+                    writer.writerow(header)
+                    for row in merged.values():
+                        writer.writerow([row.get(column, '') for column in header])
+                os.replace(tmp_path, energy_csv_path)
+            for path, _ in handles:
+                os.remove(path)
+        finally:
+            for _, fd in handles:
+                os.close(fd)
+    return len(shard_rows)
+
+
+def reset(energy_csv_path):
+    # Remove the energies CSV and any shards, for a run starting from scratch
+    with _CompactionLock(energy_csv_path):
+        for path in pending_shards(energy_csv_path):
+            os.remove(path)
+        if os.path.exists(energy_csv_path):
+            os.remove(energy_csv_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold per-process MD energy shards into the energies CSV")
+    parser.add_argument("energies_csv", help="Energies CSV written by run_md.py")
+    parser.add_argument("--reset", action="store_true", help="Delete the CSV and its shards instead")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset(args.energies_csv)
+        sys.exit(0)
+    merged = compact(args.energies_csv)
+    print(f"Merged {merged} rows from {shard_dir(args.energies_csv)} into {args.energies_csv}")
@@ -0,0 +1,61 @@
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# Materialize a file at a new path without copying its bytes when the
+# filesystem allows it. Modes:
+#   auto     - reflink, then hardlink, then copy
+#   reflink  - copy-on-write clone (btrfs, XFS, ...), else copy
+#   hardlink - hardlink, else copy
+#   symlink  - absolute symlink to the source
+#   copy     - plain copy, as before
+# A hardlink shares the source's inode, so a file later rewritten in place
+# (run_md.py opens md_output and fixed PDBs with 'w') changes under both
+# names. 'auto' and 'hardlink' are only for files that are never rewritten
+# in place; for anything else use 'reflink', which clones or copies and so
+# never shares data with the source.
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+
+def _reflink(src_path, dest_path):
+    if fcntl is None:
+        return False
+    try:
+        with open(src_path, 'rb') as src_file, open(dest_path, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        return True
+    except OSError:
+        # Unsupported filesystem or cross-device: drop the empty file
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        return False
+
+def _hardlink(src_path, dest_path):
+    try:
+        os.link(src_path, dest_path)
+        return True
+    except OSError:
+        return False
+
+def link_or_copy(src_path, dest_path, mode='auto'):
+    # Returns the method actually used. An existing destination is replaced,
+    # matching shutil.copyfile.
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode {mode!r}, expected one of {', '.join(LINK_MODES)}")
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src_path), dest_path)
+        return 'symlink'
+    if mode in ('auto', 'reflink') and _reflink(src_path, dest_path):
+        return 'reflink'
+    if mode in ('auto', 'hardlink') and _hardlink(src_path, dest_path):
+        return 'hardlink'
+    shutil.copyfile(src_path, dest_path)
+    return 'copy'
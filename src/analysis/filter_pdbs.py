@@ -2,6 +2,21 @@
 
 import os
 import sys
+import csv
+import json
+import mmap
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Exit status of a single-file check whose design is rejected, so callers
+# such as the streaming pipeline can tell a rejection from an error
+REJECTED_EXIT_CODE = 3
+
+MANIFEST_FIELDS = [
+    'file', 'status', 'size', 'mtime', 'chain', 'atom_serial', 'atom_name',
+    'res_name', 'res_seq', 'z', 'margin', 'error'
+]
 
 def delete_if_z_positive(pdb_file):
     with open(pdb_file, 'r') as file:
@@ -20,15 +35,165 @@ def process_folder(folder_path):
             pdb_file_path = os.path.join(folder_path, file_name)
             delete_if_z_positive(pdb_file_path)
 
+def find_membrane_clash(pdb_file, chain_id='A', z_max=0.0):
+    # Return the first chain atom above z_max, or None if the design is clean.
+    # The file is mapped rather than read so a violation near the top of the
+    # file never pulls the rest of it off disk.
+    chain = chain_id.encode()
+    with open(pdb_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b''):
+                if not line.startswith(b'ATOM') or line[21:22] != chain:
+                    continue
+                z_coord = float(line[46:54])
+                if z_coord > z_max:
+                    return {
+                        'chain': chain_id,
+                        'atom_serial': int(line[6:11]),
+                        'atom_name': line[12:16].decode().strip(),
+                        'res_name': line[17:20].decode().strip(),
+                        'res_seq': int(line[22:26]),
+                        'z': z_coord,
+                        'margin': round(z_coord - z_max, 3),
+                    }
+    return None
+
+def classify_pdb(pdb_file, chain_id='A', z_max=0.0):
+    stat = os.stat(pdb_file)
+    entry = {
+        'file': os.path.basename(pdb_file),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    try:
+        clash = find_membrane_clash(pdb_file, chain_id, z_max)
+    except (OSError, ValueError) as e:
+        entry['status'] = 'error'
+        entry['error'] = str(e)
+        return entry
+
+    if clash is None:
+        entry['status'] = 'accepted'
+    else:
+        entry['status'] = 'rejected'
+        entry.update(clash)
+    return entry
+
+def _classify_job(job):
+    return classify_pdb(*job)
+
+def load_manifest(manifest_path):
+    if not manifest_path or not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as manifest_file:
+        if manifest_path.endswith('.csv'):
+            entries = list(csv.DictReader(manifest_file))
+        else:
+            entries = json.load(manifest_file)
+    return {entry['file']: entry for entry in entries}
+
+def write_manifest(manifest_path, entries):
+    # Write to a temporary file first so an interrupted run keeps the old manifest
+    tmp_path = manifest_path + '.tmp'
+    rows = sorted(entries.values(), key=lambda entry: entry['file'])
+    with open(tmp_path, 'w', newline='') as manifest_file:
+        if manifest_path.endswith('.csv'):
+            writer = csv.DictWriter(manifest_file, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, manifest_file, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def _is_unchanged(entry, file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return int(entry['size']) == stat.st_size and float(entry['mtime']) == stat.st_mtime
+
+def process_folder_batch(folder_path, quarantine_dir=None, manifest_path=None,
+                         workers=None, chain_id='A', z_max=0.0, chunksize=64):
+    if quarantine_dir is None:
+        quarantine_dir = os.path.join(folder_path, 'quarantine')
+    if manifest_path is None:
+        manifest_path = os.path.join(folder_path, 'filter_manifest.json')
+
+    manifest = load_manifest(manifest_path)
+
+    # Files already classified in an earlier run (and untouched since) are skipped.
+    # Rejected designs were moved out of the folder, so they never reappear here.
+    pending = []
+    skipped = 0
+    for entry in os.scandir(folder_path):
+        if not entry.is_file() or not entry.name.endswith('.pdb'):
+            continue
+        previous = manifest.get(entry.name)
+        if previous is not None and previous['status'] == 'accepted' and _is_unchanged(previous, entry.path):
+            skipped += 1
+            continue
+        pending.append((entry.path, chain_id, z_max))
+
+    print(f"Classifying {len(pending)} PDB files in {folder_path} ({skipped} already accepted)")
+
+    executor = None
+    if workers == 1 or len(pending) < 2:
+        results = map(_classify_job, pending)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_classify_job, pending, chunksize=chunksize)
+
+    counts = {'accepted': 0, 'rejected': 0, 'error': 0}
+    try:
+        for entry in results:
+            counts[entry['status']] += 1
+            if entry['status'] == 'rejected':
+                os.makedirs(quarantine_dir, exist_ok=True)
+                shutil.move(os.path.join(folder_path, entry['file']),
+                            os.path.join(quarantine_dir, entry['file']))
+            manifest[entry['file']] = entry
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        write_manifest(manifest_path, manifest)
+
+    print(f"Accepted {counts['accepted']}, quarantined {counts['rejected']}, "
+          f"errors {counts['error']}. Manifest written to {manifest_path}")
+    return counts
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python filter_pdbs.py <folder_path>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Remove designs whose chain A protrudes into the membrane (z > 0)")
+    parser.add_argument("folder_path",
+                        help="Folder of PDB files to filter, or a single PDB file to check without deleting it")
+    parser.add_argument("--batch", action="store_true",
+                        help="Classify in parallel, quarantine rejected files and write a manifest instead of deleting")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (batch mode)")
+    parser.add_argument("--quarantine-dir", default=None,
+                        help="Where rejected designs are moved (default: <folder>/quarantine)")
+    parser.add_argument("--manifest", default=None,
+                        help="Manifest path, .json or .csv (default: <folder>/filter_manifest.json)")
+    args = parser.parse_args()
+
+    folder_path = args.folder_path
+
+    if os.path.isfile(folder_path):
+        entry = classify_pdb(folder_path)
+        if entry['status'] == 'error':
+            print(f"Error reading {folder_path}: {entry.get('error')}")
+            sys.exit(1)
+        if entry['status'] == 'rejected':
+            print(f"Rejected {folder_path}: chain {entry['chain']} atom {entry['atom_serial']} has z = {entry['z']}")
+            sys.exit(REJECTED_EXIT_CODE)
+        print(f"Accepted {folder_path}")
+        sys.exit(0)
 
-    folder_path = sys.argv[1]
-    
     if not os.path.isdir(folder_path):
         print(f"Error: {folder_path} is not a valid directory")
         sys.exit(1)
-    
-    process_folder(folder_path)
+
+    if args.batch:
+        process_folder_batch(folder_path, args.quarantine_dir, args.manifest, args.workers)
+    else:
+        process_folder(folder_path)
@@ -0,0 +1,259 @@
+import os
+import re
+import csv
+import sys
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_io import read_atom_lines, atom_table, table_field, table_coords, table_elements
+from triage import write_keep_list
+
+# Pre-MD screen of aligned complexes: does the binder actually touch the
+# hotspot residues RFdiffusion was steered towards? For every complex a
+# residue-level contact map of binder chain A against the target chains is
+# built from a KD-tree search over heavy atoms (kept sparse: one row per
+# contacting residue pair with its number of atom contacts). Hotspot coverage
+# is the fraction of hotspot residues with at least one binder contact;
+# designs below the coverage or contact thresholds are left out of the MD
+# input list. The maps of a whole folder are saved to one .npz file.
+
+# Exit status of a single-file check whose design is rejected (same value as
+# filter_pdbs.REJECTED_EXIT_CODE)
+REJECTED_EXIT_CODE = 3
+
+# ppi.hotspot_res in scripts/run_rfdiff.sh
+DEFAULT_HOTSPOTS = "C168-175,D168-175"
+CONTACT_CUTOFF = 5.5
+DEFAULT_MIN_COVERAGE = 0.25
+
+REPORT_FIELDS = ['file', 'status', 'hotspot_coverage', 'hotspots_engaged', 'hotspot_contacts',
+                 'interface_contacts', 'interface_residues', 'error']
+MAP_FIELDS = ('binder_residue', 'target_chain', 'target_residue', 'atom_contacts')
+
+
+def parse_hotspots(text):
+    # [(chain, residue number), ...] from RFdiffusion's ppi.hotspot_res list
+    # ("[C168,C169,...]") or with ranges ("C168-175,D168-175")
+    hotspots = []
+    for token in text.strip().strip('[]').split(','):
+        token = token.strip()
+        if not token:
+            continue
+        match = re.fullmatch(r'([A-Za-z])(-?\d+)(?:-(-?\d+))?', token)
+        if match is None:
+            raise ValueError(f"Bad hotspot {token!r}, expected e.g. C168 or C168-175")
+        chain, first, last = match.group(1), int(match.group(2)), match.group(3)
+        last = int(last) if last is not None else first
+        hotspots.extend((chain, number) for number in range(first, last + 1))
+    if not hotspots:
+        raise ValueError("No hotspot residues given")
+    return sorted(set(hotspots))
+
+
+def _residue_keys(chains, numbers):
+    # One integer per (chain, residue number)
+    return chains.astype(np.int64) * 100000 + numbers
+
+
+def contact_map(pdb_file_path, binder_chain='A', cutoff=CONTACT_CUTOFF):
+    # Residue pairs (binder residue, target chain, target residue) with heavy
+    # atoms within cutoff Angstrom of each other, and their atom contact
+    # counts. Every chain other than the binder is target.
+    lines = [line for line in read_atom_lines(pdb_file_path) if line[:6] == b'ATOM  ']
+    if not lines:
+        raise ValueError("no ATOM records")
+    table = atom_table(lines)
+    table = table[~np.isin(table_elements(table), ('H', 'D'))]
+    chains = table_field(table, 21, 22)
+    numbers = table_field(table, 22, 26).astype(np.int64)
+    coords = table_coords(table)
+
+    binder = chains == binder_chain.encode()
+    binder_atoms = np.nonzero(binder)[0]
+    target_atoms = np.nonzero(~binder)[0]
+    empty = {field: np.empty(0, dtype=np.int32) for field in MAP_FIELDS}
+    empty['target_chain'] = np.empty(0, dtype='S1')
+    if len(binder_atoms) == 0:
+        raise ValueError(f"no atoms in binder chain {binder_chain}")
+    if len(target_atoms) == 0:
+        return empty
+
+    pairs = cKDTree(coords[binder_atoms]).query_ball_tree(cKDTree(coords[target_atoms]), cutoff)
+    counts = np.fromiter((len(hits) for hits in pairs), dtype=np.int64, count=len(pairs))
+    total = int(counts.sum())
+    if total == 0:
+        return empty
+    binder_hits = np.repeat(binder_atoms, counts)
+    target_hits = target_atoms[np.fromiter((j for hits in pairs for j in hits), dtype=np.int64, count=total)]
+
+    # Collapse atom pairs to residue pairs
+    chain_codes = chains.view(np.uint8)
+    rows = np.stack((numbers[binder_hits], chain_codes[target_hits].astype(np.int64), numbers[target_hits]), axis=1)
+    residue_pairs, atom_contacts = np.unique(rows, axis=0, return_counts=True)
+    return {
+        'binder_residue': residue_pairs[:, 0].astype(np.int32),
+        'target_chain': residue_pairs[:, 1].astype(np.uint8).view('S1'),
+        'target_residue': residue_pairs[:, 2].astype(np.int32),
+        'atom_contacts': atom_contacts.astype(np.int32),
+    }
+
+
+def engagement(contacts, hotspots):
+    # Hotspot coverage and contact counts of one contact map
+    hotspot_keys = _residue_keys(np.array([ord(chain) for chain, _ in hotspots]),
+                                 np.array([number for _, number in hotspots]))
+    target_keys = _residue_keys(contacts['target_chain'].view(np.uint8), contacts['target_residue'].astype(np.int64))
+    on_hotspot = np.isin(target_keys, hotspot_keys)
+    engaged = np.unique(target_keys[on_hotspot])
+    return {
+        'hotspot_coverage': round(len(engaged) / len(hotspot_keys), 4),
+        'hotspots_engaged': ' '.join(f"{chr(key // 100000)}{key % 100000}" for key in engaged.tolist()),
+        'hotspot_contacts': int(on_hotspot.sum()),
+        'interface_contacts': len(target_keys),
+        'interface_residues': len(np.unique(contacts['binder_residue'])),
+    }
+
+
+def screen_complex(pdb_file_path, hotspots, binder_chain='A', cutoff=CONTACT_CUTOFF,
+                   min_coverage=DEFAULT_MIN_COVERAGE, min_contacts=1):
+    # (report entry, contact map or None) for one aligned complex
+    entry = {'file': os.path.basename(pdb_file_path)}
+    try:
+        contacts = contact_map(pdb_file_path, binder_chain, cutoff)
+    except (OSError, ValueError) as e:
+        entry['status'] = 'error'
+        entry['error'] = str(e)
+        return entry, None
+    entry.update(engagement(contacts, hotspots))
+    engaged = entry['hotspot_coverage'] >= min_coverage and entry['hotspot_contacts'] >= min_contacts
+    entry['status'] = 'accepted' if engaged else 'rejected'
+    return entry, contacts
+
+
+def _screen_job(job):
+    return screen_complex(*job)
+
+
+def save_contact_maps(maps_path, names, maps):
+    # All maps in one .npz: the MAP_FIELDS arrays concatenated, with
+    # offsets[i]:offsets[i + 1] selecting the rows of names[i]
+    directory = os.path.dirname(os.path.abspath(maps_path))
+    os.makedirs(directory, exist_ok=True)
+    sizes = [len(contacts['atom_contacts']) for contacts in maps]
+    arrays = {field: np.concatenate([contacts[field] for contacts in maps]) if maps else np.empty(0)
+              for field in MAP_FIELDS}
+    tmp_path = f"{maps_path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, names=np.array(names, dtype=str),
+                        offsets=np.concatenate(([0], np.cumsum(sizes))).astype(np.int64), **arrays)
+    os.replace(tmp_path, maps_path)
+
+
+def load_contact_maps(maps_path):
+    # {design file stem: {field: array}} from a file written by save_contact_maps
+    with np.load(maps_path) as data:
+        offsets = data['offsets']
+        arrays = {field: data[field] for field in MAP_FIELDS}
+        return {name: {field: values[offsets[i]:offsets[i + 1]] for field, values in arrays.items()}
+                for i, name in enumerate(data['names'].tolist())}
+
+
+def write_report(report_path, entries):
+    directory = os.path.dirname(os.path.abspath(report_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='') as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(entries)
+    os.replace(tmp_path, report_path)
+
+
+def screen_directory(aligned_dir, md_list_path, report_path=None, maps_path=None, hotspots=None,
+                     binder_chain='A', cutoff=CONTACT_CUTOFF, min_coverage=DEFAULT_MIN_COVERAGE,
+                     min_contacts=1, workers=None, chunksize=64):
+    # Screen every aligned complex and write the accepted ones (absolute
+    # paths) to md_list_path, the input list of run_md.py --batch. Returns
+    # {status: count}.
+    if hotspots is None:
+        hotspots = parse_hotspots(DEFAULT_HOTSPOTS)
+    pdb_paths = sorted(os.path.abspath(os.path.join(aligned_dir, name))
+                       for name in os.listdir(aligned_dir) if name.endswith('.pdb'))
+    jobs = [(path, hotspots, binder_chain, cutoff, min_coverage, min_contacts) for path in pdb_paths]
+    print(f"Screening {len(jobs)} complexes in {aligned_dir} for hotspot engagement")
+
+    executor = None
+    if workers == 1 or len(jobs) < 2:
+        results = map(_screen_job, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_screen_job, jobs, chunksize=chunksize)
+
+    entries, names, maps = [], [], []
+    counts = {'accepted': 0, 'rejected': 0, 'error': 0}
+    try:
+        for path, (entry, contacts) in zip(pdb_paths, results):
+            entries.append(entry)
+            counts[entry['status']] += 1
+            if contacts is not None:
+                names.append(os.path.splitext(entry['file'])[0])
+                maps.append(contacts)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    accepted = [path for path, entry in zip(pdb_paths, entries) if entry['status'] == 'accepted']
+    write_keep_list(md_list_path, accepted, header_lines=[
+        f"hotspot_filter.py: coverage >= {min_coverage}, hotspot contacts >= {min_contacts}, "
+        f"cutoff {cutoff} A",
+        f"{len(accepted)} of {len(pdb_paths)} aligned complexes",
+    ])
+    if report_path:
+        write_report(report_path, entries)
+    if maps_path:
+        save_contact_maps(maps_path, names, maps)
+    print(f"Accepted {counts['accepted']}, rejected {counts['rejected']}, errors {counts['error']}. "
+          f"MD input list written to {md_list_path}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop aligned designs that do not engage the RFdiffusion hotspots")
+    parser.add_argument("aligned", help="Folder of aligned complexes, or a single aligned PDB file to check")
+    parser.add_argument("--md-list", default=None,
+                        help="Accepted complexes for run_md.py --batch (default: <folder>/hotspot_pass.txt)")
+    parser.add_argument("--report", default=None, help="Per-design CSV report")
+    parser.add_argument("--maps", default=None, help="Write the contact maps to this .npz file")
+    parser.add_argument("--hotspots", default=DEFAULT_HOTSPOTS,
+                        help=f"Hotspot residues, e.g. '[C168,C169]' or C168-175 (default: {DEFAULT_HOTSPOTS})")
+    parser.add_argument("--binder-chain", default='A', help="Binder chain (default: A)")
+    parser.add_argument("--cutoff", type=float, default=CONTACT_CUTOFF,
+                        help=f"Heavy-atom contact distance in Angstrom (default: {CONTACT_CUTOFF})")
+    parser.add_argument("--min-coverage", type=float, default=DEFAULT_MIN_COVERAGE,
+                        help=f"Fraction of hotspots the binder must contact (default: {DEFAULT_MIN_COVERAGE})")
+    parser.add_argument("--min-contacts", type=int, default=1,
+                        help="Binder-hotspot residue contacts required (default: 1)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    hotspots = parse_hotspots(args.hotspots)
+
+    if os.path.isfile(args.aligned):
+        entry, contacts = screen_complex(args.aligned, hotspots, args.binder_chain, args.cutoff,
+                                         args.min_coverage, args.min_contacts)
+        if entry['status'] == 'error':
+            print(f"Error reading {args.aligned}: {entry['error']}")
+            sys.exit(1)
+        if args.maps:
+            save_contact_maps(args.maps, [os.path.splitext(entry['file'])[0]], [contacts])
+        print(f"{entry['status'].capitalize()} {args.aligned}: coverage {entry['hotspot_coverage']}, "
+              f"{entry['hotspot_contacts']} hotspot contacts ({entry['hotspots_engaged'] or 'none'})")
+        sys.exit(REJECTED_EXIT_CODE if entry['status'] == 'rejected' else 0)
+
+    if not os.path.isdir(args.aligned):
+        print(f"Error: {args.aligned} is not a valid directory")
+        sys.exit(1)
+    md_list = args.md_list or os.path.join(args.aligned, "hotspot_pass.txt")
+    screen_directory(args.aligned, md_list, args.report, args.maps, hotspots, args.binder_chain, args.cutoff,
+                     args.min_coverage, args.min_contacts, args.workers)
@@ -2,7 +2,12 @@ import os
 import sys
 import csv
 
+from energy_sink import compact
+
 def merge_csv_files(energies_csv_path, prodigy_csv_path, output_csv_path):
+    # Fold rows still in the energy sink's shards into energies.csv
+    compact(energies_csv_path)
+
     # Read energies.csv into a dictionary
     energies_dict = {}
     with open(energies_csv_path, 'r') as energies_file:
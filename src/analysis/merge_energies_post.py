@@ -1,25 +1,19 @@
 import os
-import sys
 import csv
-import re
-from Bio.PDB import PDBParser
+import argparse
 import numpy as np
 
-def extract_base_design_name(name):
-    # Remove prefixes
-    name = re.sub(r'^rnd\d+_binder_design_', 'binder_design_', name)
-    name = re.sub(r'^rnd\d+_', '', name)
-    # Remove suffixes
-    name = re.sub(r'_aligned_md$', '', name)
-    name = re.sub(r'_aligned$', '', name)
-    name = re.sub(r'_md$', '', name)
-    name = re.sub(r'_fixed$', '', name)
-    name = re.sub(r'_dldesign_.*$', '', name)
-    name = re.sub(r'_cycle.*$', '', name)
-    name = re.sub(r'_af2pred$', '', name)
-    return name
+from af2_scores import load_scores
+from design_names import extract_base_design_name
+from pdb_io import radius_of_gyration_batch
+from coord_store import CoordStore
+from energy_sink import compact
+from design_registry import build_registry
 
 def compute_radius_of_gyration(pdb_file_path, chain_id='A'):
+    # Single-file Biopython reference; merge_csv_files uses the vectorized
+    # pdb_io.radius_of_gyration_batch, which gives the same values
+    from Bio.PDB import PDBParser
     parser = PDBParser(QUIET=True)
     try:
         structure = parser.get_structure('structure', pdb_file_path)
@@ -46,18 +40,61 @@ def compute_radius_of_gyration(pdb_file_path, chain_id='A'):
     radius_of_gyration = np.sqrt(rg_squared)
     return radius_of_gyration
 
-def merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_csv_path, pdb_dir, rg_multiplier):
+def design_resolvers(registry=None):
+    # Design ID of an energies row (OutputName), an MD PDB file (Prodigy's File
+    # column) and an AF2 description: looked up in the design registry when
+    # there is one (None for names it does not hold), else derived from the name
+    if registry is None:
+        return {
+            'energies': extract_base_design_name,
+            'md': lambda file_name: extract_base_design_name(os.path.splitext(file_name)[0]),
+            'scores': extract_base_design_name,
+        }
+    return {kind: (lambda name, kind=kind: registry.design_of(kind, name)) for kind in ('energies', 'md', 'scores')}
+
+def merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_csv_path, pdb_dir, rg_multiplier,
+                    rg_workers=None, store_path=None, coord_store_path=None, registry_path=None):
+    # Fold rows still in the energy sink's shards into energies.csv, so both
+    # paths below read every MD result, one row per design
+    compact(energies_csv_path)
+
+    registry = None
+    if registry_path:
+        registry, _ = build_registry(registry_path, {'md': pdb_dir},
+                                     {'energies': energies_csv_path, 'scores': af2_score_path})
+    resolve = design_resolvers(registry)
+
+    if store_path:
+        # Incremental path: only rows appended since the last merge are read and
+        # only designs without an up-to-date Rg are recomputed, from the
+        # coordinate store when it holds them
+        from metrics_store import sync_store
+        energies_dict, prodigy_dict, af2_dict, rg_dict = sync_store(
+            store_path, energies_csv_path, prodigy_csv_path, af2_score_path, pdb_dir,
+            passes_rmsd_filter, rg_workers, resolve, coord_store_path)
+        merged_data = build_merged_rows(energies_dict, prodigy_dict, af2_dict, rg_dict, rg_multiplier)
+        write_merged_csv(output_csv_path, merged_data)
+        return
+
     # Build energies_dict
     energies_dict = {}
+    unresolved = 0
     with open(energies_csv_path, 'r') as energies_file:
         energies_reader = csv.DictReader(energies_file)
         for row in energies_reader:
             output_name = row['OutputName']
-            base_name = extract_base_design_name(output_name)
+            base_name = resolve['energies'](output_name)
+            if base_name is None:
+                unresolved += 1
+                continue
             energies_dict[base_name] = {
                 'OutputName': output_name,
                 'TotalEnergy_kJ/mol': float(row['TotalEnergy_kJ/mol']),
-                'InteractionEnergy_kJ/mol': float(row['InteractionEnergy_kJ/mol'])
+                'InteractionEnergy_kJ/mol': float(row['InteractionEnergy_kJ/mol']),
+                'Nonbonded': row.get('Nonbonded') or 'NoCutoff',
+                'StopReason': row.get('StopReason') or '',
+                # Rows written before run_md.py recorded it are format 1
+                'ResultsFormat': row.get('ResultsFormat') or '1'
             }
 
     # Build prodigy_dict
@@ -65,43 +102,77 @@ def merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_
     with open(prodigy_csv_path, 'r') as prodigy_file:
         prodigy_reader = csv.DictReader(prodigy_file)
         for row in prodigy_reader:
-            file_name = row['File']
-            base_name_full = os.path.splitext(file_name)[0]
-            base_name = extract_base_design_name(base_name_full)
+            base_name = resolve['md'](row['File'])
+            if base_name is None:
+                unresolved += 1
+                continue
             prodigy_dict[base_name] = {
                 'DeltaG_kcal/mol': float(row['DeltaG (kcal/mol)'])
             }
 
     # Build af2_dict
+    af2_scores = load_scores(af2_score_path)
     af2_dict = {}
-    with open(af2_score_path, 'r') as af2_file:
-        header = None
-        for line in af2_file:
-            line = line.strip()
-            if not line.startswith('SCORE:'):
-                continue
-            parts = line.split()
-            if 'binder_aligned_rmsd' in line and 'description' in line:
-                # Header line
-                header = parts[1:]  # Skip 'SCORE:'
-                rmsd_index = header.index('binder_aligned_rmsd')
-                description_index = header.index('description')
+    if 'binder_aligned_rmsd' in af2_scores:
+        rmsd_values = af2_scores.column('binder_aligned_rmsd')
+        by_design = {}
+        for index, description in enumerate(af2_scores.descriptions.tolist()):
+            base_name = resolve['scores'](description)
+            if base_name is None:
+                unresolved += 1
                 continue
-            elif header is not None:
-                # Data line
-                data = parts[1:]  # Skip 'SCORE:'
-                if len(data) <= max(rmsd_index, description_index):
-                    continue
-                binder_aligned_rmsd = float(data[rmsd_index])
-                description = data[description_index]
-                base_name = extract_base_design_name(description)
+            by_design.setdefault(base_name, []).append(index)
+        for base_name, rows in by_design.items():
+            # The last row for a design wins, as when the file was read line by line
+            if not np.isnan(rmsd_values[rows[-1]]):
                 af2_dict[base_name] = {
-                    'binder_aligned_rmsd': binder_aligned_rmsd
+                    'binder_aligned_rmsd': float(rmsd_values[rows[-1]])
                 }
+    if unresolved:
+        print(f"Left out {unresolved} rows of designs not in the design registry {registry_path}")
+
+    # Compute Radius of Gyration in one batch for every design that passes the RMSD filter
+    rg_paths = {}
+    for base_name, energy_data in energies_dict.items():
+        if passes_rmsd_filter(af2_dict.get(base_name, {}).get('binder_aligned_rmsd', None)):
+            rg_paths[base_name] = os.path.join(pdb_dir, energy_data['OutputName'] + '.pdb')
+    rg_dict = {}
+    if coord_store_path:
+        # Designs already in the coordinate store ('md' kind) skip PDB parsing,
+        # unless their PDB changed since it was ingested (e.g. MD was re-run)
+        store = CoordStore(coord_store_path)
+        stored = {base_name: energies_dict[base_name]['OutputName'] for base_name, pdb_file_path in rg_paths.items()
+                  if store.is_current('md', energies_dict[base_name]['OutputName'], pdb_file_path)}
+        stored_rg = store.radius_of_gyration('md', chain_id='A', names=stored.values())
+        for base_name, output_name in stored.items():
+            if stored_rg[output_name] is not None:
+                rg_dict[base_name] = stored_rg[output_name]
+                del rg_paths[base_name]
+    rg_values = radius_of_gyration_batch(list(rg_paths.values()), chain_id='A', workers=rg_workers)
+    for (base_name, pdb_file_path), rg in zip(rg_paths.items(), rg_values):
+        if rg is None:
+            print(f"No coordinates found for chain A in {pdb_file_path}")
+            continue  # Skip if Rg could not be computed
+        rg_dict[base_name] = rg
+
+    merged_data = build_merged_rows(energies_dict, prodigy_dict, af2_dict, rg_dict, rg_multiplier)
+    write_merged_csv(output_csv_path, merged_data)
 
-    # Merge dictionaries and compute Rg
+def passes_rmsd_filter(binder_aligned_rmsd):
+    # Exclude designs with missing or high RMSD
+    return binder_aligned_rmsd is not None and binder_aligned_rmsd < 6.0
+
+def build_merged_rows(energies_dict, prodigy_dict, af2_dict, rg_dict, rg_multiplier):
     merged_data = []
+    cutoff_rows = 0
     for base_name, energy_data in energies_dict.items():
+        # The -9000 kJ/mol threshold and the score weights are calibrated for
+        # all-pairs (NoCutoff) energies; run_md.py --nonbonded CutoffNonPeriodic
+        # shifts the total energy by tens of thousands of kJ/mol
+        if energy_data.get('Nonbonded', 'NoCutoff') != 'NoCutoff':
+            cutoff_rows += 1
+            continue
+
         total_energy = energy_data['TotalEnergy_kJ/mol']
         interaction_energy = energy_data['InteractionEnergy_kJ/mol']
         output_name = energy_data['OutputName']
@@ -112,20 +183,18 @@ def merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_
 
         # Get binder_aligned_rmsd
         binder_aligned_rmsd = af2_dict.get(base_name, {}).get('binder_aligned_rmsd', None)
-
-        # Exclude designs with missing or high RMSD
-        if binder_aligned_rmsd is None or binder_aligned_rmsd >= 6.0:
+        if not passes_rmsd_filter(binder_aligned_rmsd):
             continue
 
-        # Compute Radius of Gyration
-        pdb_filename = output_name + '.pdb'
-        pdb_file_path = os.path.join(pdb_dir, pdb_filename)
-        rg = compute_radius_of_gyration(pdb_file_path, chain_id='A')
+        # Get Radius of Gyration
+        rg = rg_dict.get(base_name)
         if rg is None:
             continue  # Skip if Rg could not be computed
 
-        # Calculate Score
-        if total_energy > -9000:
+        # Calculate Score. Designs run_md.py --reject-above stopped after
+        # minimization carry minimized, not MD, energies and get the penalty
+        # whatever they are
+        if total_energy > -9000 or energy_data.get('StopReason') == 'rejected_minimization':
             score = 5000
         else:
             if deltaG_kcal is not None:
@@ -136,44 +205,58 @@ def merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_
         # Prepare merged row
         merged_row = {
             'OutputName': output_name,
+            'Design': base_name,
             'TotalEnergy_kJ/mol': total_energy,
             'InteractionEnergy_kJ/mol': interaction_energy,
             'DeltaG_kcal/mol': deltaG_kcal,
             'binder_aligned_rmsd': binder_aligned_rmsd,
             'Rg': rg,
-            'Score': score
+            'Score': score,
+            'StopReason': energy_data.get('StopReason', ''),
+            'ResultsFormat': energy_data.get('ResultsFormat', '1')
         }
         merged_data.append(merged_row)
+    if cutoff_rows:
+        print(f"Left out {cutoff_rows} designs simulated with a nonbonded cutoff: their energies are not "
+              f"comparable with the NoCutoff scoring threshold")
+    return merged_data
 
-    # Write merged data
+def write_merged_csv(output_csv_path, merged_data):
     with open(output_csv_path, 'w', newline='') as output_file:
         fieldnames = [
-            'OutputName', 'TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol',
-            'DeltaG_kcal/mol', 'binder_aligned_rmsd', 'Rg', 'Score'
+            'OutputName', 'Design', 'TotalEnergy_kJ/mol', 'InteractionEnergy_kJ/mol',
+            'DeltaG_kcal/mol', 'binder_aligned_rmsd', 'Rg', 'Score', 'StopReason', 'ResultsFormat'
         ]
         writer = csv.DictWriter(output_file, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(merged_data)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        print("Usage: python merge_energies_post.py <energies_csv> <prodigy_csv> <af2_score_file> <output_csv> <pdb_dir>")
-        sys.exit(1)
-    energies_csv_path = sys.argv[1]
-    prodigy_csv_path = sys.argv[2]
-    af2_score_path = sys.argv[3]
-    output_csv_path = sys.argv[4]
-    pdb_dir = sys.argv[5]
+    parser = argparse.ArgumentParser(description="Merge MD energies, Prodigy DeltaG, AF2 RMSD and Rg into a scored CSV")
+    parser.add_argument("energies_csv")
+    parser.add_argument("prodigy_csv")
+    parser.add_argument("af2_score_file")
+    parser.add_argument("output_csv")
+    parser.add_argument("pdb_dir")
+    parser.add_argument("--store", default=None,
+                        help="SQLite metrics store; only new rows and missing Rg values are processed")
+    parser.add_argument("--coord-store", default=None,
+                        help="Coordinate store (coord_store.py) holding the MD structures as kind 'md'")
+    parser.add_argument("--rg-workers", type=int, default=None, help="Processes used to compute Rg")
+    parser.add_argument("--registry", default=None,
+                        help="Design registry (design_registry.py) the rows are matched to designs through; "
+                             "the MD folder, energies and AF2 score tables are registered in it")
+    args = parser.parse_args()
+
+    energies_csv_path = args.energies_csv
+    prodigy_csv_path = args.prodigy_csv
+    af2_score_path = args.af2_score_file
+    output_csv_path = args.output_csv
+    pdb_dir = args.pdb_dir
 
     # Define the Rg multiplier (adjust this value as needed)
     rg_multiplier = 500.0  # You can change this value later
 
-    # Ensure that Biopython is installed
-    try:
-        from Bio.PDB import PDBParser
-    except ImportError:
-        print("Biopython is required for PDB parsing. Install it using 'pip install biopython'.")
-        sys.exit(1)
-
-    merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_csv_path, pdb_dir, rg_multiplier)
+    merge_csv_files(energies_csv_path, prodigy_csv_path, af2_score_path, output_csv_path, pdb_dir, rg_multiplier,
+                    args.rg_workers, args.store, args.coord_store, args.registry)
     print(f"Merged data written to {output_csv_path}")
@@ -0,0 +1,325 @@
+import os
+import csv
+import io
+import sys
+import sqlite3
+import hashlib
+
+from af2_scores import parse_score_lines
+from design_names import extract_base_design_name
+from pdb_io import radius_of_gyration_batch
+from coord_store import CoordStore
+
+# Persistent per-design metrics for merge_energies_post. Every metric is keyed
+# by the file it came from and the normalized design name, so one store can
+# serve several rounds and a merge only sees the rows of the files it was
+# given. Source files are read from the byte offset where the previous merge
+# stopped, so re-merging a round only parses rows appended since then.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS designs (
+    design TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    design TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    text_value TEXT,
+    source TEXT NOT NULL,
+    source_mtime REAL NOT NULL,
+    PRIMARY KEY (source, design, metric)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    header TEXT,
+    tail_hash TEXT
+);
+"""
+
+# Bumped whenever the tables change; a store written by another version is
+# dropped and rebuilt from the source files on the next merge
+STORE_VERSION = 7
+
+# Bytes before the resume offset that must be unchanged for a source file to
+# be resumed instead of read again, as in design_registry
+TAIL_CHECK_BYTES = 4096
+
+
+def open_store(store_path):
+    connection = sqlite3.connect(store_path, timeout=60)
+    if connection.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+        connection.executescript(
+            "DROP TABLE IF EXISTS designs; DROP TABLE IF EXISTS metrics; DROP TABLE IF EXISTS sources;")
+        connection.execute(f"PRAGMA user_version = {STORE_VERSION}")
+    connection.executescript(SCHEMA)
+    return connection
+
+def _tail_hash(source_file, offset):
+    # Hash of the last TAIL_CHECK_BYTES already ingested, so checking a file
+    # costs the same however much of it was read before
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    source_file.seek(start)
+    return hashlib.sha1(source_file.read(offset - start)).hexdigest()
+
+def _read_new_text(connection, path, kind):
+    # Return (text, header) for the part of the file not yet ingested, or
+    # (None, None) if nothing changed. A file that was replaced (new inode, as
+    # when energy_sink.compact has to rewrite existing rows), shrank or whose
+    # bytes just before the old offset changed is treated as rewritten and
+    # read from the start. energy_sink.compact appends rows of new designs in
+    # place, so the usual merge after an MD batch only reads those rows.
+    stat = os.stat(path)
+    row = connection.execute(
+        "SELECT mtime, size, inode, offset, header, tail_hash FROM sources WHERE path = ?", (path,)).fetchone()
+
+    with open(path, 'rb') as source_file:
+        offset, header = 0, None
+        if row is not None:
+            mtime, size, inode, previous_offset, previous_header, tail_hash = row
+            if inode == stat.st_ino and mtime == stat.st_mtime and size == stat.st_size:
+                return None, None
+            if (inode == stat.st_ino and stat.st_size >= previous_offset
+                    and _tail_hash(source_file, previous_offset) == tail_hash):
+                offset, header = previous_offset, previous_header
+            else:
+                # Rewritten: forget what it contributed before reading it again
+                connection.execute("DELETE FROM metrics WHERE source = ?", (path,))
+
+        source_file.seek(offset)
+        data = source_file.read()
+        # Only consume complete lines; a partially written last line is picked up next time
+        end = data.rfind(b'\n') + 1
+        data = data[:end]
+        new_offset = offset + end
+
+        connection.execute(
+            "INSERT OR REPLACE INTO sources (path, kind, mtime, size, inode, offset, header, tail_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, kind, stat.st_mtime, stat.st_size, stat.st_ino, new_offset, header,
+             _tail_hash(source_file, new_offset)))
+    return data.decode(), header
+
+def _set_header(connection, path, header):
+    connection.execute("UPDATE sources SET header = ? WHERE path = ?", (header, path))
+
+def _upsert(connection, path, records):
+    # records: iterable of (design, metric, value); strings go to text_value
+    mtime = os.stat(path).st_mtime
+    rows = []
+    for design, metric, value in records:
+        if isinstance(value, str):
+            rows.append((design, metric, None, value, path, mtime))
+        else:
+            rows.append((design, metric, value, None, path, mtime))
+    next_seq = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM designs").fetchone()[0]
+    for design in dict.fromkeys(row[0] for row in rows):
+        next_seq += 1
+        connection.execute("INSERT OR IGNORE INTO designs (design, seq) VALUES (?, ?)", (design, next_seq))
+    connection.executemany(
+        "INSERT OR REPLACE INTO metrics (design, metric, value, text_value, source, source_mtime) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+def _ingest_csv(connection, path, kind, row_records):
+    text, header = _read_new_text(connection, path, kind)
+    if text is None:
+        return 0
+    lines = text.splitlines()
+    if header is None:
+        if not lines:
+            return 0
+        header = lines.pop(0)
+        _set_header(connection, path, header)
+    reader = csv.DictReader(io.StringIO('\n'.join(lines)), fieldnames=next(csv.reader([header])))
+    records = []
+    for row in reader:
+        records.extend(row_records(row))
+    return _upsert(connection, path, records)
+
+def ingest_energies(connection, energies_csv_path, resolve=extract_base_design_name):
+    def row_records(row):
+        output_name = row['OutputName']
+        base_name = resolve(output_name)
+        if base_name is None:
+            return []
+        return [
+            (base_name, 'OutputName', output_name),
+            (base_name, 'TotalEnergy_kJ/mol', float(row['TotalEnergy_kJ/mol'])),
+            (base_name, 'InteractionEnergy_kJ/mol', float(row['InteractionEnergy_kJ/mol'])),
+            (base_name, 'Nonbonded', row.get('Nonbonded') or 'NoCutoff'),
+            (base_name, 'ResultsFormat', row.get('ResultsFormat') or '1'),
+            (base_name, 'StopReason', row.get('StopReason') or ''),
+        ]
+    return _ingest_csv(connection, energies_csv_path, 'energies', row_records)
+
+def ingest_prodigy(connection, prodigy_csv_path, resolve=None):
+    # resolve maps Prodigy's File column (an MD PDB file name) to a design ID
+    def row_records(row):
+        if resolve is None:
+            base_name = extract_base_design_name(os.path.splitext(row['File'])[0])
+        else:
+            base_name = resolve(row['File'])
+        if base_name is None:
+            return []
+        return [(base_name, 'DeltaG_kcal/mol', float(row['DeltaG (kcal/mol)']))]
+    return _ingest_csv(connection, prodigy_csv_path, 'prodigy', row_records)
+
+def ingest_af2_scores(connection, af2_score_path, resolve=extract_base_design_name):
+    text, header = _read_new_text(connection, af2_score_path, 'af2')
+    if text is None:
+        return 0
+    segments, last_header = parse_score_lines(text.splitlines(), header.split() if header else None)
+    if last_header is not None:
+        _set_header(connection, af2_score_path, ' '.join(last_header))
+
+    records = []
+    for segment_header, rows in segments:
+        description_index = segment_header.index('description')
+        for values in rows:
+            base_name = resolve(values[description_index])
+            if base_name is None:
+                continue
+            for name, value in zip(segment_header, values):
+                if name == 'description':
+                    continue
+                try:
+                    records.append((base_name, 'af2_' + name, float(value)))
+                except ValueError:
+                    continue
+    return _upsert(connection, af2_score_path, records)
+
+def update_radius_of_gyration(connection, pdb_dir, needs_rg, workers=None, coord_store=None):
+    # Compute Rg for designs that have none yet or whose MD structure changed
+    # since it was computed. needs_rg maps design -> OutputName. Designs whose
+    # PDB is current in coord_store (a CoordStore, kind 'md') are read from
+    # it instead of parsed.
+    mtimes = {}
+    for entry in os.scandir(pdb_dir):
+        if entry.name.endswith('.pdb'):
+            mtimes[entry.name[:-4]] = entry.stat().st_mtime
+    known = set(connection.execute("SELECT design, source, source_mtime FROM metrics WHERE metric = 'Rg'"))
+
+    pending = {}
+    for design, output_name in needs_rg.items():
+        mtime = mtimes.get(output_name)
+        if mtime is None:
+            print(f"No coordinates found for chain A in {os.path.join(pdb_dir, output_name + '.pdb')}")
+            continue
+        pdb_file_path = os.path.join(pdb_dir, output_name + '.pdb')
+        if (design, pdb_file_path, mtime) not in known:
+            pending[design] = pdb_file_path
+
+    if not pending:
+        return 0
+    rg_by_design = {}
+    if coord_store is not None:
+        stored = [design for design, pdb_file_path in pending.items()
+                  if coord_store.is_current('md', needs_rg[design], pdb_file_path)]
+        stored_rg = coord_store.radius_of_gyration('md', chain_id='A', names=[needs_rg[d] for d in stored])
+        for design in stored:
+            rg_by_design[design] = stored_rg[needs_rg[design]]
+    parsed = [design for design in pending if design not in rg_by_design]
+    rg_values = radius_of_gyration_batch([pending[design] for design in parsed], chain_id='A', workers=workers)
+    rg_by_design.update(zip(parsed, rg_values))
+
+    count = 0
+    for design, pdb_file_path in pending.items():
+        rg = rg_by_design[design]
+        if rg is None:
+            print(f"No coordinates found for chain A in {pdb_file_path}")
+            continue
+        connection.execute(
+            "INSERT OR REPLACE INTO metrics (design, metric, value, text_value, source, source_mtime) "
+            "VALUES (?, 'Rg', ?, NULL, ?, ?)", (design, rg, pdb_file_path, mtimes[os.path.basename(pdb_file_path)[:-4]]))
+        count += 1
+    return count
+
+def load_metric_dicts(connection, source_paths, pdb_dir):
+    # Rebuild the dictionaries merge_energies_post works with, in the order
+    # designs first appeared. Only rows from source_paths count, and Rg only
+    # when it was computed from the design's PDB in pdb_dir, so files of other
+    # rounds sharing the store do not leak into this merge.
+    metrics, rg_by_source = {}, {}
+    placeholders = ", ".join("?" * len(source_paths))
+    for design, metric, value, text_value, source in connection.execute(
+            "SELECT m.design, m.metric, m.value, m.text_value, m.source FROM metrics m "
+            "JOIN designs d ON d.design = m.design "
+            f"WHERE m.source IN ({placeholders}) OR m.metric = 'Rg' ORDER BY d.seq", list(source_paths)):
+        if metric == 'Rg':
+            rg_by_source[(design, source)] = value
+            continue
+        metrics.setdefault(design, {})[metric] = text_value if text_value is not None else value
+
+    energies_dict, prodigy_dict, af2_dict, rg_dict = {}, {}, {}, {}
+    for design, values in metrics.items():
+        if 'OutputName' in values:
+            energies_dict[design] = {
+                'OutputName': values['OutputName'],
+                'TotalEnergy_kJ/mol': values['TotalEnergy_kJ/mol'],
+                'InteractionEnergy_kJ/mol': values['InteractionEnergy_kJ/mol'],
+                'Nonbonded': values.get('Nonbonded', 'NoCutoff'),
+                'ResultsFormat': values.get('ResultsFormat', '1'),
+                'StopReason': values.get('StopReason', ''),
+            }
+        if 'DeltaG_kcal/mol' in values:
+            prodigy_dict[design] = {'DeltaG_kcal/mol': values['DeltaG_kcal/mol']}
+        if 'af2_binder_aligned_rmsd' in values:
+            af2_dict[design] = {'binder_aligned_rmsd': values['af2_binder_aligned_rmsd']}
+        if 'OutputName' in values:
+            rg = rg_by_source.get((design, os.path.join(pdb_dir, values['OutputName'] + '.pdb')))
+            if rg is not None:
+                rg_dict[design] = rg
+    return energies_dict, prodigy_dict, af2_dict, rg_dict
+
+def sync_store(store_path, energies_csv_path, prodigy_csv_path, af2_score_path, pdb_dir,
+               rmsd_filter, rg_workers=None, resolvers=None, coord_store_path=None):
+    # Bring the store up to date with the source files and return the metric
+    # dictionaries for the merge. resolvers ({'energies', 'md', 'scores'}:
+    # name -> design ID) match rows to designs, by default from their names.
+    # Rg comes from the coordinate store at coord_store_path when it holds
+    # the current MD structure.
+    energies_csv_path, prodigy_csv_path, af2_score_path, pdb_dir = (
+        os.path.abspath(path) for path in (energies_csv_path, prodigy_csv_path, af2_score_path, pdb_dir))
+    source_paths = (energies_csv_path, prodigy_csv_path, af2_score_path)
+    connection = open_store(store_path)
+    try:
+        with connection:
+            resolvers = resolvers or {}
+            counts = {
+                'energies': ingest_energies(connection, energies_csv_path,
+                                            resolvers.get('energies', extract_base_design_name)),
+                'prodigy': ingest_prodigy(connection, prodigy_csv_path, resolvers.get('md')),
+                'af2': ingest_af2_scores(connection, af2_score_path,
+                                         resolvers.get('scores', extract_base_design_name)),
+            }
+        energies_dict, _, af2_dict, _ = load_metric_dicts(connection, source_paths, pdb_dir)
+        needs_rg = {
+            design: energy_data['OutputName']
+            for design, energy_data in energies_dict.items()
+            if rmsd_filter(af2_dict.get(design, {}).get('binder_aligned_rmsd', None))
+        }
+        with connection:
+            counts['Rg'] = update_radius_of_gyration(connection, pdb_dir, needs_rg, rg_workers,
+                                                     CoordStore(coord_store_path) if coord_store_path else None)
+        print("Metrics store updated: " + ", ".join(f"{count} new {kind} values" for kind, count in counts.items()))
+        return load_metric_dicts(connection, source_paths, pdb_dir)
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python metrics_store.py <store.sqlite>")
+        sys.exit(1)
+
+    connection = open_store(sys.argv[1])
+    for path, kind, mtime, offset in connection.execute("SELECT path, kind, mtime, offset FROM sources ORDER BY kind"):
+        print(f"{kind:<9} {path} (read up to byte {offset})")
+    for metric, count in connection.execute("SELECT metric, COUNT(*) FROM metrics GROUP BY metric ORDER BY metric"):
+        print(f"  {metric:<28} {count}")
+    connection.close()
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Lightweight fixed-width PDB readers. Instead of building a full structure
+# object, matching ATOM/HETATM lines are laid out as an (n_atoms, 80) byte
+# table and whole columns are sliced out and converted at once.
+
+ATOM_RECORDS = (b'ATOM  ', b'HETATM')
+LINE_WIDTH = 80
+
+ATOMIC_MASSES = {
+    'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'S': 32.06, 'P': 30.974,
+    'SE': 78.971, 'FE': 55.845, 'ZN': 65.38, 'MG': 24.305, 'CA': 40.078,
+    'NA': 22.990, 'CL': 35.45, 'K': 39.098, 'MN': 54.938,
+}
+
+def read_atom_lines(pdb_file_path, chain_id=None):
+    # ATOM/HETATM lines (bytes), optionally restricted to one chain. Alternate
+    # locations other than the first ('A') are dropped, as Biopython does.
+    with open(pdb_file_path, 'rb') as pdb_file:
+        data = pdb_file.read()
+    chain = chain_id.encode() if chain_id is not None else None
+    lines = []
+    for line in data.splitlines():
+        if line[:6] not in ATOM_RECORDS:
+            continue
+        if chain is not None and line[21:22] != chain:
+            continue
+        if line[16:17] not in (b' ', b'A', b''):
+            continue
+        lines.append(line)
+    return lines
+
+def atom_table(lines):
+    table = np.array([line[:LINE_WIDTH].ljust(LINE_WIDTH) for line in lines], dtype=f'S{LINE_WIDTH}')
+    return table.view('S1').reshape(len(lines), LINE_WIDTH)
+
+def table_field(table, start, end):
+    # Fixed-width column [start, end) as an array of byte strings
+    return np.ascontiguousarray(table[:, start:end]).view(f'S{end - start}').ravel()
+
+def table_coords(table):
+    coords = np.empty((len(table), 3), dtype=np.float64)
+    coords[:, 0] = table_field(table, 30, 38).astype(np.float64)
+    coords[:, 1] = table_field(table, 38, 46).astype(np.float64)
+    coords[:, 2] = table_field(table, 46, 54).astype(np.float64)
+    return coords
+
+def table_elements(table):
+    elements = np.char.upper(np.char.strip(table_field(table, 76, 78).astype(str)))
+    missing = elements == ''
+    if missing.any():
+        # Fall back to the first letter of the atom name, as most readers do
+        names = np.char.strip(table_field(table, 12, 16).astype(str))
+        elements[missing] = np.char.upper(np.array([name[:1] for name in names[missing]]))
+    return elements
+
+def read_chain_coords(pdb_file_path, chain_id='A', with_elements=False):
+    lines = read_atom_lines(pdb_file_path, chain_id)
+    if not lines:
+        coords = np.empty((0, 3), dtype=np.float64)
+        return (coords, np.array([], dtype=str)) if with_elements else coords
+    table = atom_table(lines)
+    coords = table_coords(table)
+    if with_elements:
+        return coords, table_elements(table)
+    return coords
+
+def read_ca_coords(pdb_file_path, chain_id='A'):
+    # C-alpha coordinates of one chain, in file order
+    lines = [line for line in read_atom_lines(pdb_file_path, chain_id) if line[12:16] == b' CA ']
+    if not lines:
+        return np.empty((0, 3), dtype=np.float64)
+    return table_coords(atom_table(lines))
+
+def atomic_masses(elements):
+    return np.array([ATOMIC_MASSES.get(element, ATOMIC_MASSES['C']) for element in elements.tolist()])
+
+def _read_for_rg(pdb_file_path, chain_id, mass_weighted):
+    try:
+        if mass_weighted:
+            coords, elements = read_chain_coords(pdb_file_path, chain_id, with_elements=True)
+            return coords, atomic_masses(elements)
+        return read_chain_coords(pdb_file_path, chain_id), None
+    except (OSError, ValueError) as e:
+        print(f"Error reading PDB file {pdb_file_path}: {e}")
+        return None, None
+
+def _rg_serial(pdb_file_paths, chain_id='A', mass_weighted=False):
+    # Read every file, then compute all radii of gyration in one vectorized
+    # pass over the concatenated coordinates using per-design segment sums
+    coord_blocks = []
+    weight_blocks = []
+    counts = np.zeros(len(pdb_file_paths), dtype=np.int64)
+    for index, pdb_file_path in enumerate(pdb_file_paths):
+        coords, masses = _read_for_rg(pdb_file_path, chain_id, mass_weighted)
+        if coords is None or len(coords) == 0:
+            continue
+        counts[index] = len(coords)
+        coord_blocks.append(coords)
+        weight_blocks.append(masses if mass_weighted else np.ones(len(coords)))
+
+    results = [None] * len(pdb_file_paths)
+    if not coord_blocks:
+        return results
+
+    coords = np.concatenate(coord_blocks)
+    weights = np.concatenate(weight_blocks)
+    present = np.nonzero(counts)[0]
+    starts = np.concatenate(([0], np.cumsum(counts[present])[:-1]))
+
+    total_weight = np.add.reduceat(weights, starts)
+    centers = np.add.reduceat(coords * weights[:, None], starts) / total_weight[:, None]
+    owner = np.repeat(np.arange(len(present)), counts[present])
+    sq_dist = ((coords - centers[owner]) ** 2).sum(axis=1)
+    rg = np.sqrt(np.add.reduceat(sq_dist * weights, starts) / total_weight)
+
+    for index, value in zip(present.tolist(), rg.tolist()):
+        results[index] = value
+    return results
+
+def _rg_chunk(job):
+    return _rg_serial(*job)
+
+def radius_of_gyration_batch(pdb_file_paths, chain_id='A', mass_weighted=False, workers=None, chunk_size=512):
+    # Radius of gyration of one chain for many PDB files, in input order (None
+    # where the file is unreadable or has no atoms in the chain). With workers
+    # > 1, chunks of files are processed in separate processes.
+    pdb_file_paths = list(pdb_file_paths)
+    if not workers or workers <= 1 or len(pdb_file_paths) <= chunk_size:
+        return _rg_serial(pdb_file_paths, chain_id, mass_weighted)
+
+    jobs = [(pdb_file_paths[i:i + chunk_size], chain_id, mass_weighted)
+            for i in range(0, len(pdb_file_paths), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results in executor.map(_rg_chunk, jobs):
+            results.extend(chunk_results)
+    return results
+
+def radius_of_gyration_dir(pdb_dir, chain_id='A', mass_weighted=False, workers=None):
+    # {file stem: Rg} for every PDB file in a directory
+    names = sorted(f for f in os.listdir(pdb_dir) if f.endswith('.pdb'))
+    values = radius_of_gyration_batch([os.path.join(pdb_dir, name) for name in names],
+                                      chain_id, mass_weighted, workers)
+    return {os.path.splitext(name)[0]: value for name, value in zip(names, values)}
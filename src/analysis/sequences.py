@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_io import ATOM_RECORDS
+
+# Chain sequences straight from PDB text. Only the residue name, residue
+# number and backbone C/N columns are read; no structure object is built.
+# The result matches Biopython's PPBuilder (first model, standard residues
+# only, peptides split where the C-N distance exceeds 1.8 A, peptides joined).
+
+THREE_TO_ONE = {
+    'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C', 'GLN': 'Q', 'GLU': 'E',
+    'GLY': 'G', 'HIS': 'H', 'ILE': 'I', 'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F',
+    'PRO': 'P', 'SER': 'S', 'THR': 'T', 'TRP': 'W', 'TYR': 'Y', 'VAL': 'V',
+}
+
+PEPTIDE_BOND_MAX = 1.8
+
+
+def _chain_residues(data, chain_id):
+    # Residues of one chain in file order as [res_name, C coords, N coords],
+    # or None if the chain has no atoms
+    chain = chain_id.encode()
+    residues = {}
+    for line in data.splitlines():
+        if line[:6] == b'ENDMDL' and residues:
+            break  # First model only
+        if line[:6] not in ATOM_RECORDS or line[21:22] != chain:
+            continue
+        if line[16:17] not in (b' ', b'A', b''):
+            continue
+        res_name = line[17:20].strip().decode()
+        # HETATM residues are distinct from ATOM residues with the same number
+        het = res_name if line[:6] == b'HETATM' else ''
+        key = (het, line[22:26].strip(), line[26:27])
+        residue = residues.get(key)
+        if residue is None:
+            residue = residues[key] = [res_name, None, None]
+        atom_name = line[12:16].strip()
+        if atom_name == b'C':
+            residue[1] = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+        elif atom_name == b'N':
+            residue[2] = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+    return list(residues.values()) if residues else None
+
+
+def _connected(previous, current):
+    if previous[1] is None or current[2] is None:
+        return False
+    return sum((a - b) ** 2 for a, b in zip(previous[1], current[2])) < PEPTIDE_BOND_MAX ** 2
+
+
+def sequence_from_bytes(data, chain_id='A'):
+    # One-letter sequence of a chain ('' if it has no peptide), None if the
+    # chain is absent
+    residues = _chain_residues(data, chain_id)
+    if residues is None:
+        return None
+    sequence = []
+    in_peptide = False
+    for previous, current in zip(residues, residues[1:]):
+        if previous[0] in THREE_TO_ONE and current[0] in THREE_TO_ONE and _connected(previous, current):
+            if not in_peptide:
+                sequence.append(THREE_TO_ONE[previous[0]])
+                in_peptide = True
+            sequence.append(THREE_TO_ONE[current[0]])
+        else:
+            in_peptide = False
+    return ''.join(sequence)
+
+
+def chain_sequence(pdb_file_path, chain_id='A'):
+    with open(pdb_file_path, 'rb') as pdb_file:
+        return sequence_from_bytes(pdb_file.read(), chain_id)
+
+
+def _sequence_job(job):
+    pdb_file_path, chain_id = job
+    try:
+        return chain_sequence(pdb_file_path, chain_id), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+def file_digest(pdb_file_path):
+    digest = hashlib.sha256()
+    with open(pdb_file_path, 'rb') as pdb_file:
+        for block in iter(lambda: pdb_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_sequence_cache(cache_path):
+    if not cache_path:
+        return {}
+    try:
+        with open(cache_path, 'r') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sequence_cache(cache_path, cache):
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(tmp_path, cache_path)
+
+
+def extract_sequences(pdb_file_paths, chain_id='A', workers=None, cache_path=None, chunksize=16):
+    # Chain sequences for many PDB files, in input order. Each entry is
+    # (sequence, error): sequence is None when the chain is missing or the
+    # file could not be read. Sequences are cached by file content hash, so a
+    # design copied between folders or rounds is parsed only once. workers=None
+    # uses one process per CPU, like the other batch readers; 1 stays serial.
+    pdb_file_paths = list(pdb_file_paths)
+    cache = load_sequence_cache(cache_path)
+    results = [None] * len(pdb_file_paths)
+    digests = {}
+    pending = []
+    for index, pdb_file_path in enumerate(pdb_file_paths):
+        try:
+            digest = file_digest(pdb_file_path)
+        except OSError as e:
+            results[index] = (None, str(e))
+            continue
+        key = f"{digest}:{chain_id}"
+        digests[index] = key
+        if key in cache:
+            results[index] = (cache[key], None)
+        else:
+            pending.append(index)
+
+    jobs = [(pdb_file_paths[index], chain_id) for index in pending]
+    executor = None
+    try:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1 or len(jobs) < 2:
+            outcomes = map(_sequence_job, jobs)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            outcomes = executor.map(_sequence_job, jobs, chunksize=chunksize)
+        for index, (sequence, error) in zip(pending, outcomes):
+            results[index] = (sequence, error)
+            if error is None:
+                cache[digests[index]] = sequence
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if cache_path and pending:
+        save_sequence_cache(cache_path, cache)
+    return results
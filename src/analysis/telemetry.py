@@ -0,0 +1,318 @@
+import os
+import sys
+import time
+import json
+import runpy
+import cProfile
+import pstats
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Structured timing events, one JSON object per line. main.py points
+# PIPELINE_TELEMETRY at the event file and sets PIPELINE_RUN_ID before any
+# stage starts; the analysis scripts it launches inherit both and append
+# their per-design events to the same file. Without PIPELINE_TELEMETRY
+# nothing is written, so the scripts behave as before when run by hand.
+#
+# Event names:
+#   stage          one main.py stage: wall, CPU (own thread + subprocesses), peak RSS
+#   subprocess     one command run by a stage: wall, CPU, peak RSS, exit code
+#   md.fix, md.build, md.minimize, md.dynamics      per design, run_md.py
+#   align.parse, align.superpose                    per design, align.py
+#
+# With PIPELINE_PROFILE_DIR set, Python analysis scripts started through
+# run_subprocess run under cProfile and leave a .prof file there.
+
+TELEMETRY_ENV = 'PIPELINE_TELEMETRY'
+RUN_ID_ENV = 'PIPELINE_RUN_ID'
+PROFILE_ENV = 'PIPELINE_PROFILE_DIR'
+
+_local = threading.local()
+
+
+def enabled():
+    return bool(os.environ.get(TELEMETRY_ENV))
+
+
+def enable(telemetry_path, run_id=None):
+    # Send events from this process and its children to telemetry_path
+    run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    directory = os.path.dirname(os.path.abspath(telemetry_path))
+    os.makedirs(directory, exist_ok=True)
+    os.environ[TELEMETRY_ENV] = os.path.abspath(telemetry_path)
+    os.environ[RUN_ID_ENV] = run_id
+    return run_id
+
+
+def emit(event, **fields):
+    telemetry_path = os.environ.get(TELEMETRY_ENV)
+    if not telemetry_path:
+        return
+    record = {'event': event, 'time': round(time.time(), 3), 'run': os.environ.get(RUN_ID_ENV), 'pid': os.getpid()}
+    record.update(fields)
+    line = (json.dumps(record) + '\n').encode()
+    # A single O_APPEND write per event, so concurrent processes never interleave lines
+    try:
+        fd = os.open(telemetry_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Warning: could not write telemetry to {telemetry_path}: {e}")
+
+
+@contextmanager
+def timed(event, **fields):
+    # Time the block and emit it as one event. The yielded dict can be
+    # filled in by the block (e.g. steps run); a raised exception is recorded
+    # as the event's error and re-raised.
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield fields
+    except BaseException as e:
+        fields['error'] = type(e).__name__
+        raise
+    finally:
+        fields['wall_s'] = round(time.perf_counter() - start_wall, 4)
+        fields['cpu_s'] = round(time.process_time() - start_cpu, 4)
+        emit(event, **fields)
+
+
+def peak_rss_mb(who=None):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(usage.ru_maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+@contextmanager
+def stage_scope(name):
+    # Wraps one stage (see StageGraph's monitor). CPU time and peak RSS of
+    # the subprocesses the stage starts from this thread are added up by
+    # run_subprocess.
+    _local.children = {'cpu_s': 0.0, 'peak_rss_mb': 0.0, 'subprocesses': 0}
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        children = _local.children
+        _local.children = None
+        emit('stage', stage=name, status=status,
+             wall_s=round(time.perf_counter() - start_wall, 3),
+             cpu_s=round(time.thread_time() - start_cpu + children['cpu_s'], 3),
+             peak_rss_mb=children['peak_rss_mb'] or None,
+             subprocesses=children['subprocesses'],
+             orchestrator_rss_mb=peak_rss_mb())
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def profiled_command(command):
+    # With PIPELINE_PROFILE_DIR set, run a 'python script.py ...' command
+    # under cProfile through this module's profile subcommand
+    profile_dir = os.environ.get(PROFILE_ENV)
+    if not profile_dir or len(command) < 2 or not str(command[1]).endswith('.py'):
+        return command
+    if os.path.basename(str(command[0])) not in ('python', 'python3', os.path.basename(sys.executable)):
+        return command
+    script = os.path.splitext(os.path.basename(str(command[1])))[0]
+    output = os.path.join(profile_dir, f"{script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    return [command[0], os.path.abspath(__file__), 'profile', '--output', output, '--'] + list(command[1:])
+
+
+def run_subprocess(command, check=True, labels=None, **popen_kwargs):
+    # subprocess.run replacement that records the child's wall time, CPU time
+    # and peak RSS (from wait4). stdout may be piped, with stderr either left
+    # alone or merged into it; the output is read before the child is reaped.
+    command = list(command)
+    start_wall = time.perf_counter()
+    process = subprocess.Popen(profiled_command(command), **popen_kwargs)
+    output = None
+    try:
+        if process.stdout is not None:
+            output = process.stdout.read()
+            process.stdout.close()
+        usage = None
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = _exit_code(status)
+        else:
+            process.wait()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    wall_s = time.perf_counter() - start_wall
+
+    fields = dict(labels or {})
+    fields.update(command=' '.join(os.path.basename(str(argument)) if index < 2 else str(argument)
+                                   for index, argument in enumerate(command[:8])),
+                  returncode=process.returncode, wall_s=round(wall_s, 3))
+    if usage is not None:
+        fields['cpu_s'] = round(usage.ru_utime + usage.ru_stime, 3)
+        fields['peak_rss_mb'] = round(usage.ru_maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0), 1)
+        children = getattr(_local, 'children', None)
+        if children is not None:
+            children['cpu_s'] += fields['cpu_s']
+            children['peak_rss_mb'] = max(children['peak_rss_mb'], fields['peak_rss_mb'])
+            children['subprocesses'] += 1
+    emit('subprocess', **fields)
+
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    return subprocess.CompletedProcess(command, process.returncode, output)
+
+
+def load_events(telemetry_path, run=None):
+    # Events of one run ('last' for the most recent, None for all)
+    events = []
+    with open(telemetry_path, 'r') as telemetry_file:
+        for line in telemetry_file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue  # Partially written line of an interrupted run
+    if run == 'last':
+        runs = [event.get('run') for event in events if event.get('run')]
+        run = runs[-1] if runs else None
+    if run is not None:
+        events = [event for event in events if event.get('run') == run]
+    return events
+
+
+def summarize(events, top=10):
+    # Stage hot spots, per-design phase totals and the slowest designs
+    stages = {}
+    for event in events:
+        if event['event'] != 'stage':
+            continue
+        row = stages.setdefault(event['stage'], {'runs': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0})
+        row['runs'] += 1
+        row['wall_s'] += event.get('wall_s') or 0.0
+        row['cpu_s'] += event.get('cpu_s') or 0.0
+        row['peak_rss_mb'] = max(row['peak_rss_mb'], event.get('peak_rss_mb') or 0.0)
+
+    phases = {}
+    designs = {}
+    for event in events:
+        if 'design' not in event or 'wall_s' not in event:
+            continue
+        name = event['event'] if event['event'] != 'subprocess' else f"{event.get('stage', 'subprocess')} (subprocess)"
+        row = phases.setdefault(name, {'count': 0, 'wall_s': 0.0, 'max_s': 0.0, 'slowest': None, 'ns_per_day': []})
+        row['count'] += 1
+        row['wall_s'] += event['wall_s']
+        if event['wall_s'] >= row['max_s']:
+            row['max_s'], row['slowest'] = event['wall_s'], event['design']
+        if event.get('ns_per_day'):
+            row['ns_per_day'].append(event['ns_per_day'])
+        if event['event'] != 'subprocess':
+            design = designs.setdefault(event['design'], {'wall_s': 0.0, 'phases': {}})
+            design['wall_s'] += event['wall_s']
+            design['phases'][event['event']] = design['phases'].get(event['event'], 0.0) + event['wall_s']
+
+    return {
+        'stages': sorted(stages.items(), key=lambda item: -item[1]['wall_s']),
+        'phases': sorted(phases.items(), key=lambda item: -item[1]['wall_s']),
+        'slowest_designs': sorted(designs.items(), key=lambda item: -item[1]['wall_s'])[:top],
+    }
+
+
+def print_summary(summary):
+    stages = summary['stages']
+    if stages:
+        total = sum(row['wall_s'] for _, row in stages) or 1.0
+        print(f"{'Stage':<24}{'Runs':>6}{'Wall s':>12}{'CPU s':>12}{'Peak RSS MB':>14}{'Share':>8}")
+        for name, row in stages:
+            print(f"{name:<24}{row['runs']:>6}{row['wall_s']:>12.1f}{row['cpu_s']:>12.1f}"
+                  f"{row['peak_rss_mb']:>14.0f}{100.0 * row['wall_s'] / total:>7.0f}%")
+        print()
+    phases = summary['phases']
+    if phases:
+        print(f"{'Design phase':<28}{'Count':>8}{'Total s':>12}{'Mean s':>10}{'Max s':>10}  Slowest")
+        for name, row in phases:
+            print(f"{name:<28}{row['count']:>8}{row['wall_s']:>12.1f}{row['wall_s'] / row['count']:>10.2f}"
+                  f"{row['max_s']:>10.2f}  {row['slowest']}")
+            if row['ns_per_day']:
+                rates = sorted(row['ns_per_day'])
+                print(f"{'':<28}MD throughput: median {rates[len(rates) // 2]:.1f} ns/day "
+                      f"(min {rates[0]:.1f}, max {rates[-1]:.1f})")
+        print()
+    designs = summary['slowest_designs']
+    if designs:
+        print(f"{'Slowest design':<40}{'Total s':>10}  Breakdown")
+        for name, row in designs:
+            breakdown = ', '.join(f"{phase} {seconds:.1f}" for phase, seconds in
+                                  sorted(row['phases'].items(), key=lambda item: -item[1]))
+            print(f"{name:<40}{row['wall_s']:>10.1f}  {breakdown}")
+    if not (stages or phases or designs):
+        print("No timing events found")
+
+
+def profile_script(script_path, script_args, output_path, top=25):
+    # Run an analysis script as __main__ under cProfile, write the stats and
+    # print the functions with the most cumulative time. Returns the
+    # script's exit code.
+    sys.argv = [script_path] + list(script_args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+    profiler = cProfile.Profile()
+    exit_code = 0
+    profiler.enable()
+    try:
+        runpy.run_path(script_path, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(output_path)
+        print(f"Profile written to {output_path}")
+        if top:
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(top)
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline timing telemetry: summaries and profiling")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summary', help="Print stage hot spots and the slowest designs")
+    summary_parser.add_argument("telemetry_file", help="Event file written by main.py (data/telemetry.jsonl)")
+    summary_parser.add_argument("--run", default='last', help="Run id to summarize ('last' or 'all')")
+    summary_parser.add_argument("--top", type=int, default=10, help="Number of slowest designs to list")
+    summary_parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    profile_parser = subparsers.add_parser('profile', help="Run an analysis script under cProfile")
+    profile_parser.add_argument("--output", required=True, help="Where to write the .prof stats")
+    profile_parser.add_argument("--top", type=int, default=25, help="Functions to print (0 for none)")
+    profile_parser.add_argument("script", help="Analysis script, e.g. src/analysis/run_md.py")
+    profile_parser.add_argument("script_args", nargs=argparse.REMAINDER, help="Arguments for the script")
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        summary = summarize(load_events(args.telemetry_file, None if args.run == 'all' else args.run), args.top)
+        if args.json:
+            print(json.dumps(summary, indent=1))
+        else:
+            print_summary(summary)
+    else:
+        sys.exit(profile_script(args.script, args.script_args, args.output, args.top))
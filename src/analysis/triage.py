@@ -0,0 +1,223 @@
+import os
+import ast
+import sys
+import json
+import argparse
+import numpy as np
+
+from af2_scores import load_scores
+from design_names import extract_base_design_name
+
+# Pre-MD triage over AF2 score files. A predicate such as
+#
+#   binder_aligned_rmsd < 4 and pae_interaction < 10 and plddt_binder > 80
+#
+# is parsed once and evaluated on whole score columns at a time. Designs that
+# pass can further be limited to the best K per RFdiffusion backbone. The
+# result is a keep-list (one AF2 description per line) that align.py reads
+# with --keep-list; nothing is deleted.
+
+COMPARISONS = {
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater,
+    ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+ARITHMETIC = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+}
+
+
+def _evaluate(node, scores):
+    # Evaluate one node of a parsed predicate on the score columns. Only
+    # column names, numbers, arithmetic, comparisons and and/or/not are
+    # accepted, so the expression cannot run arbitrary code.
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, scores)
+    if isinstance(node, ast.BoolOp):
+        values = [np.asarray(_evaluate(value, scores), dtype=bool) for value in node.values]
+        reduce = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+        return reduce(values)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ~np.asarray(_evaluate(node.operand, scores), dtype=bool)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_evaluate(node.operand, scores)
+    if isinstance(node, ast.Compare):
+        result = None
+        left = _evaluate(node.left, scores)
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in COMPARISONS:
+                raise ValueError(f"Unsupported comparison: {type(op).__name__}")
+            right = _evaluate(comparator, scores)
+            with np.errstate(invalid='ignore'):
+                step = COMPARISONS[type(op)](left, right)
+            result = step if result is None else result & step
+            left = right
+        return result
+    if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return ARITHMETIC[type(node.op)](_evaluate(node.left, scores), _evaluate(node.right, scores))
+    if isinstance(node, ast.Name):
+        if node.id not in scores or scores.column(node.id).dtype.kind != 'f':
+            numeric = sorted(name for name, values in scores.columns.items() if values.dtype.kind == 'f')
+            raise ValueError(f"Unknown score column '{node.id}' (available: {', '.join(numeric)})")
+        return scores.column(node.id)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return float(node.value)
+    raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+
+def parse_predicate(expression):
+    try:
+        return ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid predicate '{expression}': {e.msg}")
+
+
+def evaluate_predicate(scores, expression):
+    # Boolean mask over the score rows. Rows with a missing (NaN) metric fail
+    # every comparison on it.
+    mask = _evaluate(parse_predicate(expression), scores)
+    return np.broadcast_to(np.asarray(mask, dtype=bool), (len(scores),)).copy()
+
+
+def clause_failures(scores, expression):
+    # {clause: rows failing it} for each top-level 'and' clause, to show which
+    # criterion removes the most designs
+    tree = parse_predicate(expression)
+    body = tree.body
+    clauses = body.values if isinstance(body, ast.BoolOp) and isinstance(body.op, ast.And) else [body]
+    failures = {}
+    for clause in clauses:
+        text = ast.get_source_segment(expression, clause) or ast.dump(clause)
+        mask = np.broadcast_to(np.asarray(_evaluate(clause, scores), dtype=bool), (len(scores),))
+        failures[text] = int((~mask).sum())
+    return failures
+
+
+def top_k_per_backbone(scores, mask, k, rank_by):
+    # Restrict mask to the best k rows of each RFdiffusion backbone. rank_by
+    # is a score column, ascending; prefix it with '-' to prefer high values.
+    descending = rank_by.startswith('-')
+    column = rank_by.lstrip('-')
+    if column not in scores:
+        raise ValueError(f"Unknown score column '{column}' for ranking")
+    values = scores.column(column).astype(np.float64)
+    values = -values if descending else values
+    values = np.where(np.isnan(values), np.inf, values)  # Missing values rank last
+
+    backbones = np.array([extract_base_design_name(d) for d in scores.descriptions.tolist()], dtype=str)
+    _, backbone_codes = np.unique(backbones, return_inverse=True)
+    rows = np.nonzero(mask)[0]
+    order = rows[np.lexsort((values[rows], backbone_codes[rows]))]
+
+    # Position of each row within its backbone group, from the group start
+    codes = backbone_codes[order]
+    group_start = np.r_[True, codes[1:] != codes[:-1]]
+    starts = np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))
+    rank = np.arange(len(order)) - starts
+
+    limited = np.zeros(len(scores), dtype=bool)
+    limited[order[rank < k]] = True
+    return limited
+
+
+def write_keep_list(keep_list_path, descriptions, header_lines=()):
+    directory = os.path.dirname(os.path.abspath(keep_list_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{keep_list_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as keep_file:
+        for line in header_lines:
+            keep_file.write(f"# {line}\n")
+        for description in descriptions:
+            keep_file.write(description + '\n')
+    os.replace(tmp_path, keep_list_path)
+
+
+def load_keep_list(keep_list_path):
+    # Set of kept AF2 descriptions; comment and blank lines are ignored
+    keep = set()
+    with open(keep_list_path, 'r') as keep_file:
+        for line in keep_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                keep.add(line[:-4] if line.endswith('.pdb') else line)
+    return keep
+
+
+def triage(af2_score_paths, keep_list_path, predicate=None, top_k=None, rank_by='pae_interaction',
+           md_seconds=None, report_path=None):
+    # Evaluate the predicate and per-backbone limit over all score rows, write
+    # the keep-list and return a summary of what was removed
+    scores = load_scores(af2_score_paths)
+    mask = np.ones(len(scores), dtype=bool)
+    failures = {}
+    if predicate:
+        mask = evaluate_predicate(scores, predicate)
+        failures = clause_failures(scores, predicate)
+    passed = int(mask.sum())
+    if top_k:
+        mask = top_k_per_backbone(scores, mask, top_k, rank_by)
+
+    # A description appearing in several rows is kept if any of them passes
+    kept = sorted({description for description, keep in zip(scores.descriptions.tolist(), mask.tolist()) if keep})
+    backbones = {extract_base_design_name(d) for d in scores.descriptions.tolist()}
+    kept_backbones = {extract_base_design_name(d) for d in kept}
+
+    # One MD run per aligned backbone: every backbone without a kept
+    # prediction is an MD run that no longer happens
+    summary = {
+        'predicate': predicate,
+        'top_k_per_backbone': top_k,
+        'rank_by': rank_by if top_k else None,
+        'rows': len(scores),
+        'passed_predicate': passed,
+        'kept': len(kept),
+        'backbones': len(backbones),
+        'backbones_kept': len(kept_backbones),
+        'md_runs_avoided': len(backbones) - len(kept_backbones),
+        'clause_failures': failures,
+    }
+    if md_seconds:
+        summary['md_seconds_per_run'] = md_seconds
+        summary['md_hours_saved'] = round(summary['md_runs_avoided'] * md_seconds / 3600.0, 2)
+
+    write_keep_list(keep_list_path, kept, [
+        f"predicate: {predicate or '(none)'}",
+        f"top_k_per_backbone: {top_k or '(none)'}" + (f" by {rank_by}" if top_k else ''),
+        f"kept {len(kept)} of {len(scores)} predictions, {len(kept_backbones)} of {len(backbones)} backbones",
+    ])
+
+    print(f"Kept {len(kept)} of {len(scores)} predictions ({passed} passed the predicate), "
+          f"{len(kept_backbones)} of {len(backbones)} backbones -> {keep_list_path}")
+    for clause, count in failures.items():
+        print(f"  {count:6d} fail  {clause}")
+    saved = f", about {summary['md_hours_saved']} hours of MD" if md_seconds else ''
+    print(f"MD runs avoided: {summary['md_runs_avoided']}{saved}")
+    if report_path:
+        with open(report_path, 'w') as report_file:
+            json.dump(summary, report_file, indent=1)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select which AF2 predictions go on to alignment and MD")
+    parser.add_argument("af2_score_files", nargs='+', help="AF2 score file(s) (out.sc)")
+    parser.add_argument("--keep-list", required=True, help="Output file listing the kept AF2 descriptions")
+    parser.add_argument("--predicate", default=None,
+                        help="Condition on score columns, e.g. "
+                             "'binder_aligned_rmsd < 4 and pae_interaction < 10 and plddt_binder > 80'")
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="Keep at most this many predictions per backbone (main.py and campaign.py always "
+                             "use 1, as aligned and MD outputs are named after the backbone)")
+    parser.add_argument("--rank-by", default='pae_interaction',
+                        help="Column ranking predictions within a backbone (prefix '-' for higher is better)")
+    parser.add_argument("--md-seconds", type=float, default=None,
+                        help="Wall time of one MD run, used to report the MD time saved")
+    parser.add_argument("--report", default=None, help="Write the triage summary to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        triage(args.af2_score_files, args.keep_list, args.predicate, args.top_k, args.rank_by,
+               args.md_seconds, args.report)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+Resumable multi-round design campaign.
+
+Every round generates new designs within its budget (RFdiffusion backbones
+and ProteinMPNN sequences per backbone), takes them through filter -> AF2 ->
+align -> hotspot check -> MD -> merge, and carries the best designs of the
+previous round forward. Carried designs are not aligned or simulated again:
+their merged row and MD structure are reused as they are, and marked with the
+round they come from (CarriedFrom), so collect_top_designs.py counts each
+design once.
+
+Rounds are laid out the way collect_top_designs.py expects:
+
+    <campaign_dir>/rounds/round<N>/{rf,mpnn,af2,aligned,fixed,md_output}/
+    <campaign_dir>/rounds/round<N>/{energies,prodigy,merged_energies_post}.csv
+
+The checkpoint (<campaign_dir>/campaign.json) records every finished stage
+of every round and is saved after each stage and each MD chunk. Stages that
+work per design only pick up the designs without an output yet, so an
+interrupted campaign resumes at the stage, and design, where it stopped.
+"""
+
+import os
+import sys
+import csv
+import json
+import shlex
+import shutil
+import argparse
+from pathlib import Path
+
+src_dir = Path(__file__).resolve().parent
+analysis_dir = src_dir / "analysis"
+if str(analysis_dir) not in sys.path:
+    sys.path.append(str(analysis_dir))
+
+import sharding
+import telemetry
+import energy_sink
+from triage import triage, load_keep_list, write_keep_list
+from design_registry import design_id, build_registry
+from file_links import link_or_copy
+
+CAMPAIGN_VERSION = 1
+CHECKPOINT_FILE = "campaign.json"
+
+ROUND_STAGES = ["select_carry", "rfdiffusion", "filter_pdbs", "proteinmpnn", "af2", "align", "hotspot_filter",
+                "run_md", "coord_store", "prodigy", "merge_energies", "carry_forward"]
+
+DEFAULT_CONFIG = {
+    'rounds': 3,
+    'rf_designs': 100,
+    'seqs_per_struct': sharding.DEFAULT_SEQS_PER_STRUCT,
+    'carry': 20,
+    'cd20': "data/pdb/cd20.pdb",
+    'model_dir': "models",
+    'shards': 1,
+    'slots': 1,
+    'devices': None,
+    'rf_launcher': None,
+    'mpnn_launcher': None,
+    'af2_launcher': None,
+    'triage_predicate': None,
+    'rank_by': 'pae_interaction',
+    'min_hotspot_coverage': None,
+    'md_chunk': 8,
+    'md_retry_failed': False,
+    'md_workers': 1,
+    'md_platform': 'CUDA',
+    'md_args': [],
+    'prodigy_cmd': None,
+    'top_n': 1000,
+}
+
+# Settings captured by a round when it starts; changing them later only
+# affects the rounds that have not started yet
+ROUND_BUDGET_KEYS = ('rf_designs', 'seqs_per_struct', 'carry')
+
+AF2_SUFFIX = "_af2pred"
+
+
+def analysis_command(script, *args):
+    """Command line for one of the analysis scripts."""
+    return ["python", os.path.join(analysis_dir, script)] + [str(arg) for arg in args]
+
+
+def read_rows(csv_path):
+    """Rows of a CSV file as dicts, with its header; ([], []) if it does not exist."""
+    if not os.path.isfile(csv_path):
+        return [], []
+    with open(csv_path, 'r', newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        return list(reader.fieldnames or []), list(reader)
+
+
+def write_rows(csv_path, fieldnames, rows):
+    """Write rows atomically, so an interrupted write keeps the previous file."""
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pdb_stems(directory):
+    if not os.path.isdir(directory):
+        return set()
+    return {name[:-4] for name in os.listdir(directory) if name.endswith('.pdb')}
+
+
+class Campaign:
+    """A sequence of design rounds driven from a checkpoint file."""
+
+    def __init__(self, campaign_dir, config=None):
+        """
+        Args:
+            campaign_dir: Folder holding the checkpoint and the rounds.
+            config: Settings overriding those recorded in the checkpoint (or
+                DEFAULT_CONFIG for a new campaign).
+        """
+        self.campaign_dir = campaign_dir
+        self.rounds_dir = os.path.join(campaign_dir, "rounds")
+        self.checkpoint_path = os.path.join(campaign_dir, CHECKPOINT_FILE)
+        self.state = {'version': CAMPAIGN_VERSION, 'config': dict(DEFAULT_CONFIG), 'rounds': [], 'current': None}
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if state.get('version') != CAMPAIGN_VERSION:
+                raise ValueError(f"{self.checkpoint_path} was written by an incompatible version")
+            state['config'] = dict(DEFAULT_CONFIG, **state['config'])
+            self.state = state
+        self.state['config'].update(config or {})
+        self.config = self.state['config']
+
+    def save(self):
+        """Write the checkpoint atomically."""
+        os.makedirs(self.campaign_dir, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file, indent=1)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # -- Layout -------------------------------------------------------------
+
+    def round_dir(self, number, *parts):
+        return os.path.join(self.rounds_dir, f"round{number}", *parts)
+
+    def _round_record(self, number):
+        # The checkpoint entry of a round, created (with its budget and seed
+        # range) when the round starts
+        if number <= len(self.state['rounds']):
+            return self.state['rounds'][number - 1]
+        previous = self.state['rounds'][-1] if self.state['rounds'] else None
+        base_seed = previous['base_seed'] + previous['budget']['rf_designs'] if previous else 0
+        record = {
+            'round': number,
+            'base_seed': base_seed,
+            'budget': {key: self.config[key] for key in ROUND_BUDGET_KEYS},
+            'stages': {},
+            'carried': [],
+        }
+        self.state['rounds'].append(record)
+        return record
+
+    # -- Driver -------------------------------------------------------------
+
+    def run(self):
+        """
+        Run (or resume) every round up to config['rounds'], then collect
+        the top designs of all rounds.
+
+        Returns:
+            Path of the final top designs folder.
+        """
+        for number in range(1, self.config['rounds'] + 1):
+            record = self._round_record(number)
+            for stage in ROUND_STAGES:
+                if record['stages'].get(stage) == 'done':
+                    continue
+                self.state['current'] = {'round': number, 'stage': stage}
+                self.save()
+                print(f"[round {number}] {stage}")
+                with telemetry.stage_scope(f"round{number}.{stage}"):
+                    getattr(self, f"_{stage}")(number, record)
+                record['stages'][stage] = 'done'
+                self.save()
+
+        self.state['current'] = {'round': None, 'stage': 'collect_top_designs'}
+        self.save()
+        final_dir = os.path.join(self.campaign_dir, "final")
+        with telemetry.stage_scope("collect_top_designs"):
+            telemetry.run_subprocess(analysis_command(
+                "collect_top_designs.py", self.rounds_dir, final_dir, "--top-n", self.config['top_n']))
+        self.state['current'] = None
+        self.save()
+        return final_dir
+
+    # -- Stages -------------------------------------------------------------
+
+    def _select_carry(self, number, record):
+        # Best designs of the previous round, carried rows included, so a
+        # design stays in the campaign for as long as it ranks in the top
+        record['carried'] = []
+        if number == 1 or not record['budget']['carry']:
+            return
+        previous = self.round_dir(number - 1)
+        _, rows = read_rows(os.path.join(previous, "merged_energies_post.csv"))
+        scored = [row for row in rows
+                  if _to_float(row.get('Score')) is not None and _to_float(row.get('binder_aligned_rmsd')) is not None]
+        scored.sort(key=lambda row: _to_float(row['Score']))  # Stable, like collect_top_designs
+        for row in scored[:record['budget']['carry']]:
+            origin = row.pop('CarriedFrom', None) or f"round{number - 1}"
+            record['carried'].append({'origin': origin, 'row': row})
+        print(f"Carrying {len(record['carried'])} designs forward from round {number - 1}")
+
+    def _rfdiffusion(self, number, record):
+        # Design numbers base_seed .. base_seed + rf_designs - 1; only those
+        # without a backbone (kept or quarantined by the filter) are run
+        rf_dir = self.round_dir(number, "rf")
+        prefix = f"rnd{number}_binder_design"
+        present = _pdb_stems(rf_dir) | _pdb_stems(os.path.join(rf_dir, "quarantine"))
+        first = record['base_seed']
+        missing = [i for i in range(first, first + record['budget']['rf_designs'])
+                   if f"{prefix}_{i}" not in present]
+        if not missing:
+            return
+
+        # Contiguous runs of missing numbers, cut into pieces of at most
+        # len(missing) / shards numbers so the work spreads over about
+        # config['shards'] shards; all shards share the prefix, so names do
+        # not depend on how an earlier attempt was split
+        runs = []
+        for i in missing:
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        piece = -(-len(missing) // max(1, self.config['shards']))
+        runs = [(start, min(start + piece, end)) for run_start, end in runs for start in range(run_start, end, piece)]
+        work_dir = self.round_dir(number, "work", "rfdiffusion")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shards = [{
+            'shard': shard,
+            'num_designs': end - start,
+            'design_startnum': start,
+            'seed_range': [start, end - 1],
+            'output_prefix': prefix,
+            'output_dir': os.path.abspath(os.path.join(work_dir, f"shard_{shard}")),
+            'input_dir': os.path.abspath(os.path.dirname(self.config['cd20'])),
+            'model_dir': os.path.abspath(self.config['model_dir']),
+        } for shard, (start, end) in enumerate(runs)]
+        print(f"RFdiffusion: {len(missing)} of {record['budget']['rf_designs']} backbones to generate")
+        launcher = shlex.split(self.config['rf_launcher']) if self.config['rf_launcher'] else sharding.RFDIFFUSION_LAUNCHER
+        results = sharding.run_shards(shards, launcher, self.config['slots'], self.config['devices'])
+        # Backbones finished before a failure are kept, so a rerun only
+        # generates the rest
+        sharding.merge_shard_outputs(shards, rf_dir, patterns=("*.pdb", "*.trb"))
+        sharding.check_results(results)
+
+    def _filter_pdbs(self, number, record):
+        telemetry.run_subprocess(analysis_command("filter_pdbs.py", self.round_dir(number, "rf"), "--batch"))
+
+    def _run_folder_stage(self, number, kind, input_paths, output_dir, launcher, fields=None):
+        # Run ProteinMPNN or AF2 on the given inputs only, then move their
+        # outputs into output_dir and append their scores to its out.sc
+        work_dir = self.round_dir(number, "work", kind)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        input_dir = os.path.join(work_dir, "input")
+        merged_dir = os.path.join(work_dir, "merged")
+        os.makedirs(input_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        for path in input_paths:
+            link_or_copy(path, os.path.join(input_dir, os.path.basename(path)))
+        results = sharding.run_sharded_directory(input_dir, merged_dir, os.path.join(work_dir, "shards"), launcher,
+                                                 self.config['shards'], self.config['slots'],
+                                                 self.config['devices'], fields)
+
+        # Outputs of a failed run are kept as well, so a rerun only picks up
+        # the inputs that are still missing one
+        for name in sorted(os.listdir(merged_dir)):
+            if name.endswith('.pdb'):
+                shutil.copyfile(os.path.join(merged_dir, name), os.path.join(output_dir, name + '.tmp'))
+                os.replace(os.path.join(output_dir, name + '.tmp'), os.path.join(output_dir, name))
+        new_scores = os.path.join(merged_dir, sharding.SCORE_FILE)
+        if os.path.isfile(new_scores):
+            score_path = os.path.join(output_dir, sharding.SCORE_FILE)
+            has_header = os.path.isfile(score_path) and os.path.getsize(score_path) > 0
+            with open(new_scores, 'r') as source, open(score_path, 'a') as scores:
+                for line in source:
+                    if has_header and 'description' in line.split():
+                        continue
+                    scores.write(line if line.endswith('\n') else line + '\n')
+        sharding.check_results(results)
+
+    def _proteinmpnn(self, number, record):
+        rf_dir = self.round_dir(number, "rf")
+        mpnn_dir = self.round_dir(number, "mpnn")
+        designed = {}
+        for stem in _pdb_stems(mpnn_dir):
+            designed[design_id(stem)] = designed.get(design_id(stem), 0) + 1
+        pending = [os.path.join(rf_dir, stem + '.pdb') for stem in sorted(_pdb_stems(rf_dir))
+                   if designed.get(design_id(stem), 0) < record['budget']['seqs_per_struct']]
+        if not pending:
+            return
+        print(f"ProteinMPNN: {len(pending)} backbones, {record['budget']['seqs_per_struct']} sequences each")
+        launcher = (shlex.split(self.config['mpnn_launcher']) if self.config['mpnn_launcher']
+                    else sharding.PROTEINMPNN_LAUNCHER)
+        self._run_folder_stage(number, "proteinmpnn", pending, mpnn_dir, launcher,
+                               {'seqs_per_struct': record['budget']['seqs_per_struct']})
+
+    def _af2(self, number, record):
+        mpnn_dir = self.round_dir(number, "mpnn")
+        predicted = {stem[:-len(AF2_SUFFIX)] if stem.endswith(AF2_SUFFIX) else stem
+                     for stem in _pdb_stems(self.round_dir(number, "af2"))}
+        pending = [os.path.join(mpnn_dir, stem + '.pdb') for stem in sorted(_pdb_stems(mpnn_dir))
+                   if stem not in predicted]
+        if not pending:
+            return
+        print(f"AF2: {len(pending)} sequences to predict")
+        launcher = shlex.split(self.config['af2_launcher']) if self.config['af2_launcher'] else sharding.AF2_LAUNCHER
+        self._run_folder_stage(number, "af2", pending, self.round_dir(number, "af2"), launcher)
+
+    def _register(self, number, directories, tables=None):
+        # Record stage outputs in the round's design registry, through which
+        # merge_energies_post.py and collect_top_designs.py find each design
+        registry, _ = build_registry(self.round_dir(number, "design_registry.json"),
+                                     {kind: self.round_dir(number, folder) for kind, folder in directories.items()},
+                                     {kind: self.round_dir(number, *path) for kind, path in (tables or {}).items()})
+        print(f"Design registry: {len(registry)} designs")
+
+    def _align(self, number, record):
+        # One AF2 prediction per backbone (the best by rank_by, among those
+        # passing the triage predicate) is aligned and simulated
+        self._register(number, {'rf': "rf", 'mpnn': "mpnn", 'af2': "af2"}, {'scores': ("af2", sharding.SCORE_FILE)})
+        af2_dir = self.round_dir(number, "af2")
+        aligned_dir = self.round_dir(number, "aligned")
+        keep_list = self.round_dir(number, "keep_list.txt")
+        triage([os.path.join(af2_dir, sharding.SCORE_FILE)], keep_list, self.config['triage_predicate'],
+               1, self.config['rank_by'])
+        aligned = {design_id(stem) for stem in _pdb_stems(aligned_dir)}
+        available = _pdb_stems(af2_dir)
+        pending = sorted(description for description in load_keep_list(keep_list)
+                         if design_id(description) not in aligned and description in available)
+        if not pending:
+            return
+        pending_list = self.round_dir(number, "work", "align_pending.txt")
+        write_keep_list(pending_list, pending)
+        telemetry.run_subprocess(analysis_command(
+            "align.py", self.round_dir(number, "rf"), af2_dir, self.config['cd20'], aligned_dir,
+            "--parallel", "--keep-list", pending_list,
+            "--summary", self.round_dir(number, "work", "align_summary.json"),
+            "--registry", self.round_dir(number, "design_registry.json")))
+
+    def _hotspot_filter(self, number, record):
+        # Aligned designs that do not contact the RFdiffusion hotspots are
+        # left out of the MD input list
+        command = analysis_command(
+            "hotspot_filter.py", self.round_dir(number, "aligned"),
+            "--md-list", self.round_dir(number, "hotspot_pass.txt"),
+            "--report", self.round_dir(number, "hotspot_report.csv"),
+            "--maps", self.round_dir(number, "contact_maps.npz"))
+        if self.config['min_hotspot_coverage'] is not None:
+            command += ["--min-coverage", str(self.config['min_hotspot_coverage'])]
+        telemetry.run_subprocess(command)
+
+    def _simulated(self, energies_csv):
+        # OutputNames with a row in the energy sink
+        energy_sink.compact(energies_csv)
+        _, rows = read_rows(energies_csv)
+        return {row['OutputName'] for row in rows}
+
+    def _run_md(self, number, record):
+        # Designs that passed the hotspot filter without an energy row, in
+        # chunks; the checkpoint is saved after each chunk and the energy
+        # sink tells what finished. Designs run_md.py logged as failed are
+        # not retried unless md_retry_failed is set.
+        energies_csv = self.round_dir(number, "energies.csv")
+        failure_log = self.round_dir(number, "md_failures.tsv")
+        simulated = self._simulated(energies_csv)
+        failed = set()
+        if os.path.isfile(failure_log) and not self.config['md_retry_failed']:
+            with open(failure_log, 'r') as log_file:
+                failed = {os.path.abspath(line.split('\t', 1)[0]) for line in log_file if line.strip()}
+        passed = load_keep_list(self.round_dir(number, "hotspot_pass.txt"))
+        pending = [os.path.abspath(path + '.pdb') for path in sorted(passed)
+                   if f"{os.path.basename(path)}_md" not in simulated]
+        skipped = [path for path in pending if path in failed]
+        pending = [path for path in pending if path not in failed]
+        print(f"MD: {len(pending)} designs to simulate, {len(simulated)} already done"
+              + (f", {len(skipped)} failed before (see {failure_log}; retry with --retry-failed-md)"
+                 if skipped else ""))
+        record['md_done'] = len(simulated)
+
+        chunk_size = max(1, self.config['md_chunk'])
+        for start in range(0, len(pending), chunk_size):
+            chunk_list = self.round_dir(number, "work", "md_chunk.txt")
+            os.makedirs(os.path.dirname(chunk_list), exist_ok=True)
+            with open(chunk_list, 'w') as list_file:
+                list_file.write('\n'.join(pending[start:start + chunk_size]) + '\n')
+            telemetry.run_subprocess(analysis_command(
+                "run_md.py", "--batch", chunk_list, self.round_dir(number, "fixed"),
+                self.round_dir(number, "md_output"), energies_csv,
+                "--workers", self.config['md_workers'], "--platform", self.config['md_platform'],
+                "--failure-log", failure_log, *self.config['md_args']))
+            record['md_done'] = len(self._simulated(energies_csv))
+            self.save()
+        self._register(number, {'fixed': "fixed", 'md': "md_output"}, {'energies': ("energies.csv",)})
+
+    def _coord_store(self, number, record):
+        # The MD structures are parsed once into the coordinate store, which
+        # the merge reads Rg from
+        telemetry.run_subprocess(analysis_command(
+            "coord_store.py", "ingest", self.round_dir(number, "coord_store"),
+            "--md", self.round_dir(number, "md_output")))
+
+    def _prodigy(self, number, record):
+        prodigy_csv = self.round_dir(number, "prodigy.csv")
+        if self.config['prodigy_cmd']:
+            command = self.config['prodigy_cmd'].format(
+                round_dir=self.round_dir(number), md_dir=self.round_dir(number, "md_output"),
+                prodigy_csv=prodigy_csv)
+            telemetry.run_subprocess(["bash", "-c", command])
+        else:
+            telemetry.run_subprocess(analysis_command(
+                "binding_affinity.py", self.round_dir(number, "md_output"), prodigy_csv))
+        if not os.path.isfile(prodigy_csv):
+            raise FileNotFoundError(f"{prodigy_csv} was not written")
+
+    def _merge_energies(self, number, record):
+        telemetry.run_subprocess(analysis_command(
+            "merge_energies_post.py", self.round_dir(number, "energies.csv"), self.round_dir(number, "prodigy.csv"),
+            self.round_dir(number, "af2", sharding.SCORE_FILE), self.round_dir(number, "merged_energies_post.csv"),
+            self.round_dir(number, "md_output"), "--registry", self.round_dir(number, "design_registry.json"),
+            "--coord-store", self.round_dir(number, "coord_store")))
+
+    def _carry_forward(self, number, record):
+        # Add the carried designs' rows to this round's ranking and link their
+        # MD structures in, without aligning or simulating them again
+        merged_csv = self.round_dir(number, "merged_energies_post.csv")
+        fieldnames, rows = read_rows(merged_csv)
+        rows = [row for row in rows if not row.get('CarriedFrom')]  # Rerun-safe
+        md_dir = self.round_dir(number, "md_output")
+        os.makedirs(md_dir, exist_ok=True)
+        for carried in record['carried']:
+            row = dict(carried['row'], CarriedFrom=carried['origin'])
+            source = os.path.join(self.rounds_dir, carried['origin'], "md_output", row['OutputName'] + '.pdb')
+            if os.path.isfile(source):
+                # No hardlink: an MD re-run in the origin round rewrites its PDB in place
+                link_or_copy(source, os.path.join(md_dir, row['OutputName'] + '.pdb'), 'reflink')
+            rows.append(row)
+            for column in carried['row']:
+                if column not in fieldnames:
+                    fieldnames.append(column)
+        if 'CarriedFrom' not in fieldnames:
+            fieldnames.append('CarriedFrom')
+        write_rows(merged_csv, fieldnames, rows)
+        if record['carried']:
+            print(f"Round {number}: {len(rows) - len(record['carried'])} new and "
+                  f"{len(record['carried'])} carried designs ranked")
+
+    # -- Reporting ----------------------------------------------------------
+
+    def status(self):
+        """Print the budget and progress of every round."""
+        print(f"Campaign {self.campaign_dir}: {len(self.state['rounds'])} of {self.config['rounds']} rounds started")
+        for record in self.state['rounds']:
+            done = [stage for stage in ROUND_STAGES if record['stages'].get(stage) == 'done']
+            budget = record['budget']
+            print(f"  round {record['round']}: {budget['rf_designs']} backbones x {budget['seqs_per_struct']} "
+                  f"sequences (design numbers from {record['base_seed']}), "
+                  f"{len(record['carried'])} carried; {len(done)}/{len(ROUND_STAGES)} stages done"
+                  + (f", MD {record['md_done']} designs" if 'md_done' in record else ""))
+        current = self.state.get('current')
+        if current:
+            where = f"round {current['round']} " if current['round'] else ""
+            print(f"  resumes at {where}{current['stage']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a resumable multi-round design campaign")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Start or resume a campaign")
+    run_parser.add_argument("campaign_dir", help="Folder holding campaign.json and rounds/")
+    run_parser.add_argument("--rounds", type=int, default=None, help="Total number of rounds")
+    run_parser.add_argument("--rf-designs", type=int, default=None, help="New RFdiffusion backbones per round")
+    run_parser.add_argument("--seqs-per-struct", type=int, default=None,
+                            help="ProteinMPNN sequences per backbone")
+    run_parser.add_argument("--carry", type=int, default=None,
+                            help="Designs carried forward from the previous round")
+    run_parser.add_argument("--cd20", default=None, help="CD20 target PDB")
+    run_parser.add_argument("--model-dir", default=None, help="RFdiffusion model weights")
+    run_parser.add_argument("--shards", type=int, default=None, help="ProteinMPNN/AF2 shards per round")
+    run_parser.add_argument("--slots", type=int, default=None, help="Shards running at once")
+    run_parser.add_argument("--devices", default=None, help="Comma-separated GPU ids handed out to shard slots")
+    run_parser.add_argument("--rf-launcher", default=None, help="Command template replacing the RFdiffusion docker command")
+    run_parser.add_argument("--mpnn-launcher", default=None, help="Command template replacing the ProteinMPNN docker command")
+    run_parser.add_argument("--af2-launcher", default=None, help="Command template replacing the AF2 docker command")
+    run_parser.add_argument("--triage", dest="triage_predicate", default=None,
+                            help="Only align AF2 predictions matching this condition (see triage.py)")
+    run_parser.add_argument("--rank-by", default=None,
+                            help="Score column picking the AF2 prediction aligned for each backbone")
+    run_parser.add_argument("--min-hotspot-coverage", type=float, default=None,
+                            help="Fraction of the hotspot residues an aligned binder must contact to be simulated")
+    run_parser.add_argument("--md-chunk", type=int, default=None, help="Designs per MD batch (checkpoint interval)")
+    run_parser.add_argument("--md-workers", type=int, default=None, help="MD worker processes")
+    run_parser.add_argument("--retry-failed-md", dest="md_retry_failed", action="store_true",
+                            help="Simulate designs listed in a round's md_failures.tsv again (only for this run)")
+    run_parser.add_argument("--md-platform", default=None, help="OpenMM platform name")
+    run_parser.add_argument("--md-args", default=None, help="Extra run_md.py options, e.g. '--max-steps 1000'")
+    run_parser.add_argument("--prodigy-cmd", default=None,
+                            help="Shell command writing {prodigy_csv} from the structures in {md_dir} "
+                                 "(default: the built-in binding_affinity.py)")
+    run_parser.add_argument("--top-n", type=int, default=None, help="Designs collected across all rounds")
+    run_parser.add_argument("--telemetry", default=None, help="Append stage timing events to this JSONL file")
+
+    status_parser = subparsers.add_parser('status', help="Show the progress of a campaign")
+    status_parser.add_argument("campaign_dir")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        if not os.path.isfile(os.path.join(args.campaign_dir, CHECKPOINT_FILE)):
+            print(f"No campaign in {args.campaign_dir}")
+            sys.exit(1)
+        Campaign(args.campaign_dir).status()
+        sys.exit(0)
+
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG
+              if key not in ('devices', 'md_args') and getattr(args, key, None) is not None}
+    if args.devices:
+        config['devices'] = args.devices.split(',')
+    if args.md_args:
+        config['md_args'] = shlex.split(args.md_args)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+
+    campaign = Campaign(args.campaign_dir, config)
+    try:
+        final_dir = campaign.run()
+    except Exception as e:
+        current = campaign.state.get('current') or {}
+        print(f"Campaign stopped in round {current.get('round')} at {current.get('stage')}: {e}")
+        print(f"Rerun 'python src/campaign.py run {args.campaign_dir}' to resume from there.")
+        sys.exit(1)
+    print(f"Campaign complete: top designs in {final_dir}")
@@ -11,8 +11,8 @@ Date: March 2025
 """
 
 import os
+import csv
 import argparse
-import subprocess
 import sys
 from pathlib import Path
 
@@ -22,6 +22,36 @@ project_root = Path(__file__).resolve().parent.parent
 src_dir = project_root / "src"
 if str(src_dir) not in sys.path:
     sys.path.append(str(src_dir))
+analysis_dir = src_dir / "analysis"
+if str(analysis_dir) not in sys.path:
+    sys.path.append(str(analysis_dir))
+
+from stage_graph import Stage, StageGraph
+import telemetry
+import energy_sink
+from triage import load_keep_list, write_keep_list
+
+# Data locations shared by the stages (relative to the project root)
+CD20_PDB = "data/pdb/cd20.pdb"
+RFDIFF_OUTPUT_DIR = "data/output"
+MPNN_OUTPUT_DIR = "data/mpnn_output"
+AF2_OUTPUT_DIR = "data/af2_output"
+AF2_SCORE_FILE = os.path.join(AF2_OUTPUT_DIR, "out.sc")
+RESULTS_DIR = "data/results"
+ROUND_DIR = os.path.join(RESULTS_DIR, "round1")
+FINAL_DIR = os.path.join(RESULTS_DIR, "final")
+STATE_FILE = "data/pipeline_state.json"
+SHARD_WORK_DIR = "data/shards"
+WORKER_SPOOL_DIR = "data/workers"
+TELEMETRY_FILE = "data/telemetry.jsonl"
+
+KEEP_LIST = os.path.join(ROUND_DIR, "keep_list.txt")
+DESIGN_REGISTRY = os.path.join(ROUND_DIR, "design_registry.json")
+HOTSPOT_PASS_LIST = os.path.join(ROUND_DIR, "hotspot_pass.txt")
+COORD_STORE = os.path.join(ROUND_DIR, "coord_store")
+
+ANALYSIS_STAGES = ["filter_pdbs", "triage", "align", "hotspot_filter", "run_md", "coord_store", "prodigy",
+                   "merge_energies", "collect_top_designs"]
 
 def create_directories():
     """Create necessary directories for pipeline execution."""
@@ -37,82 +67,464 @@ def create_directories():
     
     print("Created directory structure")
 
-def run_rfdiffusion(args):
-    """Run RFDiffusion to generate initial binder structures."""
-    print("Starting RFDiffusion for initial binder generation...")
-    script_path = os.path.join(src_dir, "scripts", "run_rfdiff.sh")
-    
-    # Ensure script is executable
-    subprocess.run(["chmod", "+x", script_path])
-    
-    # Run the RFDiffusion script
-    subprocess.run([script_path], check=True)
-    print("RFDiffusion complete")
+def run_command(command):
+    """Return a stage action that runs a command and raises if it fails."""
+    def action():
+        telemetry.run_subprocess(command)
+    return action
 
-def run_proteinmpnn_af2(args):
+def analysis_command(script, *args):
+    """Command line for one of the analysis scripts."""
+    return ["python", os.path.join(src_dir, "analysis", script)] + [str(arg) for arg in args]
+
+def run_proteinmpnn_af2():
     """Run ProteinMPNN for sequence design and AlphaFold2 for structure prediction."""
     print("Starting ProteinMPNN and AlphaFold2 pipeline...")
-    
-    # Setup the Docker environment if needed
-    setup_script = os.path.join(src_dir, "proteinmpnn_af2", "setup.sh")
-    subprocess.run(["chmod", "+x", setup_script])
-    subprocess.run([setup_script], check=True)
-    
+
     # Run the Docker container
     docker_script = os.path.join(src_dir, "proteinmpnn_af2", "run_docker.sh")
-    subprocess.run(["chmod", "+x", docker_script])
-    subprocess.run([docker_script], check=True)
+    telemetry.run_subprocess(["bash", docker_script])
     
+    # The beta_model_*.py files are shell scripts despite their extension
     # Run ProteinMPNN
     mpnn_script = os.path.join(src_dir, "proteinmpnn_af2", "beta_model_mpnn.py")
-    subprocess.run(["conda", "run", "-n", "proteinmpnn_binder_design", "python", mpnn_script], check=True)
+    telemetry.run_subprocess(["conda", "run", "-n", "proteinmpnn_binder_design", "bash", mpnn_script])
     
     # Run AlphaFold2
     af2_script = os.path.join(src_dir, "proteinmpnn_af2", "beta_model_af2.py")
-    subprocess.run(["conda", "run", "-n", "af2_binder_design", "python", af2_script], check=True)
+    telemetry.run_subprocess(["conda", "run", "-n", "af2_binder_design", "bash", af2_script])
     
     print("ProteinMPNN and AlphaFold2 complete")
 
-def run_analysis(args):
-    """Run analysis scripts to evaluate and rank designs."""
-    print("Starting analysis of designed binders...")
-    
-    # Run analysis scripts in sequence
-    scripts = [
-        "filter_pdbs.py",
-        "align.py",
-        "run_md.py",
-        "merge_energies.py",
-        "collect_top_designs.py"
-    ]
-    
-    for script in scripts:
-        script_path = os.path.join(src_dir, "analysis", script)
-        subprocess.run(["python", script_path], check=True)
-    
-    print("Analysis complete")
+def register_designs(directories, tables=None):
+    """
+    Record stage outputs in the round's design registry, through which
+    merge_energies_post.py and collect_top_designs.py find each design.
+    """
+    from design_registry import build_registry
+    registry, _ = build_registry(DESIGN_REGISTRY, directories, tables)
+    print(f"Design registry updated: {DESIGN_REGISTRY} ({len(registry)} designs)")
+
+def registering(action, directories, tables=None):
+    """Stage action running action, then registering its outputs."""
+    def registered_action():
+        action()
+        register_designs(directories, tables)
+    return registered_action
+
+def simulated_designs(energies_csv):
+    """OutputNames with a row in the energy sink (compacted first)."""
+    energy_sink.compact(energies_csv)
+    if not os.path.isfile(energies_csv):
+        return set()
+    with open(energies_csv, 'r', newline='') as csvfile:
+        return {row['OutputName'] for row in csv.DictReader(csvfile)}
+
+def run_md(from_scratch=False):
+    """
+    Run the MD batch on the aligned designs that passed the hotspot filter;
+    run_md.py records rows through the energy sink. As in campaign.py,
+    designs that already have an energy row, or that run_md.py logged as
+    failed, are skipped; from_scratch (--force run_md) clears the energies
+    and the failure log and simulates every design again.
+    """
+    energies_csv = os.path.join(ROUND_DIR, "energies.csv")
+    failure_log = os.path.join(ROUND_DIR, "md_failures.tsv")
+    if from_scratch:
+        energy_sink.reset(energies_csv)
+        if os.path.isfile(failure_log):
+            os.remove(failure_log)
+    simulated = simulated_designs(energies_csv)
+    failed = set()
+    if os.path.isfile(failure_log):
+        with open(failure_log, 'r') as log_file:
+            failed = {os.path.abspath(line.split('\t', 1)[0]) for line in log_file if line.strip()}
+    pending = [os.path.abspath(path + '.pdb') for path in sorted(load_keep_list(HOTSPOT_PASS_LIST))
+               if f"{os.path.basename(path)}_md" not in simulated]
+    skipped = [path for path in pending if path in failed]
+    pending = [path for path in pending if path not in failed]
+    print(f"MD: {len(pending)} designs to simulate, {len(simulated)} already done"
+          + (f", {len(skipped)} failed before (see {failure_log}; retry with --force run_md)" if skipped else ""))
+    if pending:
+        pending_list = os.path.join(ROUND_DIR, "md_pending.txt")
+        write_keep_list(pending_list, pending)
+        telemetry.run_subprocess(analysis_command(
+            "run_md.py", "--batch", pending_list, os.path.join(ROUND_DIR, "fixed"),
+            os.path.join(ROUND_DIR, "md_output"), energies_csv, "--failure-log", failure_log))
+    register_designs({"fixed": os.path.join(ROUND_DIR, "fixed"), "md": os.path.join(ROUND_DIR, "md_output")},
+                     {"energies": energies_csv})
+
+def run_md_action(from_scratch=False):
+    """Stage action for run_md."""
+    def action():
+        run_md(from_scratch)
+    return action
+
+def sharded_rfdiffusion(sharding):
+    """Stage action running RFdiffusion as concurrent shards merged into RFDIFF_OUTPUT_DIR."""
+    def action():
+        from sharding import run_sharded_rfdiffusion, check_results
+        results = run_sharded_rfdiffusion(
+            sharding["num_designs"], sharding["shards"], os.path.dirname(CD20_PDB), RFDIFF_OUTPUT_DIR,
+            "models", os.path.join(SHARD_WORK_DIR, "rfdiffusion"), sharding["slots"], sharding["devices"])
+        check_results(results)
+    return action
+
+def sharded_proteinmpnn_af2(sharding):
+    """Stage action running ProteinMPNN, then AF2, each as concurrent shards."""
+    def action():
+        from sharding import run_sharded_directory, check_results, PROTEINMPNN_LAUNCHER, AF2_LAUNCHER
+        for name, input_dir, output_dir, launcher in (
+                ("proteinmpnn", RFDIFF_OUTPUT_DIR, MPNN_OUTPUT_DIR, PROTEINMPNN_LAUNCHER),
+                ("af2", MPNN_OUTPUT_DIR, AF2_OUTPUT_DIR, AF2_LAUNCHER)):
+            results = run_sharded_directory(input_dir, output_dir, os.path.join(SHARD_WORK_DIR, name), launcher,
+                                            sharding["shards"], sharding["slots"], sharding["devices"])
+            check_results(results)
+    return action
+
+def warm_worker_proteinmpnn_af2(backend):
+    """
+    Stage action sending ProteinMPNN and AF2 jobs to long-lived workers.
+
+    Workers are started on first use and left running, so the next round
+    reuses their container and library imports; each job still loads the
+    models.
+    """
+    def action():
+        import model_worker
+        launcher = None
+        if backend == "local":
+            launcher = ["{python}", os.path.join(src_dir, "model_worker.py"), "serve", "{spool}",
+                        "--kind", "{kind}", "--backend", "local"]
+        for kind, input_dir, output_dir in (("proteinmpnn", RFDIFF_OUTPUT_DIR, MPNN_OUTPUT_DIR),
+                                            ("af2", MPNN_OUTPUT_DIR, AF2_OUTPUT_DIR)):
+            spool = os.path.join(WORKER_SPOOL_DIR, kind)
+            model_worker.ensure_worker(spool, kind, launcher)
+            model_worker.run_job(spool, kind, input_dir, output_dir)
+    return action
+
+def build_graph(state_path, sharding=None, warm_workers=None, triage=None, min_hotspot_coverage=None,
+                rerun_md=False):
+    """
+    Declare the pipeline stages, their inputs, outputs and dependencies.
+
+    The image build only depends on the Dockerfile, the PyRosetta wheel and
+    setup.sh, so it is skipped unless one of them changes. RFdiffusion and
+    the image build are independent and run at the same time. With more than
+    one shard, the GPU stages are split across concurrent shards; with
+    warm_workers ('docker' or 'local'), ProteinMPNN and AF2 run as jobs on
+    long-lived workers instead. With triage (a dict with predicate, top_k
+    and rank_by), a triage stage writes a keep-list of AF2 predictions and
+    only those are aligned and simulated; top_k must be 1, since aligned
+    structures are named after their backbone. Aligned designs contacting fewer
+    than min_hotspot_coverage of the RFdiffusion hotspots (the
+    hotspot_filter.py default if None) are not simulated. run_md only
+    simulates designs without an energy row unless rerun_md is set.
+    """
+    graph = StageGraph(state_path, monitor=telemetry.stage_scope)
+    proteinmpnn_af2_dir = os.path.join(src_dir, "proteinmpnn_af2")
+    rfdiff_script = os.path.join(src_dir, "scripts", "run_rfdiff.sh")
+    setup_script = os.path.join(proteinmpnn_af2_dir, "setup.sh")
+
+    graph.add(Stage(
+        "setup_dl_binder_design", run_command(["bash", setup_script]),
+        inputs=[setup_script, os.path.join(proteinmpnn_af2_dir, "Dockerfile"),
+                os.path.join(proteinmpnn_af2_dir, "pyrosetta-*.whl")]))
+
+    sharded = sharding is not None and sharding["shards"] > 1
+    graph.add(Stage(
+        "rfdiffusion", sharded_rfdiffusion(sharding) if sharded else run_command(["bash", rfdiff_script]),
+        inputs=[rfdiff_script, CD20_PDB],
+        outputs=[RFDIFF_OUTPUT_DIR],
+        params={"sharding": sharding} if sharded else {}))
+
+    filter_command = analysis_command("filter_pdbs.py", RFDIFF_OUTPUT_DIR, "--batch")
+    graph.add(Stage(
+        "filter_pdbs", run_command(filter_command),
+        inputs=[RFDIFF_OUTPUT_DIR],
+        outputs=[os.path.join(RFDIFF_OUTPUT_DIR, "filter_manifest.json")],
+        deps=["rfdiffusion"],
+        params={"command": filter_command[1:]}))
+
+    if warm_workers:
+        proteinmpnn_af2_action = warm_worker_proteinmpnn_af2(warm_workers)
+    elif sharded:
+        proteinmpnn_af2_action = sharded_proteinmpnn_af2(sharding)
+    else:
+        proteinmpnn_af2_action = run_proteinmpnn_af2
+    graph.add(Stage(
+        "proteinmpnn_af2", registering(proteinmpnn_af2_action, {"mpnn": MPNN_OUTPUT_DIR, "af2": AF2_OUTPUT_DIR},
+                                       {"scores": AF2_SCORE_FILE}),
+        inputs=[RFDIFF_OUTPUT_DIR, os.path.join(proteinmpnn_af2_dir, "beta_model_mpnn.py"),
+                os.path.join(proteinmpnn_af2_dir, "beta_model_af2.py")],
+        outputs=[AF2_OUTPUT_DIR],
+        deps=["setup_dl_binder_design", "filter_pdbs"],
+        params=dict({"sharding": sharding} if sharded else {}, **({"workers": warm_workers} if warm_workers else {}))))
+
+    align_deps = ["filter_pdbs", "proteinmpnn_af2"]
+    align_options = []
+    if triage:
+        triage_command = analysis_command(
+            "triage.py", AF2_SCORE_FILE, "--keep-list", KEEP_LIST,
+            "--report", os.path.join(ROUND_DIR, "triage_report.json"))
+        if triage.get("predicate"):
+            triage_command += ["--predicate", triage["predicate"]]
+        if triage.get("top_k"):
+            triage_command += ["--top-k", str(triage["top_k"]), "--rank-by", triage["rank_by"]]
+        graph.add(Stage(
+            "triage", run_command(triage_command),
+            inputs=[AF2_SCORE_FILE],
+            outputs=[KEEP_LIST],
+            deps=["proteinmpnn_af2"],
+            params={"command": triage_command[1:]}))
+        align_deps.append("triage")
+        align_options = ["--keep-list", KEEP_LIST]
+
+    aligned_dir = os.path.join(ROUND_DIR, "aligned")
+    align_command = analysis_command("align.py", RFDIFF_OUTPUT_DIR, AF2_OUTPUT_DIR, CD20_PDB, aligned_dir,
+                                     "--parallel", "--registry", DESIGN_REGISTRY, *align_options)
+    graph.add(Stage(
+        "align", run_command(align_command),
+        inputs=[RFDIFF_OUTPUT_DIR, AF2_OUTPUT_DIR, CD20_PDB] + ([KEEP_LIST] if triage else []),
+        outputs=[aligned_dir],
+        deps=align_deps,
+        params={"command": align_command[1:]}))
+
+    hotspot_command = analysis_command(
+        "hotspot_filter.py", aligned_dir, "--md-list", HOTSPOT_PASS_LIST,
+        "--report", os.path.join(ROUND_DIR, "hotspot_report.csv"),
+        "--maps", os.path.join(ROUND_DIR, "contact_maps.npz"))
+    if min_hotspot_coverage is not None:
+        hotspot_command += ["--min-coverage", str(min_hotspot_coverage)]
+    graph.add(Stage(
+        "hotspot_filter", run_command(hotspot_command),
+        inputs=[aligned_dir, os.path.join(src_dir, "analysis", "hotspot_filter.py")],
+        outputs=[HOTSPOT_PASS_LIST],
+        deps=["align"],
+        params={"command": hotspot_command[1:]}))
+
+    energies_csv = os.path.join(ROUND_DIR, "energies.csv")
+    md_output_dir = os.path.join(ROUND_DIR, "md_output")
+    graph.add(Stage(
+        "run_md", run_md_action(rerun_md),
+        inputs=[HOTSPOT_PASS_LIST, os.path.join(src_dir, "analysis", "run_md.py")],
+        outputs=[energies_csv, md_output_dir],
+        deps=["hotspot_filter"]))
+
+    prodigy_csv = os.path.join(ROUND_DIR, "prodigy.csv")
+    prodigy_command = analysis_command("binding_affinity.py", md_output_dir, prodigy_csv)
+    graph.add(Stage(
+        "prodigy", run_command(prodigy_command),
+        inputs=[md_output_dir, os.path.join(src_dir, "analysis", "binding_affinity.py")],
+        outputs=[prodigy_csv],
+        deps=["run_md"],
+        params={"command": prodigy_command[1:]}))
+
+    # The MD structures are parsed once into the coordinate store, which the
+    # merge reads Rg from
+    coord_store_command = analysis_command("coord_store.py", "ingest", COORD_STORE, "--md", md_output_dir)
+    graph.add(Stage(
+        "coord_store", run_command(coord_store_command),
+        inputs=[md_output_dir, os.path.join(src_dir, "analysis", "coord_store.py")],
+        outputs=[os.path.join(COORD_STORE, "index.json")],
+        deps=["run_md"],
+        params={"command": coord_store_command[1:]}))
+
+    merged_csv = os.path.join(ROUND_DIR, "merged_energies_post.csv")
+    merge_command = analysis_command(
+        "merge_energies_post.py", energies_csv, prodigy_csv, AF2_SCORE_FILE, merged_csv, md_output_dir,
+        "--registry", DESIGN_REGISTRY, "--coord-store", COORD_STORE)
+    graph.add(Stage(
+        "merge_energies", run_command(merge_command),
+        inputs=[energies_csv, prodigy_csv, AF2_SCORE_FILE, md_output_dir, os.path.join(COORD_STORE, "index.json")],
+        outputs=[merged_csv],
+        deps=["run_md", "coord_store", "prodigy"],
+        params={"command": merge_command[1:]}))
+
+    collect_command = analysis_command("collect_top_designs.py", RESULTS_DIR, FINAL_DIR, "--top-n", 1000)
+    graph.add(Stage(
+        "collect_top_designs", run_command(collect_command),
+        inputs=[os.path.join(RESULTS_DIR, "*", "merged_energies_post.csv")],
+        outputs=[os.path.join(FINAL_DIR, "top_designs.csv")],
+        deps=["merge_energies"],
+        params={"command": collect_command[1:]}))
+    return graph
+
+def run_streaming(graph, args):
+    """
+    Run the GPU stages in the background and stream each AF2 prediction
+    through filter -> align -> hotspot check -> MD as soon as it lands, then
+    score, merge and rank.
+    """
+    from streaming import StreamingPipeline, build_stages, DEFAULT_COMMANDS
+
+    # The image build keeps its up-to-date check
+    if not args.skip_proteinmpnn_af2:
+        results = graph.run(skip=[name for name in graph.stages if name != "setup_dl_binder_design"],
+                            force=args.force)
+        if results["setup_dl_binder_design"] == "failed":
+            sys.exit(1)
+
+    producers = []
+    if not args.skip_rfdiffusion:
+        producers.append(graph.stages["rfdiffusion"].action)
+    if not args.skip_proteinmpnn_af2:
+        producers.append(graph.stages["proteinmpnn_af2"].action)
+
+    commands = {}
+    if args.min_hotspot_coverage is not None:
+        commands['hotspots'] = DEFAULT_COMMANDS['hotspots'] + ["--min-coverage", str(args.min_hotspot_coverage)]
+    pipeline = StreamingPipeline(AF2_OUTPUT_DIR, AF2_SCORE_FILE, RFDIFF_OUTPUT_DIR, ROUND_DIR, CD20_PDB,
+                                 build_stages(commands), queue_size=args.stream_queue_size)
+    summary = pipeline.run(producers)
+    if "producer_error" in summary:
+        sys.exit(1)
+
+    post_stages = ("coord_store", "prodigy", "merge_energies", "collect_top_designs")
+    results = graph.run(skip=[name for name in graph.stages if name not in post_stages], force=args.force)
+    if any(status in ("failed", "blocked") for status in results.values()):
+        sys.exit(1)
+    print("Pipeline completed successfully!")
+
+def run_campaign(args, sharding, triage):
+    """Run or resume a multi-round campaign with the budget and sharding given on the command line."""
+    from campaign import Campaign
+
+    config = {
+        "rf_designs": args.num_designs,
+        "cd20": CD20_PDB,
+        "shards": sharding["shards"],
+        "slots": sharding["slots"],
+        "devices": sharding["devices"],
+        "md_retry_failed": False,
+    }
+    if args.rounds:
+        config["rounds"] = args.rounds
+    if triage and triage["predicate"]:
+        config["triage_predicate"] = triage["predicate"]
+    if args.min_hotspot_coverage is not None:
+        config["min_hotspot_coverage"] = args.min_hotspot_coverage
+    campaign = Campaign(args.campaign, config)
+    try:
+        final_dir = campaign.run()
+    except Exception as e:
+        current = campaign.state.get("current") or {}
+        print(f"Campaign stopped in round {current.get('round')} at {current.get('stage')}: {e}. "
+              "Rerun to resume from there.")
+        sys.exit(1)
+    print(f"Campaign complete: top designs in {final_dir}")
 
 def main():
     parser = argparse.ArgumentParser(description="CD20 Protein Binder Design Pipeline")
     parser.add_argument("--skip-rfdiffusion", action="store_true", help="Skip RFDiffusion step")
     parser.add_argument("--skip-proteinmpnn-af2", action="store_true", help="Skip ProteinMPNN and AlphaFold2 steps")
     parser.add_argument("--skip-analysis", action="store_true", help="Skip analysis steps")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="Run a stage even if its inputs are unchanged (repeatable; 'all' for every stage)")
+    parser.add_argument("--jobs", type=int, default=4, help="Maximum number of stages running at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run")
+    parser.add_argument("--state-file", default=STATE_FILE, help="Where stage stamps are recorded")
+    parser.add_argument("--stream", action="store_true",
+                        help="Analyse each AF2 prediction as it lands instead of after the whole batch")
+    parser.add_argument("--stream-queue-size", type=int, default=8,
+                        help="Designs buffered between two streaming stages")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split RFDiffusion, ProteinMPNN and AF2 into this many concurrent shards")
+    parser.add_argument("--slots", type=int, default=None,
+                        help="Shards running at once (default: one per device, or 1)")
+    parser.add_argument("--devices", default=None, help="Comma-separated GPU ids handed out to shard slots")
+    parser.add_argument("--num-designs", type=int, default=100, help="RFDiffusion design budget when sharding (per round with --campaign)")
+    parser.add_argument("--warm-workers", nargs="?", const="docker", choices=["docker", "local"], default=None,
+                        help="Run ProteinMPNN/AF2 as jobs on long-lived workers, reused across rounds "
+                             "('local' uses the model-free stand-in worker)")
+    parser.add_argument("--triage", default=None, metavar="PREDICATE",
+                        help="Only align and simulate AF2 predictions matching this condition, e.g. "
+                             "'binder_aligned_rmsd < 4 and pae_interaction < 10 and plddt_binder > 80'")
+    parser.add_argument("--triage-top-k", type=int, default=None,
+                        help="Best AF2 predictions of each backbone to align and simulate; only 1 is supported, "
+                             "as aligned and MD outputs are named after the backbone (the default with --triage). "
+                             "Larger K is only available from the standalone src/analysis/triage.py --top-k")
+    parser.add_argument("--triage-rank-by", default="pae_interaction",
+                        help="Score column ranking predictions for --triage-top-k ('-' prefix: higher is better)")
+    parser.add_argument("--min-hotspot-coverage", type=float, default=None,
+                        help="Fraction of the RFdiffusion hotspot residues an aligned binder must contact to be "
+                             "simulated (default: 0.25, see src/analysis/hotspot_filter.py; 0 keeps every design)")
+    parser.add_argument("--telemetry", default=TELEMETRY_FILE,
+                        help="Append stage and per-design timing events to this JSONL file "
+                             "(summarize with src/analysis/telemetry.py summary)")
+    parser.add_argument("--no-telemetry", action="store_true", help="Do not record timing events")
+    parser.add_argument("--profile", default=None, metavar="DIR",
+                        help="Run the analysis scripts under cProfile and write their .prof files to DIR")
+    parser.add_argument("--campaign", default=None, metavar="DIR",
+                        help="Run (or resume) a multi-round campaign in DIR instead of a single round "
+                             "(see src/campaign.py)")
+    parser.add_argument("--rounds", type=int, default=None, help="Total number of campaign rounds")
     args = parser.parse_args()
+    if args.warm_workers and args.shards > 1:
+        parser.error("--warm-workers and --shards cannot be combined")
+    if args.stream and (args.skip_analysis or args.dry_run):
+        parser.error("--stream cannot be combined with --skip-analysis or --dry-run")
+    if args.campaign and (args.stream or args.dry_run or args.warm_workers):
+        parser.error("--campaign cannot be combined with --stream, --dry-run or --warm-workers")
+    if args.stream and (args.triage or args.triage_top_k):
+        parser.error("--triage/--triage-top-k need the whole AF2 batch and cannot be combined with --stream")
+    if args.triage_top_k not in (None, 1):
+        parser.error("--triage-top-k must be 1: align.py keeps one prediction per backbone")
 
     # Create directory structure
     create_directories()
-    
-    # Run pipeline components unless skipped
-    if not args.skip_rfdiffusion:
-        run_rfdiffusion(args)
-    
-    if not args.skip_proteinmpnn_af2:
-        run_proteinmpnn_af2(args)
-    
-    if not args.skip_analysis:
-        run_analysis(args)
-    
+
+    # Child processes inherit these, so the analysis scripts report to the same file
+    if not args.no_telemetry and not args.dry_run:
+        run_id = telemetry.enable(args.telemetry)
+        print(f"Recording timing events for run {run_id} in {args.telemetry}")
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        os.environ[telemetry.PROFILE_ENV] = os.path.abspath(args.profile)
+
+    devices = args.devices.split(",") if args.devices else None
+    sharding = {
+        "shards": args.shards,
+        "slots": args.slots or (len(devices) if devices else 1),
+        "devices": devices,
+        "num_designs": args.num_designs,
+    }
+    triage = None
+    if args.triage or args.triage_top_k:
+        # Always top-1: a predicate alone can keep several predictions of a
+        # backbone, which align.py rejects
+        triage = {"predicate": args.triage, "top_k": 1, "rank_by": args.triage_rank_by}
+    graph = build_graph(args.state_file, sharding, args.warm_workers, triage, args.min_hotspot_coverage,
+                        rerun_md=bool({"run_md", "all"} & set(args.force)))
+    unknown = [name for name in args.force if name != "all" and name not in graph.stages]
+    if unknown:
+        parser.error(f"unknown stage(s) for --force: {', '.join(unknown)} (stages: {', '.join(graph.stages)})")
+
+    if args.stream:
+        run_streaming(graph, args)
+        return
+    if args.campaign:
+        run_campaign(args, sharding, triage)
+        return
+
+    # Skipped stages are left out; their dependents use what is already on disk
+    skip = []
+    if args.skip_rfdiffusion:
+        skip.append("rfdiffusion")
+    if args.skip_proteinmpnn_af2:
+        skip.extend(["setup_dl_binder_design", "proteinmpnn_af2"])
+    if args.skip_analysis:
+        skip.extend(ANALYSIS_STAGES)
+
+    results = graph.run(skip=skip, force=args.force, jobs=args.jobs, dry_run=args.dry_run)
+    if args.dry_run:
+        return
+
+    failed = [name for name, status in results.items() if status in ("failed", "blocked")]
+    if failed:
+        print(f"Pipeline stopped: {', '.join(failed)} did not complete. Rerun to resume from the failed stages.")
+        sys.exit(1)
     print("Pipeline completed successfully!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Long-lived model workers for the dl_binder_design stages.
+
+A worker is started once (normally inside the dl_binder_design container),
+imports its libraries, then serves jobs until told to stop, so later rounds
+skip container startup, conda activation and library imports. The models
+are not kept: each job runs the upstream script afresh, which loads its
+weights, compiles (JAX) and initializes PyRosetta again.
+
+Jobs are exchanged through a spool directory:
+
+    spool/jobs/<job_id>.json      submitted by the client (written atomically)
+    spool/claimed/<job_id>.json   moved there, with its id, by the worker that takes the job
+    spool/done/<job_id>.json      result: status, error, elapsed_s, outputs
+    spool/workers/<worker>.json   heartbeat of every live worker
+    spool/STOP                    workers exit once their current job is done
+
+A job names an input folder of PDBs and an output folder. Workers pass a
+per-job checkpoint in the output folder to the upstream scripts, so a job
+resubmitted after a crash resumes instead of starting over. A client
+waiting for a job puts it back in the queue when the worker running it
+stops sending heartbeats, and gives up once no worker of its kind is left.
+The 'local' backend is a stand-in that follows the same protocol without
+any models, for tests and CPU-only machines.
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import runpy
+import shutil
+import socket
+import argparse
+import threading
+import subprocess
+
+JOB_KINDS = ('proteinmpnn', 'af2')
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_STALE = 30.0
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Default way to start a warm worker: a detached dl_binder_design container
+# with the project mounted at the same path, so job paths need no mapping
+WORKER_LAUNCHER = [
+    "docker", "run", "-d", "--rm", "--gpus", "device={device}", "--name", "dl_binder_worker_{kind}",
+    "--entrypoint", "/bin/bash", "-v", "{project_root}:{project_root}", "-w", "{project_root}",
+    "dl_binder_design", "-c",
+    "source /opt/conda/etc/profile.d/conda.sh && conda activate {conda_env} && "
+    "python -u {project_root}/src/model_worker.py serve {spool} --kind {kind} --backend dl_binder_design",
+]
+CONDA_ENVS = {'proteinmpnn': 'proteinmpnn_binder_design', 'af2': 'af2_binder_design'}
+
+
+# -- Spool helpers ------------------------------------------------------------
+
+def _spool_dirs(spool):
+    dirs = {name: os.path.join(spool, name) for name in ('jobs', 'claimed', 'done', 'workers')}
+    for path in dirs.values():
+        os.makedirs(path, exist_ok=True)
+    return dirs
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def live_workers(spool, kind=None, max_age=HEARTBEAT_STALE):
+    """Heartbeats of workers seen within max_age seconds, optionally of one kind."""
+    workers = []
+    for path in glob.glob(os.path.join(spool, 'workers', '*.json')):
+        heartbeat = _read_json(path)
+        if heartbeat is None or time.time() - heartbeat.get('last_seen', 0) > max_age:
+            continue
+        if kind is None or heartbeat.get('kind') == kind:
+            workers.append(heartbeat)
+    return workers
+
+
+# -- Client -------------------------------------------------------------------
+
+def submit_job(spool, kind, input_dir, output_dir, options=None):
+    """Queue a job and return its id. Job ids sort in submission order."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind {kind!r}, expected one of {', '.join(JOB_KINDS)}")
+    dirs = _spool_dirs(spool)
+    job_id = f"{time.time():.6f}_{os.getpid()}_{kind}"
+    _write_json(os.path.join(dirs['jobs'], job_id + '.json'), {
+        'job_id': job_id,
+        'kind': kind,
+        'input_dir': os.path.abspath(input_dir),
+        'output_dir': os.path.abspath(output_dir),
+        'options': options or {},
+        'submitted': time.time(),
+    })
+    return job_id
+
+
+def wait_for_job(spool, job_id, timeout=None, poll_interval=1.0):
+    """
+    Block until the job's result is written and return it.
+
+    A job claimed by a worker whose heartbeat went stale is moved back to the
+    queue, where another worker resumes it from its checkpoint. Raises
+    RuntimeError if the job is waiting and no worker of its kind is alive.
+    """
+    dirs = _spool_dirs(spool)
+    kind = job_id.rsplit('_', 1)[-1]
+    done_path = os.path.join(dirs['done'], job_id + '.json')
+    claimed_path = os.path.join(dirs['claimed'], job_id + '.json')
+    start_time = time.time()
+    while True:
+        result = _read_json(done_path)
+        if result is not None:
+            return result
+        job = _read_json(claimed_path)
+        if job is not None:
+            if job.get('worker') not in {heartbeat['worker'] for heartbeat in live_workers(spool)}:
+                try:
+                    os.replace(claimed_path, os.path.join(dirs['jobs'], job_id + '.json'))
+                    print(f"Worker {job.get('worker')} stopped responding, job {job_id} requeued")
+                except OSError:
+                    pass  # Finished or requeued meanwhile
+        elif not live_workers(spool, kind):
+            result = _read_json(done_path)
+            if result is not None:
+                return result
+            raise RuntimeError(f"No live {kind} worker on {spool} to run job {job_id}")
+        if timeout is not None and time.time() - start_time > timeout:
+            raise TimeoutError(f"Job {job_id} not finished after {timeout} s")
+        time.sleep(poll_interval)
+
+
+def run_job(spool, kind, input_dir, output_dir, options=None, timeout=None, poll_interval=1.0):
+    """Submit a job, wait for it and raise if the worker reports an error."""
+    job_id = submit_job(spool, kind, input_dir, output_dir, options)
+    result = wait_for_job(spool, job_id, timeout, poll_interval)
+    if result['status'] != 'ok':
+        raise RuntimeError(f"{kind} job {job_id} failed: {result.get('error')}")
+    print(f"{kind} job finished in {result['elapsed_s']} s ({result['outputs']} outputs, "
+          f"worker {result['worker']})")
+    return result
+
+
+def ensure_worker(spool, kind, launcher=None, fields=None, startup_timeout=600):
+    """
+    Start a worker for `kind` unless a live one is already serving the spool.
+
+    Args:
+        spool: Spool directory shared with the worker.
+        kind: 'proteinmpnn' or 'af2'.
+        launcher: Command template starting the worker in the background;
+            defaults to WORKER_LAUNCHER.
+        fields: Extra template fields (e.g. device).
+        startup_timeout: Seconds to wait for the worker's first heartbeat.
+
+    Returns:
+        True if a new worker was started, False if one was reused.
+    """
+    _spool_dirs(spool)
+    if live_workers(spool, kind):
+        print(f"Reusing warm {kind} worker on {spool}")
+        return False
+
+    stop_path = os.path.join(spool, 'STOP')
+    if os.path.exists(stop_path):
+        os.remove(stop_path)
+    template = launcher or WORKER_LAUNCHER
+    values = dict({'device': 'all'}, **(fields or {}))
+    values.update(kind=kind, spool=os.path.abspath(spool), project_root=project_root,
+                  conda_env=CONDA_ENVS[kind], python=sys.executable)
+    command = [argument.format(**values) for argument in template]
+    print(f"Starting {kind} worker: {' '.join(command)}")
+    with open(os.path.join(spool, f'{kind}_worker.log'), 'a') as log_file:
+        # A new session keeps the worker alive after the orchestrator exits
+        subprocess.Popen(command, start_new_session=True, stdout=log_file, stderr=subprocess.STDOUT)
+
+    start_time = time.time()
+    while not live_workers(spool, kind):
+        if time.time() - start_time > startup_timeout:
+            raise TimeoutError(f"No {kind} worker heartbeat on {spool} after {startup_timeout} s")
+        time.sleep(1.0)
+    return True
+
+
+def stop_workers(spool):
+    """Ask every worker on the spool to exit after its current job."""
+    _spool_dirs(spool)
+    open(os.path.join(spool, 'STOP'), 'w').close()
+
+
+# -- Backends -----------------------------------------------------------------
+
+def _pdb_stems(folder):
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(folder) if name.endswith('.pdb'))
+
+
+def _read_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, 'r') as checkpoint_file:
+            return {line.strip() for line in checkpoint_file if line.strip()}
+    except OSError:
+        return set()
+
+
+class LocalBackend:
+    """Stand-in for the real models: writes placeholder outputs with the same names."""
+
+    def __init__(self, kind, load_delay=0.0):
+        self.kind = kind
+        self.load_delay = load_delay
+
+    def load(self):
+        time.sleep(self.load_delay)  # Stands in for imports and parameter loading
+
+    def run(self, job):
+        input_dir, output_dir = job['input_dir'], job['output_dir']
+        checkpoint_path = os.path.join(output_dir, 'check.point')
+        finished = _read_checkpoint(checkpoint_path)
+        score_path = os.path.join(output_dir, 'out.sc')
+        outputs = 0
+        for stem in _pdb_stems(input_dir):
+            if stem in finished:
+                continue
+            source = os.path.join(input_dir, stem + '.pdb')
+            if self.kind == 'proteinmpnn':
+                for index in range(int(job['options'].get('seqs_per_struct', 4))):
+                    shutil.copyfile(source, os.path.join(output_dir, f"{stem}_dldesign_{index}.pdb"))
+                    outputs += 1
+            else:
+                shutil.copyfile(source, os.path.join(output_dir, f"{stem}_af2pred.pdb"))
+                new_file = not os.path.exists(score_path)
+                with open(score_path, 'a') as score_file:
+                    if new_file:
+                        score_file.write("SCORE: binder_aligned_rmsd description\n")
+                    score_file.write(f"SCORE: 0.000 {stem}_af2pred\n")
+                outputs += 1
+            with open(checkpoint_path, 'a') as checkpoint_file:
+                checkpoint_file.write(stem + '\n')
+        return outputs
+
+
+class DlBinderDesignBackend:
+    """
+    Runs the dl_binder_design scripts inside the worker process.
+
+    Only the library imports are shared between jobs: every run of the
+    script loads the model weights and initializes PyRosetta itself.
+    """
+
+    SCRIPTS = {
+        'proteinmpnn': '/app/mpnn_fr/dl_interface_design.py',
+        'af2': '/app/af2_initial_guess/predict.py',
+    }
+    PRELOAD = {
+        'proteinmpnn': ('torch', 'pyrosetta'),
+        'af2': ('jax', 'haiku', 'pyrosetta'),
+    }
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.script = self.SCRIPTS[kind]
+
+    def load(self):
+        # Import the heavy libraries once; every job's run of the script then
+        # finds them in sys.modules
+        sys.path.insert(0, os.path.dirname(self.script))
+        for module in self.PRELOAD[self.kind]:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+
+    def run(self, job):
+        output_dir = job['output_dir']
+        argv = [self.script, '-pdbdir', job['input_dir'], '-outpdbdir', output_dir,
+                '-checkpoint_name', os.path.join(output_dir, 'check.point')]
+        if self.kind == 'proteinmpnn':
+            argv += ['-relax_cycles', str(job['options'].get('relax_cycles', 0)),
+                     '-seqs_per_struct', str(job['options'].get('seqs_per_struct', 4))]
+        else:
+            argv += ['-scorefilename', os.path.join(output_dir, 'out.sc')]
+
+        before = len(_pdb_stems(output_dir))
+        saved_argv, saved_cwd = sys.argv, os.getcwd()
+        sys.argv = argv
+        os.chdir(output_dir)
+        try:
+            runpy.run_path(self.script, run_name='__main__')
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                raise RuntimeError(f"{os.path.basename(self.script)} exited with {e.code}")
+        finally:
+            sys.argv = saved_argv
+            os.chdir(saved_cwd)
+        return len(_pdb_stems(output_dir)) - before
+
+
+def make_backend(name, kind, load_delay=0.0):
+    if name == 'local':
+        return LocalBackend(kind, load_delay)
+    if name == 'dl_binder_design':
+        return DlBinderDesignBackend(kind)
+    raise ValueError(f"Unknown backend {name!r}")
+
+
+# -- Worker -------------------------------------------------------------------
+
+class Worker:
+    """Serve jobs of one kind from a spool directory until STOP appears."""
+
+    def __init__(self, spool, kind, backend, poll_interval=1.0):
+        self.spool = spool
+        self.kind = kind
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.dirs = _spool_dirs(spool)
+        self.worker_id = f"{socket.gethostname()}_{os.getpid()}_{kind}"
+        self.heartbeat_path = os.path.join(self.dirs['workers'], self.worker_id + '.json')
+        self.state = {'worker': self.worker_id, 'kind': kind, 'pid': os.getpid(),
+                      'started': time.time(), 'jobs_done': 0, 'current_job': None}
+        self._stop = threading.Event()
+
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            self.state['last_seen'] = time.time()
+            _write_json(self.heartbeat_path, self.state)
+            self._stop.wait(HEARTBEAT_INTERVAL)
+
+    def _requeue_orphans(self):
+        # Jobs claimed by a worker that is no longer alive go back to the queue,
+        # including claims interrupted before the job file got its worker id
+        alive = {heartbeat['worker'] for heartbeat in live_workers(self.spool)}
+        for path in glob.glob(os.path.join(self.dirs['claimed'], '*.json')):
+            job = _read_json(path)
+            if job is not None and job.get('worker') not in alive:
+                os.replace(path, os.path.join(self.dirs['jobs'], os.path.basename(path)))
+        for path in glob.glob(os.path.join(self.dirs['claimed'], '*.json.*.claim')):
+            name, _, worker = os.path.basename(path)[:-len('.claim')].partition('.json.')
+            if worker not in alive:
+                os.replace(path, os.path.join(self.dirs['jobs'], name + '.json'))
+
+    def _claim(self):
+        for name in sorted(os.listdir(self.dirs['jobs'])):
+            if not name.endswith('.json'):
+                continue
+            job = _read_json(os.path.join(self.dirs['jobs'], name))
+            if job is None or job.get('kind') != self.kind:
+                continue
+            # Take the job under a name _requeue_orphans and waiting clients
+            # ignore, add the worker id, then move it into place, so a job in
+            # claimed/ always names the worker running it
+            claimed_path = os.path.join(self.dirs['claimed'], name)
+            claim_path = f"{claimed_path}.{self.worker_id}.claim"
+            try:
+                os.rename(os.path.join(self.dirs['jobs'], name), claim_path)
+            except OSError:
+                continue  # Another worker was faster
+            job['worker'] = self.worker_id
+            with open(claim_path, 'w') as claim_file:
+                json.dump(job, claim_file, indent=1)
+            os.replace(claim_path, claimed_path)
+            return job, claimed_path
+        return None, None
+
+    def _process(self, job):
+        start_time = time.time()
+        result = {'job_id': job['job_id'], 'kind': self.kind, 'worker': self.worker_id}
+        try:
+            os.makedirs(job['output_dir'], exist_ok=True)
+            result['outputs'] = self.backend.run(job)
+            result['status'] = 'ok'
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = f"{type(e).__name__}: {e}"
+            result['outputs'] = 0
+        result['elapsed_s'] = round(time.time() - start_time, 3)
+        return result
+
+    def serve(self):
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        load_start = time.time()
+        self.backend.load()
+        self.state['load_s'] = round(time.time() - load_start, 3)
+        print(f"Worker {self.worker_id} ready after {self.state['load_s']} s")
+        self._requeue_orphans()
+
+        stop_path = os.path.join(self.spool, 'STOP')
+        try:
+            while not os.path.exists(stop_path):
+                job, claimed_path = self._claim()
+                if job is None:
+                    time.sleep(self.poll_interval)
+                    continue
+                self.state['current_job'] = job['job_id']
+                result = self._process(job)
+                _write_json(os.path.join(self.dirs['done'], job['job_id'] + '.json'), result)
+                os.remove(claimed_path)
+                self.state['current_job'] = None
+                self.state['jobs_done'] += 1
+                print(f"Job {job['job_id']}: {result['status']} in {result['elapsed_s']} s")
+        finally:
+            self._stop.set()
+            heartbeat.join()
+            if os.path.exists(self.heartbeat_path):
+                os.remove(self.heartbeat_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm ProteinMPNN/AF2 worker serving jobs from a spool directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run a worker in the foreground")
+    serve_parser.add_argument("spool")
+    serve_parser.add_argument("--kind", choices=JOB_KINDS, required=True)
+    serve_parser.add_argument("--backend", choices=["dl_binder_design", "local"], default="dl_binder_design")
+    serve_parser.add_argument("--load-delay", type=float, default=0.0,
+                              help="Seconds the local backend pretends to spend loading models")
+    serve_parser.add_argument("--poll-interval", type=float, default=1.0)
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a job and wait for its result")
+    submit_parser.add_argument("spool")
+    submit_parser.add_argument("kind", choices=JOB_KINDS)
+    submit_parser.add_argument("input_dir")
+    submit_parser.add_argument("output_dir")
+    submit_parser.add_argument("--timeout", type=float, default=None)
+
+    status_parser = subparsers.add_parser("status", help="List live workers and queued jobs")
+    status_parser.add_argument("spool")
+
+    stop_parser = subparsers.add_parser("stop", help="Ask all workers on the spool to exit")
+    stop_parser.add_argument("spool")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        Worker(args.spool, args.kind, make_backend(args.backend, args.kind, args.load_delay),
+               args.poll_interval).serve()
+    elif args.command == "submit":
+        try:
+            run_job(args.spool, args.kind, args.input_dir, args.output_dir, timeout=args.timeout)
+        except (RuntimeError, TimeoutError) as e:
+            print(e)
+            sys.exit(1)
+    elif args.command == "status":
+        dirs = _spool_dirs(args.spool)
+        for heartbeat in live_workers(args.spool):
+            print(f"{heartbeat['worker']}: {heartbeat['kind']}, {heartbeat['jobs_done']} jobs done, "
+                  f"current job {heartbeat['current_job']}")
+        print(f"{len(os.listdir(dirs['jobs']))} queued, {len(os.listdir(dirs['claimed']))} running")
+    else:
+        stop_workers(args.spool)
+        print(f"Stop requested for workers on {args.spool}")
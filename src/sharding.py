@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Sharded launches of the GPU stages.
+
+A design budget (RFdiffusion) or a folder of inputs (ProteinMPNN, AF2) is
+split into shards. Each shard gets its own output folder, seed range and
+output prefix, so shards never write to the same files, and shards run
+concurrently up to a number of slots. Every slot is bound to one device
+from a pool, so a node with several GPUs runs one container per GPU. When
+all shards finish, their outputs are merged into a single output folder.
+
+The launcher is a command template formatted with the shard's fields
+({shard}, {device}, {num_designs}, {design_startnum}, {output_prefix},
+{input_dir}, {output_dir}, {seqs_per_struct}, ...). The defaults run the same Docker
+containers as run_rfdiff.sh and pipeline.sh; any other command (e.g. a
+stub that writes fake PDBs) can be used to test sharding on a CPU box.
+"""
+
+import os
+import sys
+import glob
+import time
+import shlex
+import shutil
+import argparse
+import subprocess
+from queue import Queue
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+src_dir = Path(__file__).resolve().parent
+analysis_dir = src_dir / "analysis"
+if str(analysis_dir) not in sys.path:
+    sys.path.append(str(analysis_dir))
+
+from file_links import link_or_copy
+
+RFDIFFUSION_LAUNCHER = [
+    "docker", "run", "--rm", "--gpus", "device={device}",
+    "-v", "{model_dir}:/app/models",
+    "-v", "{input_dir}:/app/inputs",
+    "-v", "{output_dir}:/app/outputs",
+    "rfdiffusion",
+    "inference.output_prefix=/app/outputs/{output_prefix}",
+    "inference.model_directory_path=/app/models",
+    "inference.input_pdb=/app/inputs/cd20.pdb",
+    "inference.num_designs={num_designs}",
+    "inference.design_startnum={design_startnum}",
+    "inference.deterministic=True",
+    "inference.ckpt_override_path=/app/models/Complex_base_ckpt.pt",
+    "contigmap.contigs=[C46-210/0 D46-210/0 80-80]",
+    "ppi.hotspot_res=[C168,C169,C170,C171,C172,C173,C174,C175,D168,D169,D170,D171,D172,D173,D174,D175]",
+]
+
+PROTEINMPNN_LAUNCHER = [
+    "docker", "run", "--rm", "--gpus", "device={device}", "--entrypoint", "/bin/bash",
+    "-v", "{input_dir}:/app/inputs",
+    "-v", "{output_dir}:/app/outputs",
+    "dl_binder_design", "-c",
+    "source /opt/conda/etc/profile.d/conda.sh && conda activate proteinmpnn_binder_design && "
+    "python -u /app/mpnn_fr/dl_interface_design.py -pdbdir /app/inputs -relax_cycles 0 "
+    "-seqs_per_struct {seqs_per_struct} -outpdbdir /app/outputs -checkpoint_name /app/outputs/check.point",
+]
+
+AF2_LAUNCHER = [
+    "docker", "run", "--rm", "--gpus", "device={device}", "--entrypoint", "/bin/bash",
+    "-v", "{input_dir}:/app/inputs",
+    "-v", "{output_dir}:/app/outputs",
+    "dl_binder_design", "-c",
+    "source /opt/conda/etc/profile.d/conda.sh && conda activate af2_binder_design && "
+    "python -u /app/af2_initial_guess/predict.py -pdbdir /app/inputs -outpdbdir /app/outputs "
+    "-scorefilename /app/outputs/out.sc -checkpoint_name /app/outputs/check.point",
+]
+
+SCORE_FILE = "out.sc"
+
+# ProteinMPNN sequences per backbone, as in beta_model_mpnn.py
+DEFAULT_SEQS_PER_STRUCT = 4
+
+
+def plan_rfdiffusion_shards(num_designs, num_shards, work_dir, prefix="binder_design_rfdiff", base_seed=0):
+    """
+    Split an RFdiffusion design budget into shards.
+
+    RFdiffusion seeds design i with i when inference.deterministic is set, so
+    giving each shard its own design_startnum gives it its own seed range.
+
+    Returns:
+        List of shard dicts with shard, num_designs, design_startnum,
+        seed_range, output_prefix and output_dir.
+    """
+    num_shards = max(1, min(num_shards, num_designs))
+    shards = []
+    start = base_seed
+    for shard in range(num_shards):
+        count = num_designs // num_shards + (1 if shard < num_designs % num_shards else 0)
+        shards.append({
+            'shard': shard,
+            'num_designs': count,
+            'design_startnum': start,
+            'seed_range': [start, start + count - 1],
+            'output_prefix': f"{prefix}_s{shard}",
+            'output_dir': os.path.abspath(os.path.join(work_dir, f"shard_{shard}")),
+        })
+        start += count
+    return shards
+
+
+def plan_directory_shards(input_dir, num_shards, work_dir, pattern="*.pdb"):
+    """
+    Split the files of an input folder into shards of (nearly) equal size.
+
+    Each shard gets an input folder holding links to its files, and its own
+    output folder, so per-run files such as check.point never collide.
+    Shard folders left in work_dir by an earlier run are removed first: the
+    split depends on the current file list and shard count, and their stale
+    outputs (PDBs, out.sc rows) would otherwise be merged with the new ones.
+    """
+    files = sorted(glob.glob(os.path.join(input_dir, pattern)))
+    num_shards = max(1, min(num_shards, len(files)))
+    for stale_dir in glob.glob(os.path.join(work_dir, "shard_*")):
+        shutil.rmtree(stale_dir)
+    shards = []
+    for shard in range(num_shards):
+        shard_dir = os.path.abspath(os.path.join(work_dir, f"shard_{shard}"))
+        shard_input = os.path.join(shard_dir, "input")
+        os.makedirs(shard_input)
+        shard_files = files[shard::num_shards]
+        for path in shard_files:
+            link_or_copy(path, os.path.join(shard_input, os.path.basename(path)))
+        shards.append({
+            'shard': shard,
+            'num_inputs': len(shard_files),
+            'input_dir': shard_input,
+            'output_dir': os.path.join(shard_dir, "output"),
+        })
+    return shards
+
+
+def _run_shard(shard, launcher, devices, log_dir):
+    device = devices.get()  # Blocks until a device is free
+    try:
+        fields = dict(shard, device=device)
+        command = [argument.format(**fields) for argument in launcher]
+        os.makedirs(shard['output_dir'], exist_ok=True)
+        log_path = os.path.join(log_dir, f"shard_{shard['shard']}.log")
+        start_time = time.time()
+        with open(log_path, 'w') as log_file:
+            result = subprocess.run(command, stdout=log_file, stderr=subprocess.STDOUT,
+                                    cwd=shard['output_dir'])
+        return {'shard': shard['shard'], 'device': device, 'returncode': result.returncode,
+                'elapsed_s': round(time.time() - start_time, 1), 'log': log_path}
+    finally:
+        devices.put(device)
+
+
+def run_shards(shards, launcher, slots=1, devices=None, log_dir=None):
+    """
+    Run one launcher command per shard, at most `slots` at a time.
+
+    Args:
+        shards: Shard dicts from one of the plan_* functions, plus any extra
+            template fields (e.g. model_dir).
+        launcher: Command template (list of arguments).
+        slots: Maximum number of shards running at once.
+        devices: Device ids handed out to running shards, one per slot. The
+            default hands out 'all' to every slot.
+        log_dir: Where each shard's output is logged (default: next to its outputs).
+
+    Returns:
+        Per-shard results (returncode, device, elapsed_s, log) in shard order.
+    """
+    devices = list(devices) if devices else ['all'] * slots
+    slots = max(1, min(slots, len(devices)))
+    free_devices = Queue()
+    for device in devices[:slots]:
+        free_devices.put(device)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=slots) as executor:
+        futures = [executor.submit(_run_shard, shard, launcher, free_devices,
+                                   log_dir or os.path.dirname(shard['output_dir']))
+                   for shard in shards]
+        for future in futures:
+            result = future.result()
+            status = "ok" if result['returncode'] == 0 else f"failed (exit {result['returncode']})"
+            print(f"Shard {result['shard']} on device {result['device']}: {status} in {result['elapsed_s']} s")
+            results.append(result)
+    return results
+
+
+def merge_shard_outputs(shards, output_dir, patterns=("*.pdb",), score_file=SCORE_FILE, link_mode='auto'):
+    """
+    Gather the shards' outputs into one folder.
+
+    Files matching `patterns` are linked (or copied) into output_dir; a name
+    produced by two shards is an error, since prefixes are meant to keep them
+    apart. Score files are concatenated into output_dir/score_file with a
+    single copy of each repeated header line.
+
+    Returns:
+        Number of files merged.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sources = {}
+    for shard in shards:
+        for pattern in patterns:
+            for path in sorted(glob.glob(os.path.join(shard['output_dir'], pattern))):
+                name = os.path.basename(path)
+                if name in sources:
+                    raise ValueError(f"{name} was produced by shards {sources[name][0]} and {shard['shard']}")
+                sources[name] = (shard['shard'], path)
+
+    for name, (_, path) in sources.items():
+        link_or_copy(path, os.path.join(output_dir, name), link_mode)
+
+    score_paths = [os.path.join(shard['output_dir'], score_file) for shard in shards]
+    score_paths = [path for path in score_paths if os.path.isfile(path)]
+    if score_paths:
+        merged_path = os.path.join(output_dir, score_file)
+        tmp_path = f"{merged_path}.{os.getpid()}.tmp"
+        headers = set()
+        with open(tmp_path, 'w') as merged_file:
+            for path in score_paths:
+                with open(path, 'r') as shard_scores:
+                    for line in shard_scores:
+                        if 'description' in line.split():
+                            if line in headers:
+                                continue
+                            headers.add(line)
+                        merged_file.write(line if line.endswith('\n') else line + '\n')
+        os.replace(tmp_path, merged_path)
+    return len(sources)
+
+
+def run_sharded_rfdiffusion(num_designs, num_shards, input_dir, output_dir, model_dir, work_dir,
+                            slots=1, devices=None, launcher=None, prefix="binder_design_rfdiff", base_seed=0):
+    """Run RFdiffusion in shards and merge the designs (.pdb and .trb) into output_dir."""
+    shards = plan_rfdiffusion_shards(num_designs, num_shards, work_dir, prefix, base_seed)
+    for shard in shards:
+        shard['input_dir'] = os.path.abspath(input_dir)
+        shard['model_dir'] = os.path.abspath(model_dir)
+        print(f"Shard {shard['shard']}: {shard['num_designs']} designs, seeds "
+              f"{shard['seed_range'][0]}-{shard['seed_range'][1]}, prefix {shard['output_prefix']}")
+    results = run_shards(shards, launcher or RFDIFFUSION_LAUNCHER, slots, devices)
+    merged = merge_shard_outputs(shards, output_dir, patterns=("*.pdb", "*.trb"))
+    print(f"Merged {merged} files from {len(shards)} shards into {output_dir}")
+    return results
+
+
+def run_sharded_directory(input_dir, output_dir, work_dir, launcher, num_shards, slots=1, devices=None, fields=None):
+    """
+    Run a folder-in/folder-out stage (ProteinMPNN, AF2) in shards and merge the outputs.
+
+    fields are extra launcher template fields, e.g. {'seqs_per_struct': 8}.
+    """
+    shards = plan_directory_shards(input_dir, num_shards, work_dir)
+    for shard in shards:
+        shard.update(dict({'seqs_per_struct': DEFAULT_SEQS_PER_STRUCT}, **(fields or {})))
+    results = run_shards(shards, launcher, slots, devices)
+    merged = merge_shard_outputs(shards, output_dir)
+    print(f"Merged {merged} files from {len(shards)} shards into {output_dir}")
+    return results
+
+
+def check_results(results):
+    """Raise if any shard failed, naming the logs to look at."""
+    failed = [result for result in results if result['returncode'] != 0]
+    if failed:
+        raise RuntimeError("shards failed: " + ", ".join(
+            f"{result['shard']} (exit {result['returncode']}, see {result['log']})" for result in failed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run RFdiffusion, ProteinMPNN or AF2 in concurrent shards")
+    parser.add_argument("stage", choices=["rfdiffusion", "proteinmpnn", "af2"])
+    parser.add_argument("input_dir", help="RFdiffusion: folder holding cd20.pdb; otherwise the input PDB folder")
+    parser.add_argument("output_dir", help="Folder the shards' outputs are merged into")
+    parser.add_argument("--work-dir", default=None, help="Per-shard folders (default: <output_dir>_shards)")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=None, help="Shards running at once (default: one per device)")
+    parser.add_argument("--devices", default=None, help="Comma-separated GPU ids handed out to slots, e.g. 0,1,2,3")
+    parser.add_argument("--launcher", default=None,
+                        help="Command template replacing the default docker command (fields: {shard}, {device}, "
+                             "{input_dir}, {output_dir}, {num_designs}, {design_startnum}, {output_prefix}, ...)")
+    parser.add_argument("--num-designs", type=int, default=100, help="RFdiffusion design budget")
+    parser.add_argument("--model-dir", default="models", help="RFdiffusion model weights")
+    parser.add_argument("--prefix", default="binder_design_rfdiff", help="RFdiffusion output prefix")
+    parser.add_argument("--base-seed", type=int, default=0, help="First RFdiffusion design number / seed")
+    parser.add_argument("--seqs-per-struct", type=int, default=DEFAULT_SEQS_PER_STRUCT,
+                        help="ProteinMPNN sequences designed per backbone")
+    args = parser.parse_args()
+
+    devices = args.devices.split(',') if args.devices else None
+    slots = args.slots or (len(devices) if devices else 1)
+    launcher = shlex.split(args.launcher) if args.launcher else None
+    work_dir = args.work_dir or args.output_dir.rstrip('/') + "_shards"
+
+    if args.stage == "rfdiffusion":
+        results = run_sharded_rfdiffusion(args.num_designs, args.shards, args.input_dir, args.output_dir,
+                                          args.model_dir, work_dir, slots, devices, launcher,
+                                          args.prefix, args.base_seed)
+    else:
+        default_launcher = PROTEINMPNN_LAUNCHER if args.stage == "proteinmpnn" else AF2_LAUNCHER
+        results = run_sharded_directory(args.input_dir, args.output_dir, work_dir,
+                                        launcher or default_launcher, args.shards, slots, devices,
+                                        {'seqs_per_struct': args.seqs_per_struct})
+    try:
+        check_results(results)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
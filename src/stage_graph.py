@@ -0,0 +1,287 @@
+"""
+Dependency-aware stage runner for the pipeline orchestrator.
+
+Each stage declares the files or directories it reads and writes, the
+parameters that affect its result, and the stages it depends on. Before a
+stage runs, a stamp is computed from those declarations; if it matches the
+stamp recorded in the state file after the last successful run and every
+declared output still exists, the stage is skipped. Stages whose
+dependencies are satisfied run concurrently in a thread pool.
+"""
+
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STATE_VERSION = 1
+
+
+class Stage:
+    """A unit of work in the pipeline graph."""
+
+    def __init__(self, name, action, inputs=(), outputs=(), deps=(), params=None):
+        """
+        Args:
+            name: Unique stage name.
+            action: Callable run with no arguments; raising marks the stage failed.
+            inputs: Files, directories or glob patterns the stage reads.
+            outputs: Files or directories the stage must leave behind.
+            deps: Names of stages that have to finish first.
+            params: JSON-serializable settings that change the stage's result.
+        """
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+
+
+class StageGraph:
+    """A set of stages run in dependency order with up-to-date checks."""
+
+    def __init__(self, state_path, root='.', monitor=None):
+        """
+        Args:
+            state_path: JSON file recording the stamp of each successful stage.
+            root: Directory that relative input and output paths are resolved against.
+            monitor: Optional callable taking a stage name and returning a
+                context manager entered around the stage's action, e.g. to
+                record its resource use.
+        """
+        self.state_path = state_path
+        self.root = root
+        self.monitor = monitor
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    # -- State file ---------------------------------------------------------
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return {'version': STATE_VERSION, 'stages': {}, 'files': {}}
+        if state.get('version') != STATE_VERSION:
+            return {'version': STATE_VERSION, 'stages': {}, 'files': {}}
+        return state
+
+    def _save_state(self):
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self._state, state_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    # -- Stamps -------------------------------------------------------------
+
+    def _path(self, path):
+        return path if os.path.isabs(path) else os.path.join(self.root, path)
+
+    def _file_digest(self, path):
+        """Content hash of a file, reusing the recorded hash while size and mtime match."""
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._state['files'].get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b''):
+                digest.update(block)
+        with self._lock:
+            self._state['files'][path] = {
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()
+            }
+        return digest.hexdigest()
+
+    def _dir_digest(self, path):
+        """Hash of a directory listing: relative names, sizes and mtimes of all files."""
+        digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue  # Removed while walking
+                relative = os.path.relpath(file_path, path)
+                digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def _input_digests(self, stage):
+        digests = {}
+        for pattern in stage.inputs:
+            matches = sorted(glob.glob(self._path(pattern)))
+            if not matches:
+                digests[pattern] = None
+            for path in matches:
+                if os.path.isdir(path):
+                    digests[path] = 'dir:' + self._dir_digest(path)
+                else:
+                    digests[path] = 'file:' + self._file_digest(path)
+        return digests
+
+    def stamp(self, stage):
+        """Stamp covering a stage's parameters, inputs and its dependencies' stamps."""
+        with self._lock:
+            recorded = self._state['stages']
+            dep_stamps = {dep: recorded.get(dep, {}).get('stamp') for dep in stage.deps}
+        payload = {
+            'params': stage.params,
+            'inputs': self._input_digests(stage),
+            'deps': dep_stamps,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def missing_inputs(self, stage):
+        return [pattern for pattern in stage.inputs if not glob.glob(self._path(pattern))]
+
+    def is_up_to_date(self, stage):
+        with self._lock:
+            recorded = self._state['stages'].get(stage.name)
+        if not recorded or recorded.get('status') != 'ok':
+            return False
+        if any(not os.path.exists(self._path(output)) for output in stage.outputs):
+            return False
+        return recorded.get('stamp') == self.stamp(stage)
+
+    # -- Execution ----------------------------------------------------------
+
+    def _order(self):
+        """Stage names in a valid dependency order; raises on unknown deps or cycles."""
+        order, visiting, done = [], set(), set()
+
+        def visit(name, chain):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError("Dependency cycle: " + " -> ".join(chain + [name]))
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}' required by {chain[-1] if chain else 'caller'}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep, chain + [name])
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def _run_stage(self, stage, force):
+        if not force and self.is_up_to_date(stage):
+            return 'up-to-date', 0.0
+
+        missing = self.missing_inputs(stage)
+        if missing:
+            raise FileNotFoundError(f"missing inputs: {', '.join(missing)}")
+
+        print(f"[{stage.name}] running")
+        start_time = time.time()
+        with self.monitor(stage.name) if self.monitor else nullcontext():
+            stage.action()
+        elapsed = time.time() - start_time
+
+        absent = [output for output in stage.outputs if not os.path.exists(self._path(output))]
+        if absent:
+            raise FileNotFoundError(f"declared outputs not produced: {', '.join(absent)}")
+        return 'ok', elapsed
+
+    def run(self, skip=(), force=(), jobs=4, dry_run=False):
+        """
+        Run every stage not listed in skip, in dependency order.
+
+        Args:
+            skip: Stage names to leave out. Their dependents still run, using
+                whatever outputs are already on disk.
+            force: Stage names to run even if up to date ('all' forces every stage).
+            jobs: Maximum number of stages running at the same time.
+            dry_run: Only report which stages would run.
+
+        Returns:
+            Dict mapping stage name to its status: 'ok', 'up-to-date',
+            'skipped', 'blocked' or 'failed'.
+        """
+        order = self._order()
+        skip = set(skip)
+        force_all = 'all' in force
+        force = set(force)
+
+        if dry_run:
+            results = {}
+            for name in order:
+                stage = self.stages[name]
+                if name in skip:
+                    results[name] = 'skipped'
+                elif force_all or name in force or not self.is_up_to_date(stage):
+                    results[name] = 'would run'
+                else:
+                    results[name] = 'up-to-date'
+                print(f"[{name}] {results[name]}")
+            return results
+
+        results = {name: 'skipped' for name in order if name in skip}
+        pending = [name for name in order if name not in skip]
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            while pending or running:
+                for name in list(pending):
+                    dep_status = [results.get(dep) for dep in self.stages[name].deps]
+                    if any(status in ('failed', 'blocked') for status in dep_status):
+                        results[name] = 'blocked'
+                        pending.remove(name)
+                        print(f"[{name}] blocked by a failed dependency")
+                    elif all(status is not None for status in dep_status):
+                        stage = self.stages[name]
+                        running[executor.submit(self._run_stage, stage, force_all or name in force)] = name
+                        pending.remove(name)
+
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    stage = self.stages[name]
+                    try:
+                        status, elapsed = future.result()
+                    except Exception as e:
+                        results[name] = 'failed'
+                        print(f"[{name}] failed: {e}")
+                        with self._lock:
+                            self._state['stages'][name] = {'status': 'failed', 'error': str(e),
+                                                           'finished': time.time()}
+                        self._save_state()
+                        continue
+
+                    results[name] = status
+                    if status == 'up-to-date':
+                        print(f"[{name}] up to date, skipped")
+                        continue
+                    # Stamp after the run: stages such as filter_pdbs change their
+                    # own inputs, and the next run should see them as current
+                    stamp = self.stamp(stage)
+                    with self._lock:
+                        self._state['stages'][name] = {'status': 'ok', 'stamp': stamp,
+                                                       'elapsed_s': round(elapsed, 3), 'finished': time.time()}
+                    self._save_state()
+                    print(f"[{name}] done in {elapsed:.1f}s")
+        return results
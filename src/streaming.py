@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Streaming execution of the per-design analysis stages.
+
+Instead of waiting for every AlphaFold2 prediction before starting the
+analysis, the AF2 output folder is watched while the GPU stages (the
+producers) are still running. A prediction is picked up as soon as both its
+PDB and its row in the score file have landed, and flows through
+filter -> align -> hotspot check -> MD. Stages are connected by bounded queues, so a slow
+stage makes the ones before it wait instead of piling up work.
+
+Every stage is a command template formatted with the design's fields, so
+the real scripts can be swapped for stub commands when testing without
+Docker or a GPU. A stage passes a design on when its command exits with 0
+and its declared output exists; REJECTED_EXIT_CODE means the design was
+filtered out, any other exit status is recorded as a failure.
+"""
+
+import os
+import sys
+import time
+import shlex
+import argparse
+import threading
+import subprocess
+from queue import Queue
+from pathlib import Path
+
+src_dir = Path(__file__).resolve().parent
+analysis_dir = src_dir / "analysis"
+if str(analysis_dir) not in sys.path:
+    sys.path.append(str(analysis_dir))
+
+from af2_scores import parse_score_lines
+from design_names import extract_base_design_name
+import telemetry
+import energy_sink
+from sharding import DEFAULT_SEQS_PER_STRUCT
+
+# Same value as filter_pdbs.REJECTED_EXIT_CODE and hotspot_filter.REJECTED_EXIT_CODE
+REJECTED_EXIT_CODE = 3
+
+# Marks the end of the stream on a queue
+_END = object()
+
+DEFAULT_COMMANDS = {
+    'filter': ["python", "{analysis_dir}/filter_pdbs.py", "{rf_pdb}"],
+    'align': ["python", "{analysis_dir}/align.py", "{rf_pdb}", "{af2_pdb}", "{cd20_pdb}", "{aligned_pdb}"],
+    'hotspots': ["python", "{analysis_dir}/hotspot_filter.py", "{aligned_pdb}", "--maps", "{contact_map}"],
+    'md': ["python", "{analysis_dir}/run_md.py", "{aligned_pdb}", "{fixed_pdb}", "{md_pdb}", "{energies_csv}",
+           "--no-compact"],
+}
+DEFAULT_OUTPUTS = {
+    'filter': None,
+    'align': "{aligned_pdb}",
+    'hotspots': None,
+    'md': "{md_pdb}",
+}
+
+
+class StreamStage:
+    """One per-design step: a command template run by a few worker threads."""
+
+    def __init__(self, name, command, output=None, workers=1):
+        """
+        Args:
+            name: Stage name used in logs and the summary.
+            command: List of arguments; each is formatted with the design's fields.
+            output: Optional path template that must exist after a successful run.
+            workers: Number of designs processed by this stage at the same time.
+        """
+        self.name = name
+        self.command = command
+        self.output = output
+        self.workers = workers
+
+
+class ScoreFileTail:
+    """Incrementally read an AF2 score file, remembering where it stopped."""
+
+    def __init__(self, score_path):
+        self.score_path = score_path
+        self.offset = 0
+        self.header = None
+        self.rows = {}
+
+    def poll(self):
+        """Read rows appended since the last poll; returns {description: {column: value}}."""
+        try:
+            with open(self.score_path, 'rb') as score_file:
+                score_file.seek(self.offset)
+                data = score_file.read()
+        except OSError:
+            return {}
+        end = data.rfind(b'\n') + 1  # Leave a partially written line for the next poll
+        self.offset += end
+        segments, self.header = parse_score_lines(data[:end].decode().splitlines(), self.header)
+        new_rows = {}
+        for header, rows in segments:
+            for values in rows:
+                row = dict(zip(header, values))
+                new_rows[row['description']] = row
+        self.rows.update(new_rows)
+        return new_rows
+
+
+def rank_value(row, rank_by):
+    """Sort key of a score row for rank_by (a column, '-' prefix for higher is better); missing ranks last."""
+    column = rank_by.lstrip('-')
+    try:
+        value = float(row[column])
+    except (KeyError, TypeError, ValueError):
+        return float('inf')
+    if value != value:  # NaN
+        return float('inf')
+    return -value if rank_by.startswith('-') else value
+
+
+def design_fields(af2_pdb, rf_dir, work_dir, cd20_pdb, energies_csv):
+    """Paths and names a stage command can refer to for one AF2 prediction."""
+    design = os.path.splitext(os.path.basename(af2_pdb))[0]
+    backbone = extract_base_design_name(design)
+    return {
+        'design': design,
+        'backbone': backbone,
+        'af2_pdb': af2_pdb,
+        'rf_pdb': os.path.join(rf_dir, backbone + '.pdb'),
+        'aligned_pdb': os.path.join(work_dir, 'aligned', design + '_aligned.pdb'),
+        'fixed_pdb': os.path.join(work_dir, 'fixed', design + '_aligned_fixed.pdb'),
+        'md_pdb': os.path.join(work_dir, 'md_output', design + '_aligned_md.pdb'),
+        'contact_map': os.path.join(work_dir, 'contact_maps', design + '_aligned.npz'),
+        'energies_csv': energies_csv,
+        'cd20_pdb': cd20_pdb,
+        'analysis_dir': str(analysis_dir),
+        'work_dir': work_dir,
+    }
+
+
+class StreamingPipeline:
+    """Watch for AF2 predictions and push each one through the analysis stages."""
+
+    def __init__(self, af2_dir, score_path, rf_dir, work_dir, cd20_pdb, stages,
+                 queue_size=8, poll_interval=5.0, failure_log_path=None,
+                 predictions_per_backbone=DEFAULT_SEQS_PER_STRUCT, rank_by='pae_interaction'):
+        self.af2_dir = af2_dir
+        self.score_tail = ScoreFileTail(score_path)
+        self.rf_dir = rf_dir
+        self.work_dir = work_dir
+        self.cd20_pdb = cd20_pdb
+        self.energies_csv = os.path.join(work_dir, 'energies.csv')
+        self.stages = stages
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.failure_log_path = failure_log_path or os.path.join(work_dir, 'stream_failures.tsv')
+        self.predictions_per_backbone = predictions_per_backbone
+        self.rank_by = rank_by
+        self.counts = {stage.name: {'passed': 0, 'rejected': 0, 'failed': 0} for stage in stages}
+        self.counts['source'] = {'queued': 0, 'not_selected': 0}
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._pending = {}  # backbone -> {design: af2_pdb}, scored but not yet released
+        self._released = set()
+
+    # -- Source -------------------------------------------------------------
+
+    def _scan(self, flush=False):
+        """
+        Best AF2 PDB of each backbone whose predictions have all been scored
+        (all backbones with a scored prediction when flush is set).
+        """
+        self.score_tail.poll()
+        try:
+            entries = sorted(os.listdir(self.af2_dir))
+        except OSError:
+            entries = []
+        for name in entries:
+            if not name.endswith('.pdb'):
+                continue
+            design = name[:-4]
+            if design in self._seen or design not in self.score_tail.rows:
+                continue
+            self._seen.add(design)
+            backbone = extract_base_design_name(design)
+            if backbone in self._released:
+                # Landed after its backbone was already sent on
+                self.counts['source']['not_selected'] += 1
+                continue
+            self._pending.setdefault(backbone, {})[design] = os.path.join(self.af2_dir, name)
+
+        ready = []
+        for backbone in sorted(self._pending):
+            predictions = self._pending[backbone]
+            if not flush and len(predictions) < self.predictions_per_backbone:
+                continue
+            # min() keeps the first of equally ranked predictions, in name order
+            best = min(sorted(predictions), key=lambda design: rank_value(self.score_tail.rows[design], self.rank_by))
+            self.counts['source']['not_selected'] += len(predictions) - 1
+            self._released.add(backbone)
+            ready.append(predictions[best])
+        for af2_pdb in ready:
+            del self._pending[extract_base_design_name(os.path.basename(af2_pdb)[:-4])]
+        return ready
+
+    def _source(self, out_queue, producers_done):
+        while True:
+            # Check before scanning so files written just before the producers
+            # exited are still picked up by this last scan
+            finished = producers_done.is_set()
+            for af2_pdb in self._scan(flush=finished):
+                item = design_fields(af2_pdb, self.rf_dir, self.work_dir, self.cd20_pdb, self.energies_csv)
+                item['score'] = self.score_tail.rows[item['design']]
+                out_queue.put(item)  # Blocks while the first stage is saturated
+                with self._lock:
+                    self.counts['source']['queued'] += 1
+            if finished:
+                break
+            producers_done.wait(self.poll_interval)
+        out_queue.put(_END)
+
+    # -- Stages -------------------------------------------------------------
+
+    def _log_failure(self, stage, item, returncode, message):
+        with self._lock:
+            with open(self.failure_log_path, 'a') as log_file:
+                log_file.write(f"{item['design']}\t{stage.name}\t{returncode}\t{message}\n")
+
+    def _run_stage_item(self, stage, item):
+        try:
+            command = [argument.format(**item) for argument in stage.command]
+            result = telemetry.run_subprocess(command, check=False, labels={'stage': stage.name, 'design': item['design']},
+                                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        except (OSError, KeyError, IndexError, ValueError) as e:
+            # Bad template or missing executable: record it and keep the worker alive
+            self._log_failure(stage, item, None, f"{type(e).__name__}: {e}")
+            return 'failed'
+        if result.returncode == REJECTED_EXIT_CODE:
+            return 'rejected'
+        if result.returncode != 0:
+            tail = ' | '.join(result.stdout.strip().splitlines()[-3:])
+            self._log_failure(stage, item, result.returncode, tail)
+            return 'failed'
+        if stage.output and not os.path.exists(stage.output.format(**item)):
+            self._log_failure(stage, item, 0, f"output not produced: {stage.output.format(**item)}")
+            return 'failed'
+        return 'passed'
+
+    def _worker(self, stage, in_queue, out_queue, remaining):
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                in_queue.put(_END)  # Let this stage's other workers see it too
+                with self._lock:
+                    remaining[stage.name] -= 1
+                    last = remaining[stage.name] == 0
+                if last and out_queue is not None:
+                    out_queue.put(_END)
+                return
+            status = self._run_stage_item(stage, item)
+            with self._lock:
+                self.counts[stage.name][status] += 1
+            print(f"[{stage.name}] {item['design']}: {status}")
+            if status == 'passed' and out_queue is not None:
+                out_queue.put(item)  # Blocks while the next stage is saturated
+
+    # -- Driver -------------------------------------------------------------
+
+    def _prepare_outputs(self):
+        for subdir in ('aligned', 'contact_maps', 'fixed', 'md_output'):
+            os.makedirs(os.path.join(self.work_dir, subdir), exist_ok=True)
+
+    def run(self, producers=()):
+        """
+        Run the producers one after another in the background while streaming
+        their AF2 outputs through the stages. With no producers, the designs
+        already on disk are processed and the run ends.
+
+        Args:
+            producers: Callables run in order, e.g. RFdiffusion then MPNN+AF2.
+
+        Returns:
+            Per-stage counts, plus 'producer_error' if a producer raised.
+        """
+        self._prepare_outputs()
+        start_time = time.time()
+        producers_done = threading.Event()
+        producer_error = []
+
+        def run_producers():
+            try:
+                for producer in producers:
+                    producer()
+            except Exception as e:
+                producer_error.append(f"{type(e).__name__}: {e}")
+            finally:
+                producers_done.set()
+
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        threads = [threading.Thread(target=run_producers, daemon=True),
+                   threading.Thread(target=self._source, args=(queues[0], producers_done), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._worker,
+                                                args=(stage, queues[index], out_queue, remaining), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Concurrent MD runs each leave their row in an energy sink shard
+        energy_sink.compact(self.energies_csv)
+
+        elapsed = time.time() - start_time
+        summary = dict(self.counts)
+        if producer_error:
+            summary['producer_error'] = producer_error[0]
+        print(f"Streamed {self.counts['source']['queued']} designs in {elapsed:.1f} s "
+              f"({self.counts['source']['not_selected']} lower-ranked predictions of their backbones left out): " + "; ".join(
+            f"{stage.name} {counts['passed']} passed, {counts['rejected']} rejected, {counts['failed']} failed"
+            for stage in self.stages for counts in [self.counts[stage.name]]))
+        if producer_error:
+            print(f"Producer failed: {producer_error[0]}")
+        return summary
+
+
+def build_stages(commands=None, workers=None):
+    """The filter -> align -> hotspots -> MD stages, with optional command or worker overrides."""
+    commands = dict(DEFAULT_COMMANDS, **(commands or {}))
+    workers = dict({'filter': 2, 'align': 2, 'hotspots': 2, 'md': 1}, **(workers or {}))
+    return [StreamStage(name, commands[name], DEFAULT_OUTPUTS[name], workers[name])
+            for name in ('filter', 'align', 'hotspots', 'md')]
+
+
+def command_producer(command):
+    """Producer that runs a shell command and raises if it fails."""
+    def producer():
+        subprocess.run(command, shell=True, check=True)
+    return producer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream AF2 predictions through filter -> align -> hotspots -> MD as they land")
+    parser.add_argument("af2_dir", help="Folder the AF2 PDBs are written to")
+    parser.add_argument("score_file", help="AF2 score file (out.sc) the predictions are recorded in")
+    parser.add_argument("rf_dir", help="RFdiffusion backbone folder")
+    parser.add_argument("work_dir", help="Where aligned/, fixed/, md_output/ and energies.csv are written")
+    parser.add_argument("--cd20", default="data/pdb/cd20.pdb", help="CD20 target PDB")
+    parser.add_argument("--producer", action="append", default=[],
+                        help="Shell command producing AF2 outputs, run in the background (repeatable, run in order)")
+    parser.add_argument("--filter-cmd", default=None, help="Override the filter command template")
+    parser.add_argument("--align-cmd", default=None, help="Override the align command template")
+    parser.add_argument("--hotspots-cmd", default=None, help="Override the hotspot check command template")
+    parser.add_argument("--md-cmd", default=None, help="Override the MD command template")
+    parser.add_argument("--filter-workers", type=int, default=2)
+    parser.add_argument("--align-workers", type=int, default=2)
+    parser.add_argument("--hotspots-workers", type=int, default=2)
+    parser.add_argument("--md-workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=8, help="Designs buffered between two stages")
+    parser.add_argument("--seqs-per-struct", type=int, default=DEFAULT_SEQS_PER_STRUCT,
+                        help="AF2 predictions per backbone; a backbone is sent on once this many are scored")
+    parser.add_argument("--rank-by", default='pae_interaction',
+                        help="Score column picking each backbone's prediction (prefix '-' for higher is better)")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between scans of the AF2 folder")
+    args = parser.parse_args()
+
+    overrides = {name: shlex.split(command) for name, command in
+                 (('filter', args.filter_cmd), ('align', args.align_cmd), ('hotspots', args.hotspots_cmd),
+                  ('md', args.md_cmd)) if command}
+    stages = build_stages(overrides, {'filter': args.filter_workers, 'align': args.align_workers,
+                                      'hotspots': args.hotspots_workers, 'md': args.md_workers})
+    pipeline = StreamingPipeline(args.af2_dir, args.score_file, args.rf_dir, args.work_dir, args.cd20, stages,
+                                 args.queue_size, args.poll_interval,
+                                 predictions_per_backbone=args.seqs_per_struct, rank_by=args.rank_by)
+    summary = pipeline.run([command_producer(command) for command in args.producer])
+    sys.exit(1 if 'producer_error' in summary else 0)